@@ -0,0 +1,155 @@
+"""Сравнение текущих парсеров nooa с прежней реализацией
+
+Обработчики отдают JSON прямо из записей токенизатора, поэтому ускорение
+измеряется по строкам json. Строки models - публичные parse_* функции,
+которые возвращают pydantic модели, как раньше, и примерно равны
+прежней реализации по скорости
+
+Запуск из корня репозитория (с переменными окружения из .env):
+PYTHONPATH=. python cmd/bench_nooa_parser.py [число повторов]
+"""
+
+import sys
+import timeit
+from datetime import datetime
+from pathlib import Path
+from typing import Callable
+
+from pydantic import TypeAdapter
+
+from internal.nooa.nooa_parser import (
+    Kp3Column,
+    Kp27Record,
+    NooaAuroraKp3Col,
+    NooaAuroraKp3RowValue,
+    NooaAuroraKp27Row,
+    parse_kp_3_forecast,
+    parse_kp_27_outlook,
+    tokenize_kp_3_forecast,
+    tokenize_kp_27_outlook,
+)
+
+TESTDATA = Path(__file__).parent.parent / "internal" / "nooa" / "testdata"
+
+
+def legacy_parse_kp_27_outlook(data: str) -> list[NooaAuroraKp27Row]:
+    res = []
+    for line in data.splitlines():
+        if line.startswith("#"):
+            continue
+        if line.startswith(":"):
+            continue
+        line = line.strip()
+        if not line:
+            continue
+        raw_date, radio_flux, planetary_index, largest_kp_index = line.rsplit(
+            maxsplit=3
+        )
+        date = datetime.strptime(raw_date, "%Y %b %d").date()
+        res.append(
+            NooaAuroraKp27Row(
+                date=date,
+                radio_flux=radio_flux,  # type: ignore
+                planetary_index=planetary_index,  # type: ignore
+                largest_kp_index=largest_kp_index,  # type: ignore
+            )
+        )
+    return res
+
+
+def legacy_parse_kp_3_forecast(data: str) -> list[NooaAuroraKp3Col]:
+    res: list[NooaAuroraKp3Col] = []
+    cols_init = False
+    for line in data.splitlines():
+        if line.startswith("#"):
+            continue
+        if line.startswith(":"):
+            continue
+        if len(line) < 3:
+            continue
+        if line.startswith("          ") and not cols_init:
+            columns = line.strip().rsplit("    ", maxsplit=2)
+            for col in columns:
+                res.append(NooaAuroraKp3Col(date=col.strip(), values=[]))
+            cols_init = True
+        if line[2] != "-":
+            continue
+        if "UT" not in line:
+            continue
+        line = (
+            line.replace("(G1)", "")
+            .replace("(G2)", "")
+            .replace("(G3)", "")
+            .replace("(G4)", "")
+            .replace("(G5)", "")
+            .strip()
+        )
+        if not line:
+            continue
+        raw_date, raw_values = line.split(maxsplit=1)
+        values = raw_values.split(maxsplit=2)
+
+        for num in range(len(columns)):
+            res[num].values.append(
+                NooaAuroraKp3RowValue(
+                    time=raw_date,
+                    kp_index=values[num],  # type: ignore
+                )
+            )
+    return res
+
+
+Kp3Adapter = TypeAdapter(list[NooaAuroraKp3Col])
+Kp3RecordsAdapter = TypeAdapter(list[Kp3Column])
+Kp27Adapter = TypeAdapter(list[NooaAuroraKp27Row])
+Kp27RecordsAdapter = TypeAdapter(list[Kp27Record])
+
+# fixture, (legacy, current) models, (legacy, current) response json
+CASES: list[
+    tuple[str, tuple[Callable, Callable], tuple[Callable, Callable]]
+] = [
+    (
+        name,
+        (legacy_parse_kp_3_forecast, parse_kp_3_forecast),
+        (
+            lambda d: Kp3Adapter.dump_json(legacy_parse_kp_3_forecast(d)),
+            lambda d: Kp3RecordsAdapter.dump_json(tokenize_kp_3_forecast(d)),
+        ),
+    )
+    for name in ("3-day-forecast.txt", "3-day-forecast-g.txt")
+] + [
+    (
+        "27-day-outlook.txt",
+        (legacy_parse_kp_27_outlook, parse_kp_27_outlook),
+        (
+            lambda d: Kp27Adapter.dump_json(legacy_parse_kp_27_outlook(d)),
+            lambda d: Kp27RecordsAdapter.dump_json(tokenize_kp_27_outlook(d)),
+        ),
+    )
+]
+
+
+def bench(fn: Callable, data: str, number: int) -> float:
+    """Лучшее время одного вызова, мкс"""
+    best = min(timeit.repeat(lambda: fn(data), number=number, repeat=5))
+    return best / number * 1e6
+
+
+def main(number: int):
+    print(f"{'fixture':<22}{'output':<8}{'legacy':>9}{'current':>9}{'x':>6}")
+    for name, models, payloads in CASES:
+        data = (TESTDATA / name).read_text()
+        for output, (legacy, current) in (
+            ("models", models),
+            ("json", payloads),
+        ):
+            assert legacy(data) == current(data)
+            old = bench(legacy, data, number)
+            new = bench(current, data, number)
+            print(
+                f"{name:<22}{output:<8}{old:>9.1f}{new:>9.1f}{old / new:>6.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if sys.argv[1:] else 2000)
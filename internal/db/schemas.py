@@ -53,6 +53,8 @@ class CustIn(CustomerIn_Pydantic):
 
 
 class CustUpdate(BaseModel):
+    current_geo_lat: float | None = Field(le=90, ge=-90, default=None)
+    current_geo_long: float | None = Field(le=180, ge=-180, default=None)
     city_id: int | None = Field(gt=0, default=None)
     locale: str | None = Field(max_length=2, default=None)
 
@@ -0,0 +1,91 @@
+import heapq
+import math
+from typing import Generic, TypeVar
+
+T = TypeVar("T")
+
+EARTH_RADIUS_KM = 6371.0
+
+Point = tuple[float, float, float]
+
+
+def unit_vector(lat: float, lon: float) -> Point:
+    """Точка на единичной сфере, хорда между точками монотонна
+    расстоянию по дуге, поэтому поиск идет в евклидовом пространстве"""
+    lat_r, lon_r = math.radians(lat), math.radians(lon)
+    return (
+        math.cos(lat_r) * math.cos(lon_r),
+        math.cos(lat_r) * math.sin(lon_r),
+        math.sin(lat_r),
+    )
+
+
+def chord_to_km(chord_sq: float) -> float:
+    chord = math.sqrt(chord_sq)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(chord / 2, 1.0))
+
+
+class _Node(Generic[T]):
+    __slots__ = ("point", "item", "axis", "left", "right")
+
+    def __init__(self, point: Point, item: T, axis: int):
+        self.point = point
+        self.item = item
+        self.axis = axis
+        self.left: _Node[T] | None = None
+        self.right: _Node[T] | None = None
+
+
+class GeoIndex(Generic[T]):
+    """KD-дерево по координатам lat/lon для поиска ближайших объектов"""
+
+    def __init__(self, items: list[tuple[float, float, T]]):
+        points = [(unit_vector(lat, lon), item) for lat, lon, item in items]
+        self.size = len(points)
+        self._root = self._build(points, 0)
+
+    def __len__(self) -> int:
+        return self.size
+
+    @classmethod
+    def _build(
+        cls, points: list[tuple[Point, T]], axis: int
+    ) -> "_Node[T] | None":
+        if not points:
+            return None
+        points.sort(key=lambda p: p[0][axis])
+        mid = len(points) // 2
+        node = _Node(points[mid][0], points[mid][1], axis)
+        next_axis = (axis + 1) % 3
+        node.left = cls._build(points[:mid], next_axis)
+        node.right = cls._build(points[mid + 1 :], next_axis)
+        return node
+
+    def nearest(
+        self, lat: float, lon: float, k: int = 1
+    ) -> list[tuple[float, T]]:
+        """k ближайших объектов и расстояния до них в км по возрастанию"""
+        target = unit_vector(lat, lon)
+        # max heap of (-squared chord, tie breaker, item)
+        best: list[tuple[float, int, T]] = []
+        # (node, squared distance to the split plane it lies behind)
+        stack: list[tuple[_Node[T] | None, float]] = [(self._root, 0.0)]
+        while stack:
+            node, bound = stack.pop()
+            if node is None or (len(best) == k and bound >= -best[0][0]):
+                continue
+            d_sq = sum((a - b) ** 2 for a, b in zip(node.point, target))
+            if len(best) < k:
+                heapq.heappush(best, (-d_sq, id(node), node.item))
+            elif d_sq < -best[0][0]:
+                heapq.heapreplace(best, (-d_sq, id(node), node.item))
+            diff = target[node.axis] - node.point[node.axis]
+            near, far = (
+                (node.left, node.right) if diff < 0 else (node.right, node.left)
+            )
+            stack.append((far, max(bound, diff**2)))
+            stack.append((near, bound))
+        return [
+            (chord_to_km(-d_sq), item)
+            for d_sq, _, item in sorted(best, reverse=True)
+        ]
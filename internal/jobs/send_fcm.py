@@ -6,11 +6,10 @@ from firebase_admin import messaging  # type: ignore
 from tortoise import Tortoise
 
 from internal import fcm
-from internal.db.models import Cities, Customers
+from internal.db.models import Customers
 from internal.logger import setup_job_contextvars
-from internal.nooa import nooa_req
-from internal.nooa.calc import NooaAuroraReq, nearst_aurora_probability
-from internal.nooa.nooa_req import use_nooa_aurora_client
+from internal.nooa.city_table import city_table
+from internal.nooa.nooa_req import use_nooa_aurora_grid
 
 logger = structlog.stdlib.get_logger(__name__)
 
@@ -18,15 +17,9 @@ ProbDict = dict[int, float]
 
 
 async def calc_cites_probabilities() -> ProbDict:
-    res = nooa_req.NooaAuroraRes.model_validate_json(use_nooa_aurora_client())
-    cities = await Cities.all()
-    prob_dict = {}
-    for city in cities:
-        prob_dict[city.id] = nearst_aurora_probability(
-            pos=NooaAuroraReq(lat=city.lat, lon=city.long),
-            prob_map=res,
-        ).probability
-
+    grid = use_nooa_aurora_grid()
+    await city_table.reload()
+    prob_dict: ProbDict = dict(city_table.table(grid).as_dict())
     return prob_dict
 
 
@@ -0,0 +1,200 @@
+import fcntl
+import mmap
+import os
+import shutil
+import struct
+import threading
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Annotated, Iterator
+
+from fastapi import Depends
+from pydantic import BaseModel
+
+from internal.nooa.ovation import GRID_SIZE, OvationGrid, grid_index
+from internal.settings import ARCHIVE_FOLDER, ARCHIVE_MAX_FRAMES
+
+# observation time, forecast time (unix ts)
+INDEX_ENTRY = struct.Struct("<qq")
+
+HistoryRow = tuple[datetime, datetime, int]
+
+MAX_HISTORY_RANGE = timedelta(days=31)
+
+
+class AuroraHistoryPoint(BaseModel):
+    observation_time: datetime
+    forecast_time: datetime
+    probability: int
+
+
+class AuroraHistoryResponse(BaseModel):
+    lat: int
+    lon: int
+    nooa_lat: int
+    nooa_lon: int
+    points: list[AuroraHistoryPoint]
+
+
+class OvationArchive:
+    """Архив сеток OVATION на диске
+
+    frames.bin - сетки фиксированного размера (GRID_SIZE байт) подряд,
+    index.bin - время каждой сетки. Для временного ряда точки из
+    memory-mapped frames.bin читается по одному байту на сетку.
+    Запись защищена flock, поэтому архив можно делить между воркерами.
+    Хранится не больше max_frames последних сеток: когда архив вырастает
+    на 10% сверх лимита, старые сетки удаляются перезаписью файлов
+    """
+
+    def __init__(
+        self, folder: str | Path, max_frames: int = ARCHIVE_MAX_FRAMES
+    ):
+        self.folder = Path(folder)
+        self.frames_path = self.folder / "frames.bin"
+        self.index_path = self.folder / "index.bin"
+        self.lock_path = self.folder / "archive.lock"
+        self.max_frames = max_frames
+        self._lock = threading.Lock()
+        self._mm: mmap.mmap | None = None
+        # index.bin inode, changes when the archive is compacted
+        self._index_ino: int | None = None
+        self._observation_ts: list[int] = []
+        self._forecast_ts: list[int] = []
+
+    @contextmanager
+    def _file_lock(self, operation: int) -> Iterator[None]:
+        """flock между воркерами, общий для чтения и эксклюзивный для записи"""
+        self.folder.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "a+b") as lock:
+            fcntl.flock(lock, operation)
+            yield
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._sync()
+            return len(self._forecast_ts)
+
+    def append(self, grid: OvationGrid) -> bool:
+        """Добавляет сетку, если она новее последней в архиве"""
+        entry = INDEX_ENTRY.pack(
+            int(grid.observation_time.timestamp()),
+            int(grid.forecast_time.timestamp()),
+        )
+        with (
+            self._lock,
+            self._file_lock(fcntl.LOCK_EX),
+            open(self.index_path, "a+b") as index,
+        ):
+            index.seek(0, 2)
+            count = index.tell() // INDEX_ENTRY.size
+            if count:
+                index.seek((count - 1) * INDEX_ENTRY.size)
+                _, last_forecast = INDEX_ENTRY.unpack(
+                    index.read(INDEX_ENTRY.size)
+                )
+                if last_forecast >= INDEX_ENTRY.unpack(entry)[1]:
+                    return False
+            self.frames_path.touch()
+            with open(self.frames_path, "r+b") as frames:
+                frames.seek(count * GRID_SIZE)
+                frames.write(grid.data)
+            # frame is written before index, so readers never see partial one
+            index.seek(count * INDEX_ENTRY.size)
+            index.truncate()
+            index.write(entry)
+            index.flush()
+            if count + 1 > self.max_frames + max(self.max_frames // 10, 1):
+                self._compact(count + 1)
+        return True
+
+    def _compact(self, count: int):
+        """Оставляет max_frames последних сеток, вызывается под LOCK_EX
+
+        Файлы заменяются новыми, читатели замечают это по inode index.bin
+        """
+        drop = count - self.max_frames
+        frames_tmp = self.frames_path.with_suffix(".tmp")
+        index_tmp = self.index_path.with_suffix(".tmp")
+        with open(self.frames_path, "rb") as src, open(frames_tmp, "wb") as dst:
+            src.seek(drop * GRID_SIZE)
+            shutil.copyfileobj(src, dst)
+        with open(self.index_path, "rb") as src:
+            src.seek(drop * INDEX_ENTRY.size)
+            index_tmp.write_bytes(src.read())
+        os.replace(frames_tmp, self.frames_path)
+        os.replace(index_tmp, self.index_path)
+
+    def series(
+        self,
+        lon: int,
+        lat: int,
+        start: datetime,
+        end: datetime,
+    ) -> list[HistoryRow]:
+        """Вероятность в точке для сеток с Forecast Time в [start, end]"""
+        cell = grid_index(lon, lat)
+        with self._lock:
+            self._sync()
+            lo = bisect_left(self._forecast_ts, start.timestamp())
+            hi = bisect_right(self._forecast_ts, end.timestamp())
+            if lo >= hi or self._mm is None:
+                return []
+            return [
+                (
+                    datetime.fromtimestamp(
+                        self._observation_ts[i], tz=timezone.utc
+                    ),
+                    datetime.fromtimestamp(
+                        self._forecast_ts[i], tz=timezone.utc
+                    ),
+                    self._mm[i * GRID_SIZE + cell],
+                )
+                for i in range(lo, hi)
+            ]
+
+    def _sync(self):
+        """Подгружает записи, добавленные в архив (в т.ч. другими воркерами)"""
+        if not self.index_path.exists():
+            return
+        with (
+            self._file_lock(fcntl.LOCK_SH),
+            open(self.index_path, "rb") as index,
+        ):
+            ino = os.fstat(index.fileno()).st_ino
+            replaced = ino != self._index_ino
+            if replaced:
+                # new or compacted archive, read it from the start
+                self._index_ino = ino
+                self._observation_ts.clear()
+                self._forecast_ts.clear()
+            index.seek(len(self._forecast_ts) * INDEX_ENTRY.size)
+            data = index.read()
+            data = data[: len(data) // INDEX_ENTRY.size * INDEX_ENTRY.size]
+            for observation_ts, forecast_ts in INDEX_ENTRY.iter_unpack(data):
+                self._observation_ts.append(observation_ts)
+                self._forecast_ts.append(forecast_ts)
+            if replaced or data:
+                self._remap()
+
+    def _remap(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        with open(self.frames_path, "rb") as frames:
+            if os.fstat(frames.fileno()).st_size:
+                self._mm = mmap.mmap(
+                    frames.fileno(), 0, access=mmap.ACCESS_READ
+                )
+
+
+aurora_archive = OvationArchive(ARCHIVE_FOLDER)
+
+
+def use_aurora_archive() -> OvationArchive:
+    return aurora_archive
+
+
+ArchiveDep = Annotated[OvationArchive, Depends(use_aurora_archive)]
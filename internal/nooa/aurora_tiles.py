@@ -0,0 +1,154 @@
+import math
+from collections import OrderedDict
+from datetime import datetime
+from operator import itemgetter
+
+from internal.nooa.ovation import LAT_OFFSET, LAT_SIZE, LON_SIZE, OvationGrid
+from internal.payload import Payload
+from internal.png import encode_png
+from internal.registry import CacheEntry, Namespace, registry
+
+TILE_SIZE = 256
+MAX_TILE_ZOOM = 8
+MAX_TILES = 1024
+
+TileKey = tuple[int, int, int]
+
+# probability -> rgba, linear between stops
+COLOR_RAMP: list[tuple[int, tuple[int, int, int, int]]] = [
+    (0, (0, 255, 120, 0)),
+    (5, (0, 255, 120, 90)),
+    (30, (255, 255, 0, 170)),
+    (60, (255, 120, 0, 210)),
+    (100, (255, 0, 0, 240)),
+]
+
+
+def build_palette() -> tuple[bytes, bytes]:
+    """PLTE и tRNS чанки: индекс цвета равен вероятности"""
+    rgb, alpha = bytearray(), bytearray()
+    for value in range(256):
+        value = min(value, 100)
+        for (lo, lo_color), (hi, hi_color) in zip(COLOR_RAMP, COLOR_RAMP[1:]):
+            if value <= hi:
+                t = (value - lo) / (hi - lo)
+                color = [
+                    round(a + (b - a) * t) for a, b in zip(lo_color, hi_color)
+                ]
+                break
+        rgb.extend(color[:3])
+        alpha.append(color[3])
+    return bytes(rgb), bytes(alpha)
+
+
+PALETTE, TRANSPARENCY = build_palette()
+
+
+def encode_tile(rows: list[bytes]) -> bytes:
+    """8-битный PNG с палитрой из строк индексов"""
+    return encode_png(
+        len(rows[0]),
+        rows,
+        color_type=3,
+        palette=PALETTE,
+        transparency=TRANSPARENCY,
+    )
+
+
+def tile_lons(z: int, x: int) -> list[int]:
+    """Долгота ячейки сетки для каждого столбца пикселей тайла"""
+    world = TILE_SIZE * 2**z
+    return [
+        round((x * TILE_SIZE + px + 0.5) / world * 360 - 180) % LON_SIZE
+        for px in range(TILE_SIZE)
+    ]
+
+
+def tile_lats(z: int, y: int) -> list[int]:
+    """Широта ячейки сетки для каждой строки пикселей (Web-Mercator)"""
+    world = TILE_SIZE * 2**z
+    lats = []
+    for py in range(TILE_SIZE):
+        n = math.pi * (1 - 2 * (y * TILE_SIZE + py + 0.5) / world)
+        lats.append(round(math.degrees(math.atan(math.sinh(n)))))
+    return lats
+
+
+def render_tile(grid: OvationGrid, z: int, x: int, y: int) -> bytes:
+    pick = itemgetter(*tile_lons(z, x))
+    rows: dict[int, bytes] = {}
+    pixels = []
+    for lat in tile_lats(z, y):
+        row = rows.get(lat)
+        if row is None:
+            # grid is lon-major, so one latitude is a strided slice
+            by_lon = grid.data[lat + LAT_OFFSET :: LAT_SIZE]
+            row = rows[lat] = bytes(pick(by_lon))
+        pixels.append(row)
+    return encode_tile(pixels)
+
+
+class TileLRU(Namespace):
+    """Ограниченный LRU кэш тайлов одной сетки OVATION
+
+    Очищается целиком, когда приходит сетка с новым Forecast Time
+    """
+
+    def __init__(self, name: str = "aurora-tiles", maxsize: int = MAX_TILES):
+        super().__init__(name)
+        self.maxsize = maxsize
+        self.forecast_time: datetime | None = None
+        self._tiles: OrderedDict[TileKey, Payload] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._tiles)
+
+    def counts(self) -> tuple[int, int]:
+        return self.hits, self.misses
+
+    def entries(self) -> list[CacheEntry]:
+        return [
+            CacheEntry(key="/".join(map(str, key)), size=len(p.content))
+            for key, p in list(self._tiles.items())
+        ]
+
+    def invalidate(self, key: str | None = None) -> int:
+        keys = [
+            k for k in list(self._tiles) if key in (None, "/".join(map(str, k)))
+        ]
+        for k in keys:
+            self._tiles.pop(k, None)
+        return len(keys)
+
+    def get(
+        self,
+        grid: OvationGrid,
+        key: TileKey,
+        expires_at: float,
+    ) -> Payload:
+        if grid.forecast_time != self.forecast_time:
+            self._tiles.clear()
+            self.forecast_time = grid.forecast_time
+        payload = self._tiles.get(key)
+        if payload is not None:
+            self.hits += 1
+            self._tiles.move_to_end(key)
+            payload.expires_at = expires_at
+            return payload
+        self.misses += 1
+        payload = Payload(
+            render_tile(grid, *key),
+            media_type="image/png",
+            expires_at=expires_at,
+            compress=False,
+        )
+        self._tiles[key] = payload
+        if len(self._tiles) > self.maxsize:
+            self._tiles.popitem(last=False)
+        return payload
+
+
+aurora_tiles = TileLRU()
+registry.register(aurora_tiles)
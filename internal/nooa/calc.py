@@ -1,11 +1,22 @@
+import threading
+from collections import OrderedDict
 from datetime import datetime, timezone
 from typing import Annotated
 
 from fastapi import Body
-from pydantic import AwareDatetime, BaseModel, Field
+from pydantic import AwareDatetime, BaseModel, Field, field_validator
 
 from internal.nooa import swpc_req
-from internal.nooa.nooa_req import NooaAuroraRes
+from internal.nooa.ovation import (
+    LAT_OFFSET,
+    LAT_SIZE,
+    LON_SIZE,
+    AuroraMapQuery,
+    OvationGrid,
+    grid_index,
+)
+from internal.registry import DictNamespace, registry
+from internal.single_flight import SingleFlight
 from internal.validators import GeoFloat
 
 
@@ -155,9 +166,156 @@ def aurora_probability(
     )
 
 
+# local solar hour shifts by one longitude degree every 4 minutes
+MODEL_SLOT = 4 * 60
+
+
+MAX_MODEL_GRIDS = 16
+# model map inputs are rounded to these steps, so that close values share
+# one cached grid: km/s and percent
+SPEED_STEP = 10
+CLOUDS_STEP = 5
+
+
+class AuroraModelMapQuery(AuroraMapQuery):
+    speed: float = Field(default=450, ge=0)
+    clouds: float = Field(default=30, ge=0, le=100)
+
+    @field_validator("speed")
+    @classmethod
+    def round_speed(cls, speed: float) -> float:
+        return round(speed / SPEED_STEP) * SPEED_STEP
+
+    @field_validator("clouds")
+    @classmethod
+    def round_clouds(cls, clouds: float) -> float:
+        return round(clouds / CLOUDS_STEP) * CLOUDS_STEP
+
+
+def model_slot(at: datetime) -> int:
+    return int(at.timestamp()) // MODEL_SLOT
+
+
+def local_hours(at: datetime) -> list[int]:
+    """Локальный солнечный час для каждой долготы сетки OVATION"""
+    minutes = at.hour * 60 + at.minute
+    return [(minutes + lon * 4) // 60 % 24 for lon in range(LON_SIZE)]
+
+
+def aurora_probability_grid(
+    dst: swpc_req.SwpcDstReq,
+    bz: swpc_req.SwpcBzReq,
+    kp: swpc_req.SwpcKpReq,
+    at: datetime,
+    speed: float,
+    clouds: float,
+) -> OvationGrid:
+    """aurora_probability для всей сетки OVATION за один проход
+
+    Базовая вероятность зависит только от широты, вес времени суток только
+    от долготы, остальные веса общие. Поэтому считается по одному столбцу
+    широт на каждое значение веса времени, а сетка собирается из столбцов
+    """
+    weight = (
+        bz_factor(bz.bz_gse)
+        * speed_factor(speed)
+        * dst_factor(dst.dst)
+        * clouds_factor(clouds)
+    )
+    visibility_zone = kp_zone(kp.kp)
+    base = [
+        max(
+            0,
+            100
+            - (visibility_zone - calculate_geomagnetic_latitude(lat, 0)) * 10,
+        )
+        for lat in range(-LAT_OFFSET, LAT_SIZE - LAT_OFFSET)
+    ]
+    hours = local_hours(at)
+    columns = {
+        time_weight: bytes(
+            round(min(b * weight * time_weight, 100)) for b in base
+        )
+        for time_weight in {time_factor(h) for h in hours}
+    }
+    observation_time = max(
+        t if t.tzinfo else t.replace(tzinfo=timezone.utc)
+        for t in (dst.time_tag, bz.time_tag, kp.time_tag)
+    )
+    return OvationGrid(
+        observation_time,
+        at,
+        b"".join(columns[time_factor(h)] for h in hours),
+    )
+
+
+# grids of the latest inputs, keyed by inputs and model slot
+_model_grids: OrderedDict[tuple, OvationGrid] = OrderedDict()
+registry.register(DictNamespace("aurora-model", _model_grids))
+# guards the LRU order, grids are built outside of it
+_model_lock = threading.Lock()
+# grids are built in the threadpool, one build per key at a time
+_model_builds = SingleFlight()
+
+
+def cached_aurora_probability_grid(
+    dst: swpc_req.SwpcDstReq,
+    bz: swpc_req.SwpcBzReq,
+    kp: swpc_req.SwpcKpReq,
+    at: datetime,
+    speed: float,
+    clouds: float,
+) -> OvationGrid:
+    """Сетка модели, пересчитывается только при смене входных данных
+    или локального часа на какой-либо долготе"""
+    slot = model_slot(at)
+    key = (
+        dst.dst,
+        dst.time_tag,
+        bz.bz_gse,
+        bz.time_tag,
+        kp.kp,
+        kp.time_tag,
+        slot,
+        speed,
+        clouds,
+    )
+    with _model_lock:
+        grid = _model_grids.get(key)
+        if grid is not None:
+            _model_grids.move_to_end(key)
+            return grid
+
+    def build() -> OvationGrid:
+        # another build of the key may have finished in the meantime
+        grid = _model_grids.get(key)
+        if grid is not None:
+            return grid
+        grid = aurora_probability_grid(
+            dst,
+            bz,
+            kp,
+            datetime.fromtimestamp(slot * MODEL_SLOT, tz=timezone.utc),
+            speed,
+            clouds,
+        )
+        with _model_lock:
+            _model_grids[key] = grid
+            while len(_model_grids) > MAX_MODEL_GRIDS:
+                _model_grids.popitem(last=False)
+        return grid
+
+    return _model_builds.do(key, build)
+
+
+def model_slot_end(at: datetime) -> float:
+    return (model_slot(at) + 1) * MODEL_SLOT
+
+
 class NooaAuroraReq(BaseModel):
-    lat: GeoFloat
-    lon: GeoFloat
+    lat: GeoFloat = Field(le=90, ge=-90)
+    # ovation longitudes are 0..359, negative ones are west
+    lon: GeoFloat = Field(le=360, ge=-180)
 
 
 class AuroraNooaProbabilityResponse(BaseModel):
@@ -170,24 +328,32 @@ class AuroraNooaProbabilityResponse(BaseModel):
 
 def nearst_aurora_probability(
     pos: NooaAuroraReq,
-    prob_map: NooaAuroraRes,
-):
-    rounded_lat = round(pos.lat, 0)
-    rounded_lon = round(pos.lon, 0)
-    nooa_lon, nooa_lat, pb = next(
-        v
-        for v in prob_map.coordinates
-        # fmt: off
-        if v[:2] == [
-            rounded_lon if rounded_lon > 0 else rounded_lon + 360,
-            rounded_lat,
-        ]
-        # fmt: on
-    )
+    prob_map: OvationGrid,
+) -> AuroraNooaProbabilityResponse:
+    rounded_lat = int(round(pos.lat, 0))
+    rounded_lon = int(round(pos.lon, 0))
+    nooa_lon = rounded_lon % LON_SIZE
     return AuroraNooaProbabilityResponse(
-        probability=pb,
-        nooa_lat=nooa_lat,
+        probability=prob_map.probability(nooa_lon, rounded_lat),
+        nooa_lat=rounded_lat,
         nooa_lon=nooa_lon,
         lat=rounded_lat,
         lon=rounded_lon,
     )
+
+
+def nooa_cell(pos: NooaAuroraReq) -> int:
+    """Индекс ячейки OvationGrid, из которой берет значение
+    nearst_aurora_probability"""
+    return grid_index(int(round(pos.lon, 0)) % LON_SIZE, int(round(pos.lat, 0)))
+
+
+# Максимальное количество координат в одном batch запросе
+MAX_BATCH_SIZE = 256
+
+
+def nearst_aurora_probabilities(
+    positions: list[NooaAuroraReq],
+    prob_map: OvationGrid,
+) -> list[AuroraNooaProbabilityResponse]:
+    return [nearst_aurora_probability(pos, prob_map) for pos in positions]
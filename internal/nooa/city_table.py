@@ -0,0 +1,130 @@
+import time
+from datetime import datetime
+from functools import lru_cache
+from typing import Iterable
+
+from pydantic import BaseModel
+
+from internal.db.models import Cities
+from internal.geo_index import GeoIndex
+from internal.nooa.calc import NooaAuroraReq, nooa_cell
+from internal.nooa.ovation import OvationGrid
+from internal.payload import Payload
+from internal.registry import MemoNamespace, registry
+
+# other workers do not see admin changes, so reload cities periodically
+CITY_TABLE_TTL = 60
+MAX_NEAREST_CITIES = 20
+# users farther than that from every city are not assigned one
+MAX_AUTO_CITY_DISTANCE_KM = 200
+
+
+class CityProbability(BaseModel):
+    city_id: int
+    probability: int
+
+
+class CitiesProbabilityResponse(BaseModel):
+    observation_time: datetime
+    forecast_time: datetime
+    cities: list[CityProbability]
+
+
+class CityProbabilities:
+    __slots__ = ("grid", "version", "ids", "probabilities", "content")
+
+    def __init__(
+        self,
+        grid: OvationGrid,
+        version: int,
+        ids: list[int],
+        cells: list[int],
+    ):
+        self.grid = grid
+        self.version = version
+        self.ids = ids
+        # one byte per city, gathered from the grid by precomputed cells
+        self.probabilities = bytes(map(grid.data.__getitem__, cells))
+        self.content = CitiesProbabilityResponse(
+            observation_time=grid.observation_time,
+            forecast_time=grid.forecast_time,
+            cities=[
+                CityProbability(city_id=city_id, probability=probability)
+                for city_id, probability in zip(ids, self.probabilities)
+            ],
+        ).model_dump_json()
+
+    def as_dict(self) -> dict[int, int]:
+        return dict(zip(self.ids, self.probabilities))
+
+
+class CityTable:
+    """Вероятности сияния по ячейкам OvationGrid для всех городов
+
+    Ячейка каждого города и пространственный индекс считаются один раз
+    при изменении списка городов, таблица вероятностей пересчитывается
+    один раз на новую сетку
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.loaded_at: float | None = None
+        self._ids: list[int] = []
+        self._cells: list[int] = []
+        self._table: CityProbabilities | None = None
+        self.index: GeoIndex[Cities] = GeoIndex([])
+
+    def set_cities(self, cities: Iterable[Cities]) -> None:
+        cities = list(cities)
+        ids, cells = [], []
+        for c in cities:
+            ids.append(c.id)
+            cells.append(nooa_cell(NooaAuroraReq(lat=c.lat, lon=c.long)))
+        self._ids, self._cells = ids, cells
+        self.index = GeoIndex([(c.lat, c.long, c) for c in cities])
+        self.version += 1
+        self.loaded_at = time.time()
+
+    async def reload(self):
+        self.set_cities(await Cities.all())
+
+    async def ensure_loaded(self):
+        if self.loaded_at is None or (
+            time.time() - self.loaded_at > CITY_TABLE_TTL
+        ):
+            await self.reload()
+
+    def table(self, grid: OvationGrid) -> CityProbabilities:
+        table = self._table
+        if (
+            table is None
+            or table.grid is not grid
+            or (table.version != self.version)
+        ):
+            table = CityProbabilities(
+                grid, self.version, self._ids, self._cells
+            )
+            self._table = table
+        return table
+
+
+city_table = CityTable()
+
+
+@lru_cache(maxsize=8)
+def city_table_payload(table: CityProbabilities, expires_at: float) -> Payload:
+    return Payload(table.content.encode(), expires_at=expires_at)
+
+
+registry.register(
+    MemoNamespace("city-table", [city_table_payload], city_table.reload)
+)
+
+
+async def nearest_city_id(lat: float, lon: float) -> int | None:
+    """Ближайший город для автоматической привязки пользователя"""
+    await city_table.ensure_loaded()
+    found = city_table.index.nearest(lat, lon)
+    if not found or found[0][0] > MAX_AUTO_CITY_DISTANCE_KM:
+        return None
+    return found[0][1].id
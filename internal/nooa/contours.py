@@ -0,0 +1,222 @@
+import json
+from functools import lru_cache
+from operator import itemgetter
+
+from internal.nooa.ovation import (
+    LAT_OFFSET,
+    LAT_SIZE,
+    LON_SIZE,
+    OvationGrid,
+    format_time,
+)
+from internal.settings import CONTOUR_LEVELS
+
+# simplification tolerance and minimal ring area, in degrees
+CONTOUR_TOLERANCE = 0.5
+MIN_RING_AREA = 1.0
+
+Point = tuple[float, float]
+EdgeKey = tuple[int, int, int]
+
+# grid columns ordered from lon -180 to 180 so polygons fit GeoJSON range,
+# the last column repeats the first one
+COLUMNS = [(lon - 180) % LON_SIZE for lon in range(LON_SIZE + 1)]
+WIDTH = len(COLUMNS)
+HEIGHT = LAT_SIZE
+
+
+def level_mask(grid: OvationGrid, level: int) -> list[bytes]:
+    """Маска ячеек с вероятностью >= level по строкам широты
+
+    Вокруг сетки добавлена рамка из нулей, чтобы все контуры замыкались
+    """
+    table = bytes(int(v >= level) for v in range(256))
+    pick = itemgetter(*COLUMNS)
+    pad = bytes(WIDTH + 2)
+    rows = [pad]
+    for lat in range(HEIGHT):
+        row = bytes(pick(grid.data[lat::LAT_SIZE])).translate(table)
+        rows.append(b"\x00" + row + b"\x00")
+    rows.append(pad)
+    return rows
+
+
+def value(grid: OvationGrid, x: int, y: int) -> int:
+    """Вероятность в столбце x и строке y, -1 за пределами сетки"""
+    if 0 <= x < WIDTH and 0 <= y < HEIGHT:
+        return grid.data[COLUMNS[x] * LAT_SIZE + y]
+    return -1
+
+
+def crossing(grid: OvationGrid, level: int, key: EdgeKey) -> Point:
+    """Точка пересечения уровня с ребром сетки (линейная интерполяция)"""
+    vertical, x, y = key
+    # mask has a one cell frame around the grid
+    p0 = (x - 1, y - 1)
+    p1 = (x - 1, y) if vertical else (x, y - 1)
+    v0, v1 = value(grid, *p0), value(grid, *p1)
+    (inside, v_in), (outside, v_out) = sorted(
+        ((p0, v0), (p1, v1)), key=lambda p: p[1] < level
+    )
+    # frame cell has no value, contour goes along the grid border
+    t = (v_in - level) / (v_in - v_out) if v_out >= 0 else 0.0
+    px = inside[0] + (outside[0] - inside[0]) * t
+    py = inside[1] + (outside[1] - inside[1]) * t
+    return (px - 180, py - LAT_OFFSET)
+
+
+def trace_segments(mask: list[bytes]) -> dict[EdgeKey, EdgeKey]:
+    """Marching squares: отрезки контура от ребра к ребру
+
+    Отрезки направлены так, что область внутри уровня остается слева,
+    поэтому внешние кольца идут против часовой стрелки, а дыры - по ней
+    """
+    segments: dict[EdgeKey, EdgeKey] = {}
+    for y in range(len(mask) - 1):
+        bottom, top = mask[y], mask[y + 1]
+        if bottom == top and not any(bottom):
+            continue
+        for x in range(len(bottom) - 1):
+            a, b, c, d = bottom[x], bottom[x + 1], top[x + 1], top[x]
+            case = a | b << 1 | c << 2 | d << 3
+            if case == 0 or case == 15:
+                continue
+            # square perimeter counterclockwise: edge, corner at its start
+            edges = (
+                ((0, x, y), a, b),
+                ((1, x + 1, y), b, c),
+                ((0, x, y + 1), c, d),
+                ((1, x, y), d, a),
+            )
+            exits, entries = [], []
+            for i, (key, start, end) in enumerate(edges):
+                if start and not end:
+                    exits.append((i, key))
+                elif end and not start:
+                    entries.append((i, key))
+            if len(exits) == 1:
+                segments[exits[0][1]] = entries[0][1]
+                continue
+            # saddle, diagonal insides are joined through the center
+            for i, key in exits:
+                after = [e for e in entries if e[0] > i] or entries
+                segments[key] = after[0][1]
+    return segments
+
+
+def link_rings(segments: dict[EdgeKey, EdgeKey]) -> list[list[EdgeKey]]:
+    rings = []
+    while segments:
+        start, key = segments.popitem()
+        ring = [start]
+        while key != start:
+            ring.append(key)
+            key = segments.pop(key)
+        ring.append(start)
+        rings.append(ring)
+    return rings
+
+
+def point_line_distance(p: Point, a: Point, b: Point) -> float:
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    if dx == dy == 0:
+        return ((p[0] - a[0]) ** 2 + (p[1] - a[1]) ** 2) ** 0.5
+    return (
+        abs(dy * (p[0] - a[0]) - dx * (p[1] - a[1]))
+        / (dx * dx + dy * dy) ** 0.5
+    )
+
+
+def simplify(points: list[Point], tolerance: float) -> list[Point]:
+    """Douglas-Peucker, первая и последняя точки сохраняются"""
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        best, index = 0.0, 0
+        for i in range(first + 1, last):
+            d = point_line_distance(points[i], points[first], points[last])
+            if d > best:
+                best, index = d, i
+        if best > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [p for p, k in zip(points, keep) if k]
+
+
+def ring_area(ring: list[Point]) -> float:
+    """Ориентированная площадь, положительная против часовой стрелки"""
+    return (
+        sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:])) / 2
+    )
+
+
+def contains(ring: list[Point], p: Point) -> bool:
+    inside = False
+    for (x0, y0), (x1, y1) in zip(ring, ring[1:]):
+        if (y0 > p[1]) != (y1 > p[1]) and p[0] < x0 + (p[1] - y0) * (
+            x1 - x0
+        ) / (y1 - y0):
+            inside = not inside
+    return inside
+
+
+def level_polygons(
+    grid: OvationGrid,
+    level: int,
+    tolerance: float = CONTOUR_TOLERANCE,
+) -> list[list[list[Point]]]:
+    """Полигоны GeoJSON MultiPolygon области с вероятностью >= level"""
+    outers: list[tuple[float, list[Point]]] = []
+    holes: list[list[Point]] = []
+    for keys in link_rings(trace_segments(level_mask(grid, level))):
+        ring = simplify([crossing(grid, level, key) for key in keys], tolerance)
+        ring = [(round(x, 2), round(y, 2)) for x, y in ring]
+        area = ring_area(ring)
+        if len(ring) < 4 or abs(area) < MIN_RING_AREA:
+            continue
+        if area > 0:
+            outers.append((area, ring))
+        else:
+            holes.append(ring)
+    outers.sort(key=lambda o: o[0])
+    polygons: dict[int, list[list[Point]]] = {
+        i: [ring] for i, (_, ring) in enumerate(outers)
+    }
+    for hole in holes:
+        # the smallest outer ring containing the hole
+        for i, (_, ring) in enumerate(outers):
+            if contains(ring, hole[0]):
+                polygons[i].append(hole)
+                break
+    return list(polygons.values())
+
+
+@lru_cache(maxsize=8)
+def aurora_contours_json(
+    grid: OvationGrid,
+    levels: tuple[int, ...] = tuple(CONTOUR_LEVELS),
+) -> bytes:
+    """GeoJSON FeatureCollection с контурами сияния для каждого уровня"""
+    features = [
+        {
+            "type": "Feature",
+            "properties": {"probability": level},
+            "geometry": {
+                "type": "MultiPolygon",
+                "coordinates": level_polygons(grid, level),
+            },
+        }
+        for level in levels
+    ]
+    return json.dumps(
+        {
+            "type": "FeatureCollection",
+            "observation_time": format_time(grid.observation_time),
+            "forecast_time": format_time(grid.forecast_time),
+            "features": features,
+        },
+        separators=(",", ":"),
+    ).encode()
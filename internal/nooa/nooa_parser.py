@@ -1,6 +1,14 @@
-from datetime import date, datetime
+from dataclasses import dataclass, field
+from datetime import date
 
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
+
+MONTHS = {
+    name: num
+    for num, name in enumerate(
+        "Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split(), start=1
+    )
+}
 
 
 class NooaAuroraKp27Row(BaseModel):
@@ -10,31 +18,42 @@ class NooaAuroraKp27Row(BaseModel):
     largest_kp_index: int
 
 
-def parse_kp_27_outlook(data: str) -> list[NooaAuroraKp27Row]:
+@dataclass(slots=True)
+class Kp27Record:
+    date: date
+    radio_flux: int
+    planetary_index: int
+    largest_kp_index: int
+
+
+def tokenize_kp_27_outlook(data: str) -> list[Kp27Record]:
     res = []
     for line in data.splitlines():
-        if line.startswith("#"):
-            continue
-        if line.startswith(":"):
-            continue
-        line = line.strip()
-        if not line:
+        # "2025 Jan 06     172          22          5"
+        tokens = line.split()
+        if len(tokens) != 6 or line[0] in "#:":
             continue
-        raw_date, radio_flux, planetary_index, largest_kp_index = line.rsplit(
-            maxsplit=3
-        )
-        date = datetime.strptime(raw_date, "%Y %b %d").date()
+        year, month, day, radio_flux, planetary_index, largest_kp_index = tokens
         res.append(
-            NooaAuroraKp27Row(
-                date=date,
-                radio_flux=radio_flux,
-                planetary_index=planetary_index,
-                largest_kp_index=largest_kp_index,
+            Kp27Record(
+                date=date(int(year), MONTHS[month], int(day)),
+                radio_flux=int(radio_flux),
+                planetary_index=int(planetary_index),
+                largest_kp_index=int(largest_kp_index),
             )
         )
     return res
 
 
+Kp27RowsAdapter = TypeAdapter(list[NooaAuroraKp27Row])
+
+
+def parse_kp_27_outlook(data: str) -> list[NooaAuroraKp27Row]:
+    return Kp27RowsAdapter.validate_python(
+        tokenize_kp_27_outlook(data), from_attributes=True
+    )
+
+
 class NooaAuroraKp3RowValue(BaseModel):
     time: str
     kp_index: float
@@ -45,45 +64,63 @@ class NooaAuroraKp3Col(BaseModel):
     values: list[NooaAuroraKp3RowValue]
 
 
-def parse_kp_3_forecast(data: str) -> list[NooaAuroraKp3Col]:
-    res: list[NooaAuroraKp3Col] = []
-    cols_init = False
-    for line in data.splitlines():
-        if line.startswith("#"):
-            continue
-        if line.startswith(":"):
-            continue
-        if len(line) < 3:
-            continue
-        if line.startswith("          ") and not cols_init:
-            columns = line.strip().rsplit("    ", maxsplit=2)
-            for col in columns:
-                res.append(NooaAuroraKp3Col(date=col.strip(), values=[]))
-            cols_init = True
-        if line[2] != "-":
-            continue
-        if "UT" not in line:
+@dataclass(slots=True)
+class Kp3Value:
+    time: str
+    kp_index: float
+
+
+@dataclass(slots=True)
+class Kp3Column:
+    date: str
+    values: list[Kp3Value] = field(default_factory=list)
+
+
+KP_3_TABLE = "NOAA Kp index breakdown"
+
+
+def tokenize_kp_3_forecast(data: str) -> list[Kp3Column]:
+    res: list[Kp3Column] = []
+    # skip straight to the Kp table, the rest of the forecast is not needed
+    start = max(data.find(KP_3_TABLE), 0)
+    for line in data[start:].splitlines():
+        if not res:
+            # "             Jan 11       Jan 12       Jan 13"
+            if line.startswith("          "):
+                tokens = line.split()
+                res = [
+                    Kp3Column(date=f"{month} {day}")
+                    for month, day in zip(tokens[::2], tokens[1::2])
+                ]
             continue
-        line = (
-            line.replace("(G1)", "")
-            .replace("(G2)", "")
-            .replace("(G3)", "")
-            .replace("(G4)", "")
-            .replace("(G5)", "")
-            .strip()
-        )
-        if not line:
+        # "03-06UT       1.33 (G3)    1.33         5.33 (G1)"
+        if line[2:3] != "-" or "UT" not in line:
+            if res[0].values:
+                break
             continue
-        raw_date, raw_values = line.split(maxsplit=1)
-        values = raw_values.split(maxsplit=2)
-
-        for num in range(len(columns)):
-            if not res:
-                raise Exception("No cols init")
-            res[num].values.append(
-                NooaAuroraKp3RowValue(
-                    time=raw_date,
-                    kp_index=values[num],
-                )
-            )
+        tokens = line.split()
+        time = tokens[0]
+        values = [float(t) for t in tokens[1:] if t[0] != "("]
+        if len(values) < len(res):
+            raise ValueError(f"Not enough Kp values in line: {line!r}")
+        for col, kp_index in zip(res, values):
+            col.values.append(Kp3Value(time, kp_index))
     return res
+
+
+Kp3ColsAdapter = TypeAdapter(list[NooaAuroraKp3Col])
+
+
+def parse_kp_3_forecast(data: str) -> list[NooaAuroraKp3Col]:
+    # nested dicts validate faster than attributes of nested records
+    return Kp3ColsAdapter.validate_python(
+        [
+            {
+                "date": col.date,
+                "values": [
+                    {"time": v.time, "kp_index": v.kp_index} for v in col.values
+                ],
+            }
+            for col in tokenize_kp_3_forecast(data)
+        ]
+    )
@@ -1,22 +1,51 @@
+import asyncio
 from datetime import datetime
-from typing import Annotated
+from functools import lru_cache
+from typing import Annotated, Callable, Generic, TypeVar
 
 import hishel
+import httpx
+import structlog
 from fastapi import Depends
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter
 
+from internal.nooa.archive import aurora_archive
+from internal.nooa.city_table import city_table
+from internal.nooa.contours import aurora_contours_json
 from internal.nooa.nooa_parser import (
+    Kp3Column,
+    Kp27Record,
     NooaAuroraKp3Col,
     NooaAuroraKp27Row,
-    parse_kp_3_forecast,
-    parse_kp_27_outlook,
+    tokenize_kp_3_forecast,
+    tokenize_kp_27_outlook,
 )
+from internal.nooa.ovation import (
+    AuroraMapQuery,
+    GridHistory,
+    OvationGrid,
+    aurora_delta_json,
+    aurora_map_bin,
+    aurora_map_json,
+)
+from internal.payload import Payload
+from internal.refresher import Snapshot, cache_expires_at, upstream_version
+from internal.registry import MemoNamespace, StorageNamespace, registry
+from internal.single_flight import upstream
+from internal.storage import PersistentStorage
+
+log = structlog.stdlib.get_logger(__name__)
+
+T = TypeVar("T")
+
+TTL = 3600
+LONG_TTL = 24 * 3600
 
 controller = hishel.Controller(force_cache=True)
-storage = hishel.InMemoryStorage(capacity=64, ttl=3600)
+storage = PersistentStorage("nooa", ttl=TTL)
 client = hishel.CacheClient(storage=storage, controller=controller)
 
-long_storage = hishel.InMemoryStorage(capacity=64, ttl=24 * 3600)
+long_storage = PersistentStorage("nooa-long", ttl=LONG_TTL)
 long_client = hishel.CacheClient(storage=long_storage, controller=controller)
 
 
@@ -46,45 +75,243 @@ class NooaAuroraRes(BaseModel):
     }
 
 
-def use_nooa_aurora_client() -> bytes:
-    res = client.get(
-        "https://services.swpc.noaa.gov/json/ovation_aurora_latest.json"
-    )
+class NooaAuroraDeltaRes(BaseModel):
+    Observation_Time: datetime = Field(alias="Observation Time")
+    Forecast_Time: datetime = Field(alias="Forecast Time")
+    Base_Observation_Time: datetime = Field(alias="Base Observation Time")
+    Data_Format: str = Field(alias="Data Format")
+    changes: list[list[int]]
+
+    model_config = {
+        "populate_by_name": True,
+        "json_schema_extra": {
+            "examples": [
+                {
+                    "Observation_Time": "2025-01-11T15:11:00Z",
+                    "Forecast_Time": "2025-01-11T16:11:00Z",
+                    "Base_Observation_Time": "2025-01-11T15:06:00Z",
+                    "Data_Format": "[Index, Aurora]",
+                    "changes": [[6042, 12], [6043, 9]],
+                }
+            ]
+        },
+    }
+
+
+AURORA_URL = "https://services.swpc.noaa.gov/json/ovation_aurora_latest.json"
+
+
+def get_nooa_aurora() -> httpx.Response:
+    res = upstream.do(AURORA_URL, lambda: client.get(AURORA_URL))
     if res.status_code != 200:
         raise Exception("Failed to get data from nooa (aurora client)")
-    return res.content
+    return res
 
 
-AuroraDep = Annotated[NooaAuroraRes, Depends(use_nooa_aurora_client)]
+def fetch_aurora_grid() -> tuple[OvationGrid, float]:
+    res = get_nooa_aurora()
+    expires_at = cache_expires_at(res, TTL)
+    grid = aurora_snapshot.value
+    if grid is not None and res.extensions.get("from_cache"):
+        return grid, expires_at
+    grid = OvationGrid.from_json(res.content)
+    aurora_history.add(grid)
+    try:
+        aurora_archive.append(grid)
+    except OSError as e:
+        log.exception(f"Failed to archive ovation grid: {e}")
+    prepare_aurora_payloads(grid, expires_at)
+    if city_table.loaded_at is not None:
+        city_table.table(grid)
+    return grid, expires_at
 
 
-# https://services.swpc.noaa.gov/text/3-day-forecast.txt
-NooaAuroraKp3Req = list[NooaAuroraKp3Col]
+# previous grids for delta responses to clients polling the map
+aurora_history = GridHistory()
+
+# decoded grid of the last fetched ovation map, rebuilt on upstream refresh
+aurora_snapshot = Snapshot("ovation-aurora", fetch_aurora_grid)
+
+
+def use_nooa_aurora_grid() -> OvationGrid:
+    return aurora_snapshot.get()
+
+
+AuroraGridDep = Annotated[OvationGrid, Depends(use_nooa_aurora_grid)]
+
+
+def build_aurora_map_payload(
+    grid: OvationGrid,
+    query: AuroraMapQuery,
+    binary: bool,
+    expires_at: float,
+) -> Payload:
+    if binary:
+        return Payload(
+            aurora_map_bin(grid, query),
+            media_type="application/octet-stream",
+            expires_at=expires_at,
+        )
+    return Payload(aurora_map_json(grid, query), expires_at=expires_at)
+
+
+@lru_cache(maxsize=4)
+def aurora_map_payload(
+    grid: OvationGrid, binary: bool, expires_at: float
+) -> Payload:
+    """Полная карта, готовится при обновлении сетки"""
+    return build_aurora_map_payload(grid, AuroraMapQuery(), binary, expires_at)
+
+
+@lru_cache(maxsize=64)
+def filtered_aurora_map_payload(
+    grid: OvationGrid,
+    query: AuroraMapQuery,
+    binary: bool,
+    expires_at: float,
+) -> Payload:
+    """Карта с фильтром, отдельный LRU не вытесняет полную карту"""
+    return build_aurora_map_payload(grid, query, binary, expires_at)
+
 
+@lru_cache(maxsize=32)
+def aurora_model_map_payload(
+    grid: OvationGrid,
+    query: AuroraMapQuery,
+    binary: bool,
+    expires_at: float,
+) -> Payload:
+    """Карта собственной модели, свой LRU не вытесняет карты OVATION"""
+    return build_aurora_map_payload(grid, query, binary, expires_at)
 
-def use_nooa_aurora_kp_client() -> NooaAuroraKp3Req:
-    res = long_client.get(
-        "https://services.swpc.noaa.gov/text/3-day-forecast.txt"
+
+@lru_cache(maxsize=8)
+def aurora_contours_payload(grid: OvationGrid, expires_at: float) -> Payload:
+    return Payload(
+        aurora_contours_json(grid),
+        media_type="application/geo+json",
+        expires_at=expires_at,
     )
+
+
+@lru_cache(maxsize=16)
+def aurora_delta_payload(
+    base: OvationGrid,
+    grid: OvationGrid,
+    expires_at: float,
+) -> Payload:
+    return Payload(aurora_delta_json(base, grid), expires_at=expires_at)
+
+
+def prepare_aurora_payloads(grid: OvationGrid, expires_at: float):
+    # full map is requested by every client, prepare it right away
+    for binary in (False, True):
+        aurora_map_payload(grid, binary, expires_at)
+    aurora_contours_payload(grid, expires_at)
+
+
+async def warm_aurora_payloads():
+    grid = await asyncio.to_thread(aurora_snapshot.get)
+    await asyncio.to_thread(
+        prepare_aurora_payloads, grid, aurora_snapshot.expires_at
+    )
+
+
+def get_nooa_text(url: str, name: str) -> httpx.Response:
+    res = upstream.do(url, lambda: long_client.get(url))
     if res.status_code != 200:
-        raise Exception("Failed to get data from nooa (3-day-forecast)")
-    return parse_kp_3_forecast(res.text)
+        raise Exception(f"Failed to get data from nooa ({name})")
+    return res
+
+
+class ParsedText(Generic[T]):
+    """Разобранный текстовый ответ nooa (dataclass записи) и его JSON
+
+    Текст разбирается заново только при смене версии ответа,
+    повторные запросы к закэшированному ответу ничего не парсят
+    """
+
+    def __init__(self, parse: Callable[[str], T], adapter: TypeAdapter[T]):
+        self._parse = parse
+        self._adapter = adapter
+        self._parsed: tuple[str, T, Payload] | None = None
+
+    def get(self, res: httpx.Response) -> tuple[T, Payload]:
+        version = upstream_version(res)
+        parsed = self._parsed
+        if parsed is None or parsed[0] != version:
+            value = self._parse(res.text)
+            payload = Payload(self._adapter.dump_json(value))
+            parsed = self._parsed = (version, value, payload)
+        return parsed[1], parsed[2]
+
+
+# https://services.swpc.noaa.gov/text/3-day-forecast.txt
+KP_3_URL = "https://services.swpc.noaa.gov/text/3-day-forecast.txt"
+NooaAuroraKp3Req = list[NooaAuroraKp3Col]
+kp_3_parsed = ParsedText(tokenize_kp_3_forecast, TypeAdapter(list[Kp3Column]))
+
+
+def fetch_kp_3_payload() -> tuple[Payload, float]:
+    res = get_nooa_text(KP_3_URL, "3-day-forecast")
+    expires_at = cache_expires_at(res, LONG_TTL)
+    _, payload = kp_3_parsed.get(res)
+    payload.expires_at = expires_at
+    return payload, expires_at
+
+
+kp_3_snapshot = Snapshot("nooa-kp-3", fetch_kp_3_payload)
 
 
-Kp3Dep = Annotated[NooaAuroraKp3Req, Depends(use_nooa_aurora_kp_client)]
+def use_nooa_aurora_kp_payload() -> Payload:
+    return kp_3_snapshot.get()
+
+
+Kp3PayloadDep = Annotated[Payload, Depends(use_nooa_aurora_kp_payload)]
 
 
 # https://services.swpc.noaa.gov/text/27-day-outlook.txt
+KP_27_URL = "https://services.swpc.noaa.gov/text/27-day-outlook.txt"
 NooaAuroraKp27Req = list[NooaAuroraKp27Row]
+kp_27_parsed = ParsedText(tokenize_kp_27_outlook, TypeAdapter(list[Kp27Record]))
 
 
-def use_nooa_aurora_kp_27_client() -> NooaAuroraKp27Req:
-    res = long_client.get(
-        "https://services.swpc.noaa.gov/text/27-day-outlook.txt"
-    )
-    if res.status_code != 200:
-        raise Exception("Failed to get data from nooa (27-day-outlook)")
-    return parse_kp_27_outlook(res.text)
+def fetch_kp_27_payload() -> tuple[Payload, float]:
+    res = get_nooa_text(KP_27_URL, "27-day-outlook")
+    expires_at = cache_expires_at(res, LONG_TTL)
+    _, payload = kp_27_parsed.get(res)
+    payload.expires_at = expires_at
+    return payload, expires_at
 
 
-Kp27Dep = Annotated[NooaAuroraKp27Req, Depends(use_nooa_aurora_kp_27_client)]
+kp_27_snapshot = Snapshot("nooa-kp-27", fetch_kp_27_payload)
+
+
+def use_nooa_aurora_kp_27_payload() -> Payload:
+    return kp_27_snapshot.get()
+
+
+Kp27PayloadDep = Annotated[Payload, Depends(use_nooa_aurora_kp_27_payload)]
+
+
+registry.register(StorageNamespace(storage, [aurora_snapshot]))
+registry.register(
+    StorageNamespace(long_storage, [kp_3_snapshot, kp_27_snapshot])
+)
+registry.register(
+    MemoNamespace(
+        "ovation-maps",
+        [
+            aurora_map_payload,
+            filtered_aurora_map_payload,
+            aurora_model_map_payload,
+            aurora_map_json,
+            aurora_map_bin,
+            aurora_delta_payload,
+            aurora_delta_json,
+            aurora_contours_payload,
+            aurora_contours_json,
+        ],
+        warm_aurora_payloads,
+    )
+)
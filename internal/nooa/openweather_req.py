@@ -1,33 +1,146 @@
-from typing import Annotated
+import asyncio
+import shutil
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Annotated, AsyncGenerator
 
-import hishel
-from fastapi import Path, Response
+import httpx
+from fastapi import FastAPI, Header, HTTPException, Request, Response
+from fastapi import Path as PathParam
 
+from internal.payload import NotModifiedDep
+from internal.refresher import AsyncSnapshot
+from internal.registry import registry
 from internal.routers.api_router import router
-from internal.settings import OW_API_KEY
+from internal.settings import CACHE_FOLDER, OW_API_KEY, TILE_FOLDER
+from internal.tile_formats import negotiate_format
+from internal.tiles import (
+    TileCache,
+    TileKey,
+    TilePyramid,
+    TileStore,
+    TileVariants,
+)
 
-# cap is 64 cuz its max amount of tiles we need to full world map on client
-storage = hishel.InMemoryStorage(capacity=64, ttl=30 * 60)
-controller = hishel.Controller(force_cache=True, allow_stale=True)
-client = hishel.CacheClient(storage=storage, controller=controller)
+TTL = 30 * 60
+# z=3 is the only zoom level downloaded, 8x8 tiles
+CLOUD_ZOOM = 3
+CLOUD_TILES = 2**CLOUD_ZOOM
+CLOUD_MEMORY_BYTES = 16 * 1024 * 1024
+# higher zooms are cut out of the z=3 tiles
+CLOUD_MAX_ZOOM = 10
+CLOUD_PYRAMID_BYTES = 32 * 1024 * 1024
+CLOUD_VARIANT_BYTES = 8 * 1024 * 1024
+# tile set is downloaded again this many seconds before it expires
+PREFETCH_LEAD = 2 * 60
 
+client = httpx.AsyncClient(
+    timeout=httpx.Timeout(10, connect=5),
+    limits=httpx.Limits(max_connections=16),
+)
 
-@router.get("/cloud-map/{z}/{x}/{y}")
-async def api_cloud_map(
-    z: Annotated[int, Path(ge=3, le=3)],
-    x: Annotated[int, Path(ge=0, le=7)],
-    y: Annotated[int, Path(ge=0, le=7)],
-):
-    """Получение тайлов облачнсти от OpenWeatherMap
 
-    - **Источник**: openweathermap.org
-    - **Cache TTL**: 30 минут
-    - **Cache Size**: 64 тайла
-    """
-    res = client.get(
+async def fetch_cloud_tile(key: TileKey) -> bytes:
+    z, x, y = key
+    url = (
         f"https://tile.openweathermap.org/map/clouds/"
         f"{z}/{x}/{y}.png?appid={OW_API_KEY}"
     )
+    res = await client.get(url)
     if res.status_code != 200:
         raise Exception("Failed to get cloud map data (aurora client)")
-    return Response(content=res.content, media_type="image/png")
+    return res.content
+
+
+async def warm_cloud_tiles():
+    # re-downloads the z=3 tile set after invalidation
+    await cloud_snapshot.refresh()
+
+
+CLOUD_FOLDER = Path(TILE_FOLDER) / "openweather"
+# hishel store which kept cloud tiles before TileCache
+LEGACY_CLOUD_FOLDER = Path(CACHE_FOLDER) / "openweather"
+
+
+@asynccontextmanager
+async def legacy_cloud_lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
+    """Удаляет файлы старого кэша тайлов облачности при запуске"""
+    if LEGACY_CLOUD_FOLDER.exists():
+        await asyncio.to_thread(shutil.rmtree, LEGACY_CLOUD_FOLDER, True)
+    yield
+
+
+cloud_tiles = TileCache(
+    "openweather",
+    TileStore(CLOUD_FOLDER),
+    fetch_cloud_tile,
+    ttl=TTL,
+    max_bytes=CLOUD_MEMORY_BYTES,
+    warm=warm_cloud_tiles,
+)
+registry.register(cloud_tiles)
+
+cloud_variants = TileVariants(
+    "openweather-variants", CLOUD_FOLDER, CLOUD_VARIANT_BYTES
+)
+registry.register(cloud_variants)
+
+cloud_pyramid = TilePyramid(
+    "openweather-pyramid",
+    cloud_tiles,
+    base_zoom=CLOUD_ZOOM,
+    max_bytes=CLOUD_PYRAMID_BYTES,
+    variants=cloud_variants,
+)
+registry.register(cloud_pyramid)
+
+BASE_TILES = [
+    (CLOUD_ZOOM, x, y) for x in range(CLOUD_TILES) for y in range(CLOUD_TILES)
+]
+
+
+async def prefetch_cloud_tiles() -> tuple[int, float]:
+    """Загружает тайлы z=3, которые устареют до следующего запуска
+
+    Запускается refresher'ом за PREFETCH_LEAD секунд до истечения TTL
+    самого старого тайла, поэтому запросы клиентов не ждут OpenWeather
+    """
+    tiles = await cloud_tiles.ensure_fresh(BASE_TILES, PREFETCH_LEAD)
+    oldest = min(tile.fetched_at for tile in tiles)
+    return len(tiles), oldest + TTL - PREFETCH_LEAD
+
+
+cloud_snapshot = AsyncSnapshot("openweather-clouds", prefetch_cloud_tiles)
+
+
+@router.get(
+    "/cloud-map/{z}/{x}/{y}",
+    response_class=Response,
+    responses={200: {"content": {"image/png": {}}}},
+)
+async def api_cloud_map(
+    request: Request,
+    _: NotModifiedDep,
+    z: Annotated[int, PathParam(ge=CLOUD_ZOOM, le=CLOUD_MAX_ZOOM)],
+    x: Annotated[int, PathParam(ge=0)],
+    y: Annotated[int, PathParam(ge=0)],
+    accept: Annotated[str, Header()] = "image/png",
+):
+    """Получение тайлов облачнсти от OpenWeatherMap
+
+    Тайлы z>3 вырезаются из тайла z=3 и увеличиваются без запросов
+    к OpenWeatherMap
+
+    Клиентам с `image/webp` в заголовке `Accept` тайл отдается в PNG
+    с палитрой из 256 цветов.
+    Перекодированный тайл z=3 хранится на диске рядом с исходным
+
+    - **Источник**: openweathermap.org
+    - **Cache TTL**: 30 минут, тайлы обновляются в фоне до истечения TTL
+    - **Cache Size**: 16 МБ тайлов z=3 в памяти и на диске,
+    32 МБ тайлов z>3 в памяти
+    """
+    if x >= 2**z or y >= 2**z:
+        raise HTTPException(status_code=404, detail="Tile not found")
+    tile = await cloud_pyramid.get((z, x, y), negotiate_format(accept))
+    return tile.payload.response(request)
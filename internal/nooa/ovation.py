@@ -0,0 +1,254 @@
+import json
+import struct
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import TYPE_CHECKING, Iterable, Iterator, Self
+
+from pydantic import BaseModel, Field, field_validator, model_validator
+
+if TYPE_CHECKING:
+    from internal.nooa.nooa_req import NooaAuroraRes
+
+# OVATION grid is fixed: lon 0..359, lat -90..90 with 1 degree step
+LON_SIZE = 360
+LAT_SIZE = 181
+LAT_OFFSET = 90
+GRID_SIZE = LON_SIZE * LAT_SIZE
+MAX_GRID_VERSIONS = 24
+# strides served by /aurora-map, others are rounded down to keep few variants
+MAP_STRIDES = (1, 2, 3, 5, 10, 15, 30)
+
+
+def grid_index(lon: int, lat: int) -> int:
+    """Индекс ячейки в сетке OVATION, lon может быть в диапазоне -180..360"""
+    return (lon % LON_SIZE) * LAT_SIZE + lat + LAT_OFFSET
+
+
+class OvationGrid:
+    """Декодированная сетка OVATION
+
+    Вероятности хранятся в компактном uint8 массиве в порядке исходного
+    json (lon, lat), поэтому поиск значения по координатам занимает O(1)
+    """
+
+    __slots__ = ("observation_time", "forecast_time", "data")
+
+    def __init__(
+        self,
+        observation_time: datetime,
+        forecast_time: datetime,
+        data: bytes,
+    ):
+        if len(data) != GRID_SIZE:
+            raise ValueError(f"Invalid grid size: {len(data)}")
+        self.observation_time = observation_time
+        self.forecast_time = forecast_time
+        self.data = data
+
+    def probability(self, lon: int, lat: int) -> int:
+        return self.data[grid_index(lon, lat)]
+
+    @classmethod
+    def from_coordinates(
+        cls,
+        observation_time: datetime,
+        forecast_time: datetime,
+        coordinates: Iterable[list[int]],
+    ) -> "OvationGrid":
+        data = bytearray(GRID_SIZE)
+        for lon, lat, aurora in coordinates:
+            data[grid_index(lon, lat)] = aurora
+        return cls(observation_time, forecast_time, bytes(data))
+
+    @classmethod
+    def from_res(cls, res: "NooaAuroraRes") -> "OvationGrid":
+        return cls.from_coordinates(
+            res.Observation_Time,
+            res.Forecast_Time,
+            res.coordinates,
+        )
+
+    @classmethod
+    def from_json(cls, content: bytes) -> "OvationGrid":
+        # skip pydantic validation of ~65k coordinates, grid is fixed anyway
+        raw = json.loads(content)
+        return cls.from_coordinates(
+            datetime.fromisoformat(raw["Observation Time"]),
+            datetime.fromisoformat(raw["Forecast Time"]),
+            raw["coordinates"],
+        )
+
+
+class GridHistory:
+    """Последние версии сетки OVATION по Observation Time
+
+    Нужны для ответа на опрос с since=: клиенту отдаются только
+    изменившиеся ячейки относительно уже загруженной им версии
+    """
+
+    def __init__(self, maxsize: int = MAX_GRID_VERSIONS):
+        self.maxsize = maxsize
+        self._grids: OrderedDict[int, OvationGrid] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._grids)
+
+    def add(self, grid: OvationGrid):
+        key = int(grid.observation_time.timestamp())
+        self._grids[key] = grid
+        self._grids.move_to_end(key)
+        while len(self._grids) > self.maxsize:
+            self._grids.popitem(last=False)
+
+    def get(self, observation_time: datetime) -> OvationGrid | None:
+        return self._grids.get(int(observation_time.timestamp()))
+
+
+class AuroraMapQuery(BaseModel):
+    """Фильтр карты OVATION: регион, шаг сетки и минимальная вероятность"""
+
+    lat_min: int = Field(default=-LAT_OFFSET, ge=-LAT_OFFSET, le=LAT_OFFSET)
+    lat_max: int = Field(default=LAT_OFFSET, ge=-LAT_OFFSET, le=LAT_OFFSET)
+    # lon_min > lon_max means region crosses 0 meridian
+    lon_min: int = Field(default=0, ge=-180, le=LON_SIZE - 1)
+    lon_max: int = Field(default=LON_SIZE - 1, ge=-180, le=LON_SIZE - 1)
+    stride: int = Field(default=1, ge=1, le=30)
+    min_probability: int = Field(default=0, ge=0, le=100)
+
+    model_config = {"frozen": True}
+
+    @field_validator("stride")
+    @classmethod
+    def round_stride(cls, stride: int) -> int:
+        return max(s for s in MAP_STRIDES if s <= stride)
+
+    @model_validator(mode="after")
+    def check_lat(self) -> Self:
+        if self.lat_min > self.lat_max:
+            raise ValueError("lat_min must be less or equal to lat_max")
+        return self
+
+    def lons(self) -> list[int]:
+        lon_max = self.lon_max
+        if self.lon_min > lon_max:
+            lon_max += LON_SIZE
+        lons = range(self.lon_min, lon_max + 1, self.stride)
+        return list(dict.fromkeys(lon % LON_SIZE for lon in lons))
+
+    def lats(self) -> range:
+        return range(self.lat_min, self.lat_max + 1, self.stride)
+
+
+def filter_grid(
+    grid: OvationGrid,
+    query: AuroraMapQuery,
+) -> Iterator[list[int]]:
+    lats = query.lats()
+    for lon in query.lons():
+        offset = lon * LAT_SIZE + LAT_OFFSET
+        for lat in lats:
+            aurora = grid.data[offset + lat]
+            if aurora >= query.min_probability:
+                yield [lon, lat, aurora]
+
+
+def format_time(dt: datetime) -> str:
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+@lru_cache(maxsize=64)
+def aurora_map_json(grid: OvationGrid, query: AuroraMapQuery) -> bytes:
+    """Сериализованная карта в формате ovation_aurora_latest.json
+
+    Кэшируется для каждой сетки, поэтому вариант карты строится один раз
+    на обновление данных из nooa
+    """
+    return json.dumps(
+        {
+            "Observation Time": format_time(grid.observation_time),
+            "Forecast Time": format_time(grid.forecast_time),
+            "Data Format": "[Longitude, Latitude, Aurora]",
+            "coordinates": list(filter_grid(grid, query)),
+        },
+        separators=(",", ":"),
+    ).encode()
+
+
+def changed_cells(base: bytes, data: bytes) -> Iterator[int]:
+    """Индексы ячеек, значения которых отличаются между сетками"""
+    # whole lon columns are compared first, most of them do not change
+    for start in range(0, GRID_SIZE, LAT_SIZE):
+        end = start + LAT_SIZE
+        if base[start:end] == data[start:end]:
+            continue
+        for i in range(start, end):
+            if base[i] != data[i]:
+                yield i
+
+
+@lru_cache(maxsize=16)
+def aurora_delta_json(base: OvationGrid, grid: OvationGrid) -> bytes:
+    """Изменения карты относительно base: пары [индекс ячейки, вероятность]
+
+    Индекс ячейки - lon * 181 + lat + 90, как в grid_index
+    """
+    changes = [[i, grid.data[i]] for i in changed_cells(base.data, grid.data)]
+    return json.dumps(
+        {
+            "Observation Time": format_time(grid.observation_time),
+            "Forecast Time": format_time(grid.forecast_time),
+            "Base Observation Time": format_time(base.observation_time),
+            "Data Format": "[Index, Aurora]",
+            "changes": changes,
+        },
+        separators=(",", ":"),
+    ).encode()
+
+
+# magic, version, stride, reserved, observation time, forecast time (unix ts),
+# first lon, first lat, lon count, lat count
+MAP_BIN_HEADER = struct.Struct("<4sBBHqqhhHH")
+MAP_BIN_MAGIC = b"OVAT"
+MAP_BIN_VERSION = 1
+
+
+@lru_cache(maxsize=64)
+def aurora_map_bin(grid: OvationGrid, query: AuroraMapQuery) -> bytes:
+    """Бинарная карта: заголовок MAP_BIN_HEADER и uint8 растр
+
+    Растр записан по долготам (lon-major), как и исходный json:
+    значение ячейки (i, j) находится по смещению i * lat_count + j,
+    где lon = (first_lon + i * stride) % 360, lat = first_lat + j * stride.
+    Ячейки с вероятностью меньше min_probability записываются как 0
+    """
+    lons = query.lons()
+    lats = query.lats()
+    header = MAP_BIN_HEADER.pack(
+        MAP_BIN_MAGIC,
+        MAP_BIN_VERSION,
+        query.stride,
+        0,
+        int(grid.observation_time.timestamp()),
+        int(grid.forecast_time.timestamp()),
+        lons[0],
+        lats[0],
+        len(lons),
+        len(lats),
+    )
+    lat_start = lats[0] + LAT_OFFSET
+    lat_stop = lats[-1] + LAT_OFFSET + 1
+    raster = b"".join(
+        grid.data[
+            lon * LAT_SIZE
+            + lat_start : lon * LAT_SIZE
+            + lat_stop : query.stride
+        ]
+        for lon in lons
+    )
+    if query.min_probability:
+        table = bytes(
+            v if v >= query.min_probability else 0 for v in range(256)
+        )
+        raster = raster.translate(table)
+    return header + raster
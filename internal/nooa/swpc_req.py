@@ -1,13 +1,74 @@
+import asyncio
+import json
 from datetime import datetime
-from typing import Annotated
+from typing import Annotated, TypeVar
 
 import hishel
+import httpx
 from fastapi import Depends
 from pydantic import BaseModel, Field
 
+from internal.refresher import AsyncSnapshot, cache_expires_at
+from internal.registry import StorageNamespace, registry
+from internal.single_flight import async_upstream
+from internal.storage import AsyncPersistentStorage
+
+TTL = 3600
+
 controller = hishel.Controller(force_cache=True)
-storage = hishel.InMemoryStorage(capacity=64, ttl=3600)
-client = hishel.CacheClient(storage=storage, controller=controller)
+storage = AsyncPersistentStorage("swpc", ttl=TTL)
+client = hishel.AsyncCacheClient(storage=storage, controller=controller)
+
+
+M = TypeVar("M", bound=BaseModel)
+
+FIRST_RECORD_CHUNK = 4096
+_decoder = json.JSONDecoder()
+
+
+async def get_swpc(url: str) -> httpx.Response:
+    return await async_upstream.do(url, lambda: client.get(url))
+
+
+def first_record(content: bytes) -> dict:
+    """Первый элемент JSON массива без разбора всего массива
+
+    Лента dscovr_mag_1s содержит тысячи записей, а нужна только первая,
+    поэтому декодируется только начало ответа
+    """
+    start = content.index(b"[") + 1
+    size = FIRST_RECORD_CHUNK
+    while True:
+        chunk = content[start : start + size]
+        try:
+            text = chunk.decode()
+            record, _ = _decoder.raw_decode(
+                text, len(text) - len(text.lstrip())
+            )
+            break
+        except ValueError:
+            # record (or multibyte char) is cut by the chunk boundary
+            if start + size >= len(content):
+                raise
+            size *= 2
+    if not isinstance(record, dict):
+        raise ValueError("Expected array of objects")
+    return record
+
+
+async def fetch_latest(
+    snapshot: AsyncSnapshot[M],
+    url: str,
+    model: type[M],
+    name: str,
+) -> tuple[M, float]:
+    res = await get_swpc(url)
+    if res.status_code != 200:
+        raise Exception(f"Failed to get data from swpc ({name})")
+    expires_at = cache_expires_at(res, TTL)
+    if snapshot.value is not None and res.extensions.get("from_cache"):
+        return snapshot.value, expires_at
+    return model.model_validate(first_record(res.content)), expires_at
 
 
 class SwpcDstReq(BaseModel):
@@ -15,17 +76,16 @@ class SwpcDstReq(BaseModel):
     time_tag: datetime
 
 
-def use_dst_client() -> SwpcDstReq:
-    res = client.get(
-        "https://services.swpc.noaa.gov/json/geospace/geospace_dst_1_hour.json"
-    )
-    if res.status_code != 200:
-        raise Exception("Failed to get data from swpc (dst client)")
-    data = res.json()[0]
-    return SwpcDstReq.model_validate(data)
+DST_URL = (
+    "https://services.swpc.noaa.gov/json/geospace/geospace_dst_1_hour.json"
+)
+
 
+async def fetch_dst() -> tuple[SwpcDstReq, float]:
+    return await fetch_latest(dst_snapshot, DST_URL, SwpcDstReq, "dst client")
 
-DstDep = Annotated[SwpcDstReq, Depends(use_dst_client)]
+
+dst_snapshot = AsyncSnapshot("swpc-dst", fetch_dst)
 
 
 class SwpcBzReq(BaseModel):
@@ -34,17 +94,14 @@ class SwpcBzReq(BaseModel):
     time_tag: datetime
 
 
-def use_bz_client() -> SwpcBzReq:
-    res = client.get(
-        "https://services.swpc.noaa.gov/json/dscovr/dscovr_mag_1s.json"
-    )
-    if res.status_code != 200:
-        raise Exception("Failed to get data from swpc (bz client)")
-    data = res.json()[0]
-    return SwpcBzReq.model_validate(data)
+BZ_URL = "https://services.swpc.noaa.gov/json/dscovr/dscovr_mag_1s.json"
+
+
+async def fetch_bz() -> tuple[SwpcBzReq, float]:
+    return await fetch_latest(bz_snapshot, BZ_URL, SwpcBzReq, "bz client")
 
 
-BzDep = Annotated[SwpcBzReq, Depends(use_bz_client)]
+bz_snapshot = AsyncSnapshot("swpc-bz", fetch_bz)
 
 
 class SwpcKpReq(BaseModel):
@@ -52,14 +109,31 @@ class SwpcKpReq(BaseModel):
     time_tag: datetime
 
 
-def use_kp_client() -> SwpcKpReq:
-    res = client.get(
-        "https://services.swpc.noaa.gov/json/planetary_k_index_1m.json"
+KP_URL = "https://services.swpc.noaa.gov/json/planetary_k_index_1m.json"
+
+
+async def fetch_kp() -> tuple[SwpcKpReq, float]:
+    return await fetch_latest(kp_snapshot, KP_URL, SwpcKpReq, "kp client")
+
+
+kp_snapshot = AsyncSnapshot("swpc-kp", fetch_kp)
+
+
+SwpcFeeds = tuple[SwpcDstReq, SwpcBzReq, SwpcKpReq]
+
+
+async def use_swpc_feeds() -> SwpcFeeds:
+    # fastapi resolves dependencies one by one, so gather them here
+    return await asyncio.gather(
+        dst_snapshot.get(),
+        bz_snapshot.get(),
+        kp_snapshot.get(),
     )
-    if res.status_code != 200:
-        raise Exception("Failed to get data from swpc (kp client)")
-    data = res.json()[0]
-    return SwpcKpReq.model_validate(data)
 
 
-KpDep = Annotated[SwpcKpReq, Depends(use_kp_client)]
+SwpcFeedsDep = Annotated[SwpcFeeds, Depends(use_swpc_feeds)]
+
+
+registry.register(
+    StorageNamespace(storage, [dst_snapshot, bz_snapshot, kp_snapshot])
+)
@@ -0,0 +1,71 @@
+from datetime import timedelta
+
+from internal.nooa.archive import OvationArchive
+from internal.nooa.ovation import GRID_SIZE, OvationGrid
+from tests.fixtures.ovation import OBSERVATION_TIME as START
+from tests.fixtures.ovation import make_grid
+
+
+def hourly_grid(hour: int, aurora: int) -> OvationGrid:
+    return make_grid([[33, 69, aurora]], START + timedelta(hours=hour))
+
+
+def test_archive_append(tmp_path):
+    archive = OvationArchive(tmp_path)
+    assert len(archive) == 0
+    assert archive.append(hourly_grid(0, 10))
+    assert archive.append(hourly_grid(1, 20))
+    # same or older forecast is skipped
+    assert not archive.append(hourly_grid(1, 30))
+    assert not archive.append(hourly_grid(0, 30))
+    assert len(archive) == 2
+
+
+def test_archive_series(tmp_path):
+    archive = OvationArchive(tmp_path)
+    for hour in range(5):
+        archive.append(hourly_grid(hour, hour * 10))
+
+    rows = archive.series(
+        33, 69, START + timedelta(hours=2), START + timedelta(hours=4)
+    )
+    assert rows == [
+        (START + timedelta(hours=1), START + timedelta(hours=2), 10),
+        (START + timedelta(hours=2), START + timedelta(hours=3), 20),
+        (START + timedelta(hours=3), START + timedelta(hours=4), 30),
+    ]
+    assert archive.series(0, 0, START, START + timedelta(days=1)) == [
+        (row[0], row[1], 0)
+        for row in archive.series(33, 69, START, START + timedelta(days=1))
+    ]
+    assert archive.series(33, 69, START - timedelta(days=1), START) == []
+
+
+def test_archive_retention(tmp_path):
+    archive = OvationArchive(tmp_path, max_frames=10)
+    reader = OvationArchive(tmp_path)
+    for hour in range(11):
+        archive.append(hourly_grid(hour, hour))
+    assert len(reader) == 11
+    # 10% over the limit, oldest grids are dropped
+    archive.append(hourly_grid(11, 11))
+    assert (tmp_path / "frames.bin").stat().st_size == 10 * GRID_SIZE
+    assert len(archive) == 10
+    # reader notices the compacted files
+    rows = reader.series(33, 69, START, START + timedelta(days=1))
+    assert [row[2] for row in rows] == list(range(2, 12))
+    assert not reader.append(hourly_grid(11, 30))
+    assert reader.append(hourly_grid(12, 12))
+    assert len(archive) == 11
+
+
+def test_archive_reopen(tmp_path):
+    archive = OvationArchive(tmp_path)
+    archive.append(hourly_grid(0, 10))
+    reader = OvationArchive(tmp_path)
+    assert len(reader) == 1
+    # picks up frames written by another instance
+    archive.append(hourly_grid(1, 20))
+    rows = reader.series(33, 69, START, START + timedelta(days=1))
+    assert [row[2] for row in rows] == [10, 20]
+    assert not reader.append(hourly_grid(1, 30))
@@ -0,0 +1,49 @@
+from internal.nooa.aurora_tiles import (
+    PALETTE,
+    TILE_SIZE,
+    TRANSPARENCY,
+    TileLRU,
+    render_tile,
+)
+from internal.png import decode_png, is_palette_png
+from tests.fixtures.ovation import make_grid
+
+
+def test_render_tile_whole_world():
+    # Murmansk, lon 33 lat 69
+    grid = make_grid([[33, 69, 40]])
+    content = render_tile(grid, 0, 0, 0)
+    assert is_palette_png(content)
+    width, rows = decode_png(content)
+    assert width == len(rows) == TILE_SIZE
+    pixels = [[row[i : i + 4] for i in range(0, len(row), 4)] for row in rows]
+    # zero probability is fully transparent
+    hits = [
+        (px, py)
+        for py, row in enumerate(pixels)
+        for px, v in enumerate(row)
+        if v[3]
+    ]
+    assert hits
+    color = PALETTE[40 * 3 : 40 * 3 + 3] + TRANSPARENCY[40:41]
+    assert {pixels[py][px] for px, py in hits} == {color}
+    # lon 33 is right of the tile center, lat 69 is in the upper half
+    assert all(128 < px < 160 and py < 70 for px, py in hits)
+    assert TRANSPARENCY[0] == 0
+    assert TRANSPARENCY[40] > 0
+
+
+def test_tile_lru():
+    tiles = TileLRU(maxsize=2)
+    grid = make_grid([[33, 69, 40]])
+    first = tiles.get(grid, (0, 0, 0), 10)
+    assert tiles.get(grid, (0, 0, 0), 20) is first
+    assert first.expires_at == 20
+    tiles.get(grid, (1, 0, 0), 20)
+    tiles.get(grid, (1, 1, 0), 20)
+    assert len(tiles) == 2
+    assert tiles.get(grid, (0, 0, 0), 20) is not first
+
+    # new forecast time drops every tile of the old grid
+    tiles.get(make_grid([[33, 69, 50]], hours=2), (1, 1, 0), 20)
+    assert len(tiles) == 1
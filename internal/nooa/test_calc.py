@@ -1,5 +1,22 @@
-from internal.nooa.calc import nearst_aurora_probability
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from internal.nooa import calc, swpc_req
+from internal.nooa.calc import (
+    AuroraModelMapQuery,
+    AuroraProbabilityBody,
+    aurora_probability,
+    aurora_probability_grid,
+    cached_aurora_probability_grid,
+    nearst_aurora_probability,
+)
 from internal.nooa.nooa_req import NooaAuroraRes
+from internal.nooa.ovation import OvationGrid
 from internal.routers.api_router import NooaAuroraReq
 
 
@@ -9,16 +26,18 @@ def test_nearest_aurora():
             lat=55.75,
             lon=89.62,
         ),
-        prob_map=NooaAuroraRes(
-            Observation_Time="2025-01-11T15:06:00Z",
-            Forecast_Time="2025-01-11T16:06:00Z",
-            Data_Format="[Longitude, Latitude, Aurora]",
-            coordinates=[
-                [89, 54, 3],
-                [90, 55, 4],
-                [90, 56, 5],
-                [91, 57, 6],
-            ],
+        prob_map=OvationGrid.from_res(
+            NooaAuroraRes(
+                Observation_Time="2025-01-11T15:06:00Z",
+                Forecast_Time="2025-01-11T16:06:00Z",
+                Data_Format="[Longitude, Latitude, Aurora]",
+                coordinates=[
+                    [89, 54, 3],
+                    [90, 55, 4],
+                    [90, 56, 5],
+                    [91, 57, 6],
+                ],
+            )
         ),
     )
     assert prob_map.probability == 5
@@ -32,18 +51,120 @@ def test_nearest_aurora_neg_lon():
             lat=55.75,
             lon=-89.62,
         ),
-        prob_map=NooaAuroraRes(
-            Observation_Time="2025-01-11T15:06:00Z",
-            Forecast_Time="2025-01-11T16:06:00Z",
-            Data_Format="[Longitude, Latitude, Aurora]",
-            coordinates=[
-                [269, 54, 3],
-                [270, 55, 4],
-                [270, 56, 5],
-                [271, 56, 6],
-            ],
+        prob_map=OvationGrid.from_res(
+            NooaAuroraRes(
+                Observation_Time="2025-01-11T15:06:00Z",
+                Forecast_Time="2025-01-11T16:06:00Z",
+                Data_Format="[Longitude, Latitude, Aurora]",
+                coordinates=[
+                    [269, 54, 3],
+                    [270, 55, 4],
+                    [270, 56, 5],
+                    [271, 56, 6],
+                ],
+            )
         ),
     )
     assert prob_map.probability == 5
     assert prob_map.lat == 56
     assert prob_map.lon == -90
+
+
+def make_feeds(dst: float, bz_gse: float, kp: int) -> swpc_req.SwpcFeeds:
+    time_tag = datetime(2025, 1, 11, 15, 0)
+    return (
+        swpc_req.SwpcDstReq(dst=dst, time_tag=time_tag),
+        swpc_req.SwpcBzReq(bz_gsm=bz_gse, bz_gse=bz_gse, time_tag=time_tag),
+        swpc_req.SwpcKpReq(kp_index=kp, time_tag=time_tag),
+    )
+
+
+@pytest.mark.parametrize(
+    "feeds",
+    [make_feeds(-20, 3.5, 4), make_feeds(-80, -6.2, 7), make_feeds(0, 0, 0)],
+)
+def test_aurora_probability_grid_matches_scalar(feeds):
+    at = datetime(2025, 1, 11, 21, 37, tzinfo=timezone.utc)
+    grid = aurora_probability_grid(*feeds, at, speed=500, clouds=20)
+    assert grid.forecast_time == at
+    for lon in range(0, 360, 7):
+        # solar local time on this longitude
+        local_time = at.astimezone(timezone(timedelta(minutes=lon * 4)))
+        for lat in range(-90, 91, 3):
+            expected = aurora_probability(
+                AuroraProbabilityBody(local_time=local_time, lat=lat, lon=lon),
+                *feeds,
+                speed=500,
+                clouds=20,
+            ).probability
+            assert grid.probability(lon, lat) == round(expected)
+
+
+def test_cached_aurora_probability_grid():
+    feeds = make_feeds(-20, -3.5, 5)
+    at = datetime(2025, 1, 11, 21, 37, tzinfo=timezone.utc)
+    params = (450, 30)
+    grid = cached_aurora_probability_grid(*feeds, at, *params)
+    # same 4 minute slot reuses the grid
+    same = at + timedelta(minutes=2)
+    assert cached_aurora_probability_grid(*feeds, same, *params) is grid
+    later = at + timedelta(minutes=4)
+    assert cached_aurora_probability_grid(*feeds, later, *params) is not grid
+    other = make_feeds(-20, -3.5, 6)
+    assert cached_aurora_probability_grid(*other, at, *params) is not grid
+
+
+def test_cached_aurora_probability_grid_lru(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(calc, "MAX_MODEL_GRIDS", 2)
+    monkeypatch.setattr(calc, "_model_grids", OrderedDict())
+    feeds = make_feeds(-20, -3.5, 5)
+    at = datetime(2025, 1, 11, 21, 37, tzinfo=timezone.utc)
+    first = cached_aurora_probability_grid(*feeds, at, 450, 30)
+    cached_aurora_probability_grid(*feeds, at, 450, 40)
+    # recently used grid survives, the least recently used one is evicted
+    assert cached_aurora_probability_grid(*feeds, at, 450, 30) is first
+    cached_aurora_probability_grid(*feeds, at, 450, 50)
+    assert len(calc._model_grids) == 2
+    assert cached_aurora_probability_grid(*feeds, at, 450, 30) is first
+
+
+def test_cached_aurora_probability_grid_builds(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(calc, "_model_grids", OrderedDict())
+    builds: list[float] = []
+    running = [0, 0]
+    lock = threading.Lock()
+
+    def build(*args) -> OvationGrid:
+        with lock:
+            builds.append(args[-1])
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return aurora_probability_grid(*args)
+
+    monkeypatch.setattr(calc, "aurora_probability_grid", build)
+    feeds = make_feeds(-20, -3.5, 5)
+    at = datetime(2025, 1, 11, 21, 37, tzinfo=timezone.utc)
+    with ThreadPoolExecutor(4) as pool:
+        grids = list(
+            pool.map(
+                lambda clouds: cached_aurora_probability_grid(
+                    *feeds, at, 450, clouds
+                ),
+                [30, 30, 40, 40],
+            )
+        )
+    # one build per key, builds of different keys run in parallel
+    assert sorted(builds) == [30, 40]
+    assert running[1] == 2
+    assert grids[0] is grids[1] and grids[2] is grids[3]
+
+
+def test_aurora_model_map_query_rounding():
+    q = AuroraModelMapQuery(speed=454.9, clouds=32.4)
+    assert (q.speed, q.clouds) == (450, 30)
+    assert q == AuroraModelMapQuery()
@@ -0,0 +1,35 @@
+from internal.db.models import Cities
+from internal.nooa.calc import NooaAuroraReq, nearst_aurora_probability
+from internal.nooa.city_table import CityTable
+from tests.fixtures.ovation import make_grid
+
+
+def test_city_table_matches_nearest_probability():
+    cities = [
+        Cities(id=1, name="Murmansk", lat=68.9792, long=33.0925),
+        Cities(id=2, name="Kirov", lat=58.6, long=49.6),
+        Cities(id=3, name="Anchorage", lat=61.2, long=-149.9),
+    ]
+    grid = make_grid([[33, 69, 40], [50, 59, 10], [210, 61, 25]])
+    table = CityTable()
+    table.set_cities(cities)
+    probabilities = table.table(grid).as_dict()
+    assert probabilities == {1: 40, 2: 10, 3: 25}
+    for c in cities:
+        pos = NooaAuroraReq(lat=c.lat, lon=c.long)
+        assert probabilities[c.id] == (
+            nearst_aurora_probability(pos, grid).probability
+        )
+
+
+def test_city_table_rebuilt_on_change():
+    grid = make_grid([[33, 69, 40]])
+    table = CityTable()
+    table.set_cities([Cities(id=1, name="Murmansk", lat=69, long=33)])
+    first = table.table(grid)
+    assert table.table(grid) is first
+
+    table.set_cities([Cities(id=2, name="Kirov", lat=58.6, long=49.6)])
+    assert table.table(grid).as_dict() == {2: 0}
+    new_grid = make_grid([[50, 59, 10]])
+    assert table.table(new_grid).as_dict() == {2: 10}
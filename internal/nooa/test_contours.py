@@ -0,0 +1,53 @@
+import json
+
+from internal.nooa.contours import (
+    aurora_contours_json,
+    contains,
+    level_polygons,
+    ring_area,
+)
+from internal.nooa.ovation import OvationGrid
+from tests.fixtures.ovation import make_grid
+
+
+def ring_grid() -> OvationGrid:
+    # square ring around lon 20, lat 60: 50% band with an empty center
+    coordinates = []
+    for lon in range(10, 31):
+        for lat in range(50, 71):
+            edge = max(abs(lon - 20), abs(lat - 60))
+            coordinates.append([lon, lat, 50 if 4 <= edge <= 8 else 0])
+    return make_grid(coordinates)
+
+
+def test_level_polygons_hole():
+    polygons = level_polygons(ring_grid(), 30, tolerance=0.1)
+    assert len(polygons) == 1
+    outer, hole = polygons[0]
+    assert outer[0] == outer[-1] and hole[0] == hole[-1]
+    # geojson winding: counterclockwise exterior, clockwise hole
+    assert ring_area(outer) > 0 > ring_area(hole)
+    assert contains(outer, (20, 53)) and not contains(hole, (20, 53))
+    assert contains(hole, (20, 60))
+    assert max(x for x, _ in outer) <= 29 and min(x for x, _ in outer) >= 11
+    assert not level_polygons(ring_grid(), 60)
+
+
+def test_level_polygons_antimeridian():
+    grid = make_grid([[lon, 70, 80] for lon in range(360)])
+    polygons = level_polygons(grid, 10)
+    assert len(polygons) == 1
+    xs = [x for x, _ in polygons[0][0]]
+    assert (min(xs), max(xs)) == (-180, 180)
+
+
+def test_aurora_contours_json():
+    res = json.loads(aurora_contours_json(ring_grid(), (10, 60)))
+    assert res["type"] == "FeatureCollection"
+    assert res["forecast_time"] == "2025-01-11T16:06:00Z"
+    assert [f["properties"]["probability"] for f in res["features"]] == [
+        10,
+        60,
+    ]
+    assert len(res["features"][0]["geometry"]["coordinates"]) == 1
+    assert res["features"][1]["geometry"]["coordinates"] == []
@@ -1,4 +1,25 @@
-from .nooa_parser import parse_kp_3_forecast, parse_kp_27_outlook
+from datetime import date
+from pathlib import Path
+
+import pytest
+from pydantic import TypeAdapter
+
+from .nooa_parser import (
+    Kp3Column,
+    Kp3Value,
+    Kp27Record,
+    NooaAuroraKp3Col,
+    parse_kp_3_forecast,
+    parse_kp_27_outlook,
+    tokenize_kp_3_forecast,
+    tokenize_kp_27_outlook,
+)
+
+TESTDATA = Path(__file__).parent / "testdata"
+
+
+def read_testdata(name: str) -> str:
+    return (TESTDATA / name).read_text()
 
 
 def test_parse_kp_3_forecast():
@@ -358,3 +379,29 @@ def test_parse_kp_27_outlook():
             "largest_kp_index": 3,
         },
     ]
+
+
+def test_tokenize_kp_3_forecast():
+    data = read_testdata("3-day-forecast-g.txt")
+    cols = tokenize_kp_3_forecast(data)
+    assert [c.date for c in cols] == ["Jan 23", "Jan 24", "Jan 25"]
+    assert cols[2].values[1] == Kp3Value("03-06UT", 5.33)
+    # response json is dumped straight from records
+    assert TypeAdapter(list[Kp3Column]).dump_json(cols) == (
+        TypeAdapter(list[NooaAuroraKp3Col]).dump_json(parse_kp_3_forecast(data))
+    )
+
+
+def test_tokenize_kp_3_forecast_missing_value():
+    data = read_testdata("3-day-forecast.txt").replace(
+        "06-09UT       1.00         1.33         1.67",
+        "06-09UT       1.00         1.33",
+    )
+    with pytest.raises(ValueError):
+        tokenize_kp_3_forecast(data)
+
+
+def test_tokenize_kp_27_outlook():
+    rows = tokenize_kp_27_outlook(read_testdata("27-day-outlook.txt"))
+    assert rows[0] == Kp27Record(date(2025, 1, 6), 172, 22, 5)
+    assert len(rows) == 3
@@ -0,0 +1,28 @@
+import httpx
+from pydantic import TypeAdapter
+
+from internal.nooa.nooa_req import ParsedText
+
+
+def test_parsed_text_keyed_by_version():
+    calls: list[str] = []
+
+    def parse(text: str) -> list[int]:
+        calls.append(text)
+        return [int(v) for v in text.split()]
+
+    parsed = ParsedText(parse, TypeAdapter(list[int]))
+    res = httpx.Response(200, text="1 2 3", headers={"ETag": '"v1"'})
+    value, payload = parsed.get(res)
+    assert value == [1, 2, 3]
+    assert payload.content == b"[1,2,3]"
+    assert parsed.get(res) == (value, payload)
+    assert len(calls) == 1
+
+    res = httpx.Response(200, text="4 5", headers={"ETag": '"v2"'})
+    assert parsed.get(res)[0] == [4, 5]
+    # without validators the body hash is the version
+    res = httpx.Response(200, text="4 5")
+    parsed.get(res)
+    parsed.get(httpx.Response(200, text="4 5"))
+    assert len(calls) == 3
@@ -0,0 +1,122 @@
+import json
+from datetime import timedelta, timezone
+
+import pytest
+
+from internal.nooa.ovation import (
+    GRID_SIZE,
+    MAP_BIN_HEADER,
+    MAP_BIN_MAGIC,
+    MAP_BIN_VERSION,
+    AuroraMapQuery,
+    GridHistory,
+    OvationGrid,
+    aurora_delta_json,
+    aurora_map_bin,
+    grid_index,
+)
+from tests.fixtures.ovation import OBSERVATION_TIME, make_grid
+
+
+def make_ovation_json(coordinates: list[list[int]]) -> bytes:
+    return json.dumps(
+        {
+            "Observation Time": "2025-01-11T15:06:00Z",
+            "Forecast Time": "2025-01-11T16:06:00Z",
+            "Data Format": "[Longitude, Latitude, Aurora]",
+            "coordinates": coordinates,
+        }
+    ).encode()
+
+
+def test_grid_from_json():
+    grid = OvationGrid.from_json(
+        make_ovation_json([[0, -90, 3], [0, 70, 10], [359, 90, 100]])
+    )
+    assert len(grid.data) == GRID_SIZE
+    assert grid.forecast_time.isoformat() == "2025-01-11T16:06:00+00:00"
+    assert grid.probability(0, -90) == 3
+    assert grid.probability(0, 70) == 10
+    assert grid.probability(359, 90) == 100
+    assert grid.probability(-1, 90) == 100
+    assert grid.probability(360, 70) == 10
+    assert grid.probability(10, 10) == 0
+
+
+def test_grid_invalid_size():
+    with pytest.raises(ValueError):
+        OvationGrid(*[None] * 2, data=b"\x00")  # type: ignore
+
+
+def test_aurora_map_bin():
+    grid = OvationGrid.from_json(
+        make_ovation_json([[0, -90, 3], [0, 70, 10], [359, 90, 100]])
+    )
+    res = aurora_map_bin(grid, AuroraMapQuery())
+    header = MAP_BIN_HEADER.unpack_from(res)
+    assert header == (
+        MAP_BIN_MAGIC,
+        MAP_BIN_VERSION,
+        1,
+        0,
+        int(grid.observation_time.timestamp()),
+        int(grid.forecast_time.timestamp()),
+        0,
+        -90,
+        360,
+        181,
+    )
+    assert res[MAP_BIN_HEADER.size :] == grid.data
+
+    res = aurora_map_bin(
+        grid,
+        AuroraMapQuery(lon_min=350, lon_max=10, stride=10, min_probability=5),
+    )
+    lon_count, lat_count = MAP_BIN_HEADER.unpack_from(res)[-2:]
+    assert (lon_count, lat_count) == (3, 19)
+    raster = res[MAP_BIN_HEADER.size :]
+    # lon 0 is the second column, lat 70 has index 16, lat -90 is below 5
+    assert raster[lat_count + 16] == 10
+    assert sum(raster) == 10
+
+
+def test_aurora_map_query_stride():
+    assert AuroraMapQuery(stride=4).stride == 3
+    assert AuroraMapQuery(stride=29).stride == 15
+    assert AuroraMapQuery(stride=4) == AuroraMapQuery(stride=3)
+
+
+def grid_at(minutes: int, coordinates: list[list[int]]) -> OvationGrid:
+    return make_grid(coordinates, OBSERVATION_TIME + timedelta(minutes=minutes))
+
+
+def test_grid_history():
+    history = GridHistory(maxsize=2)
+    grids = [grid_at(i, []) for i in range(3)]
+    for grid in grids:
+        history.add(grid)
+    assert len(history) == 2
+    assert history.get(grids[0].observation_time) is None
+    assert history.get(grids[2].observation_time) is grids[2]
+    # same instant in another timezone is the same version
+    moscow = timezone(timedelta(hours=3))
+    assert history.get(grids[1].observation_time.astimezone(moscow)) is grids[1]
+
+
+def test_aurora_delta_json():
+    base = grid_at(0, [[0, -90, 3], [33, 69, 40], [359, 90, 100]])
+    grid = grid_at(5, [[0, -90, 3], [33, 69, 45], [359, 90, 0], [1, 0, 7]])
+    res = json.loads(aurora_delta_json(base, grid))
+    assert res["Observation Time"] == "2025-01-11T15:11:00Z"
+    assert res["Base Observation Time"] == "2025-01-11T15:06:00Z"
+    assert res["changes"] == [
+        [grid_index(1, 0), 7],
+        [grid_index(33, 69), 45],
+        [grid_index(359, 90), 0],
+    ]
+    data = bytearray(base.data)
+    for i, aurora in res["changes"]:
+        data[i] = aurora
+    assert data == grid.data
+
+    assert json.loads(aurora_delta_json(grid, grid))["changes"] == []
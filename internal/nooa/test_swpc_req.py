@@ -0,0 +1,72 @@
+import asyncio
+import json
+import time
+
+import hishel
+import httpx
+import pytest
+
+from internal import storage as storage_module
+from internal.nooa import swpc_req
+from internal.nooa.swpc_req import SwpcBzReq, first_record
+from internal.storage import AsyncPersistentStorage
+
+
+def test_first_record():
+    records = [
+        {"time_tag": f"2025-01-11T15:06:{i:02}", "bz_gsm": -i, "bz_gse": i}
+        for i in range(60)
+    ]
+    content = json.dumps(records, indent=2).encode()
+    assert first_record(content) == records[0]
+    assert SwpcBzReq.model_validate(first_record(content)).bz_gsm == 0
+
+
+def test_first_record_long(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(swpc_req, "FIRST_RECORD_CHUNK", 8)
+    record = {"name": "Мурманск" * 10, "dst": -12.5}
+    content = json.dumps([record, record], ensure_ascii=False).encode()
+    assert first_record(content) == record
+
+
+@pytest.mark.parametrize("content", [b"[]", b"[1, 2]", b"{}", b'[{"a": 1'])
+def test_first_record_invalid(content: bytes):
+    with pytest.raises(ValueError):
+        first_record(content)
+
+
+async def test_use_swpc_feeds_concurrent(
+    tmp_path, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(storage_module, "CACHE_FOLDER", str(tmp_path))
+    records = {
+        swpc_req.DST_URL: {"time_tag": "2025-01-11T15:00:00", "dst": -20},
+        swpc_req.BZ_URL: {
+            "time_tag": "2025-01-11T15:06:00",
+            "bz_gsm": -3.5,
+            "bz_gse": -2.5,
+        },
+        swpc_req.KP_URL: {"time_tag": "2025-01-11T15:06:00", "kp_index": 4},
+    }
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(0.2)
+        return httpx.Response(200, json=[records[str(request.url)]])
+
+    client = hishel.AsyncCacheClient(
+        storage=AsyncPersistentStorage("swpc", ttl=swpc_req.TTL),
+        controller=swpc_req.controller,
+        transport=httpx.MockTransport(handler),
+    )
+    monkeypatch.setattr(swpc_req, "client", client)
+    for s in (
+        swpc_req.dst_snapshot,
+        swpc_req.bz_snapshot,
+        swpc_req.kp_snapshot,
+    ):
+        monkeypatch.setattr(s, "value", None)
+
+    started = time.monotonic()
+    dst, bz, kp = await swpc_req.use_swpc_feeds()
+    assert time.monotonic() - started < 0.5
+    assert (dst.dst, bz.bz_gsm, kp.kp) == (-20, -3.5, 4)
@@ -0,0 +1,145 @@
+import gzip
+import hashlib
+import time
+from typing import Annotated
+
+from fastapi import Depends, HTTPException, Request, Response
+
+from internal.registry import DictNamespace, registry
+
+# smaller payloads are not worth compressing
+MIN_COMPRESS_SIZE = 512
+MAX_KNOWN_ETAGS = 4096
+ENCODINGS = ("gzip",)
+
+
+class Payload:
+    """Тело ответа с заранее сжатыми вариантами и сильным ETag
+
+    Создается один раз на обновление данных из внешнего API, после чего
+    ответ клиенту не требует ни сериализации, ни сжатия
+    """
+
+    __slots__ = ("content", "media_type", "etag", "expires_at", "encodings")
+
+    def __init__(
+        self,
+        content: bytes,
+        media_type: str = "application/json",
+        expires_at: float = 0,
+        compress: bool = True,
+    ):
+        self.content = content
+        self.media_type = media_type
+        self.etag = f'"{hashlib.blake2b(content, digest_size=16).hexdigest()}"'
+        # time.time() after which upstream data may change
+        self.expires_at = expires_at
+        self.encodings: dict[str, bytes] = {}
+        # already compressed formats (png) are not worth it either
+        if not compress or len(content) < MIN_COMPRESS_SIZE:
+            return
+        self.encodings["gzip"] = gzip.compress(content, mtime=0)
+
+    def response(self, request: Request) -> Response:
+        accepted = accepted_encodings(request.headers.get("accept-encoding"))
+        encoding = next((e for e in self.encodings if e in accepted), None)
+        # every encoded body is a separate representation with its own etag
+        etag = (
+            self.etag if encoding is None else encoded_etag(self.etag, encoding)
+        )
+        headers = {"ETag": etag, "Vary": "Accept, Accept-Encoding"}
+        if self.expires_at > time.time():
+            remember_etag(request, etag, self.expires_at)
+        if etag_matches(request.headers.get("if-none-match"), self.etag):
+            return Response(status_code=304, headers=headers)
+        if encoding is None:
+            return Response(
+                content=self.content,
+                media_type=self.media_type,
+                headers=headers,
+            )
+        headers["Content-Encoding"] = encoding
+        return Response(
+            content=self.encodings[encoding],
+            media_type=self.media_type,
+            headers=headers,
+        )
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def strip_encoding(etag: str) -> str:
+    """ETag исходного тела для ETag любого из сжатых вариантов"""
+    for encoding in ENCODINGS:
+        suffix = f'-{encoding}"'
+        if etag.endswith(suffix):
+            return etag.removesuffix(suffix) + '"'
+    return etag
+
+
+def accepted_encodings(accept_encoding: str | None) -> set[str]:
+    if not accept_encoding:
+        return set()
+    res = set()
+    for item in accept_encoding.split(","):
+        encoding, _, params = item.partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00"):
+            continue
+        res.add(encoding.strip().lower())
+    return res
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, any encoding of the body matches
+    etag = strip_encoding(etag)
+    return etag in (
+        strip_encoding(tag.strip().removeprefix("W/"))
+        for tag in if_none_match.split(",")
+    )
+
+
+# last etag served for each request, valid until upstream data expires
+_known_etags: dict[str, tuple[str, float]] = {}
+# stale etags would keep answering 304 for an invalidated payload
+registry.register(DictNamespace("etags", _known_etags), derived=True)
+
+
+def request_key(request: Request) -> str:
+    return (
+        f"{request.url.path}?{request.url.query}"
+        f"|{request.headers.get('accept', '')}"
+        f"|{request.headers.get('accept-encoding', '')}"
+    )
+
+
+def remember_etag(request: Request, etag: str, expires_at: float):
+    if len(_known_etags) >= MAX_KNOWN_ETAGS:
+        _known_etags.clear()
+    _known_etags[request_key(request)] = (etag, expires_at)
+
+
+async def check_not_modified(request: Request) -> None:
+    """Отвечает 304 по уже известному ETag, не обращаясь к кэшу данных"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return
+    known = _known_etags.get(request_key(request))
+    if known is None:
+        return
+    etag, expires_at = known
+    if expires_at <= time.time():
+        return
+    if etag_matches(if_none_match, etag):
+        raise HTTPException(
+            status_code=304,
+            headers={"ETag": etag, "Vary": "Accept, Accept-Encoding"},
+        )
+
+
+NotModifiedDep = Annotated[None, Depends(check_not_modified)]
@@ -0,0 +1,238 @@
+import struct
+import sys
+import zlib
+from array import array
+from collections import Counter, defaultdict
+from itertools import chain, product
+from typing import Callable
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# bytes per pixel of 8-bit images by color type
+CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+# bits per channel of rgba pixels before picking a palette, fewer bits
+# are used while there are more than MAX_QUANTIZE_COLORS colors
+QUANTIZE_BITS = (5, 4, 3)
+MAX_QUANTIZE_COLORS = 2048
+
+
+def png_chunk(kind: bytes, data: bytes) -> bytes:
+    chunk = kind + data
+    return (
+        struct.pack(">I", len(data))
+        + chunk
+        + struct.pack(">I", zlib.crc32(chunk))
+    )
+
+
+def encode_png(
+    width: int,
+    rows: list[bytes],
+    color_type: int = 6,
+    palette: bytes = b"",
+    transparency: bytes = b"",
+    level: int = 6,
+) -> bytes:
+    """8-битный PNG из строк пикселей без фильтров"""
+    header = struct.pack(">IIBBBBB", width, len(rows), 8, color_type, 0, 0, 0)
+    chunks = [PNG_SIGNATURE, png_chunk(b"IHDR", header)]
+    if palette:
+        chunks.append(png_chunk(b"PLTE", palette))
+    if transparency:
+        chunks.append(png_chunk(b"tRNS", transparency))
+    raw = b"".join(b"\x00" + row for row in rows)
+    chunks.append(png_chunk(b"IDAT", zlib.compress(raw, level)))
+    chunks.append(png_chunk(b"IEND", b""))
+    return b"".join(chunks)
+
+
+def paeth(a: int, b: int, c: int) -> int:
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    return b if pb <= pc else c
+
+
+def unfilter(raw: bytes, width: int, height: int, bpp: int) -> list[bytes]:
+    stride = width * bpp
+    rows = []
+    prev = bytearray(stride)
+    for i in range(height):
+        start = i * (stride + 1)
+        kind = raw[start]
+        row = bytearray(raw[start + 1 : start + 1 + stride])
+        if kind == 1:
+            for j in range(bpp, stride):
+                row[j] = (row[j] + row[j - bpp]) & 0xFF
+        elif kind == 2:
+            row = bytearray((a + b) & 0xFF for a, b in zip(row, prev))
+        elif kind == 3:
+            for j in range(stride):
+                left = row[j - bpp] if j >= bpp else 0
+                row[j] = (row[j] + ((left + prev[j]) >> 1)) & 0xFF
+        elif kind == 4:
+            for j in range(stride):
+                left = row[j - bpp] if j >= bpp else 0
+                up_left = prev[j - bpp] if j >= bpp else 0
+                row[j] = (row[j] + paeth(left, prev[j], up_left)) & 0xFF
+        elif kind != 0:
+            raise ValueError(f"Invalid PNG filter: {kind}")
+        rows.append(bytes(row))
+        prev = row
+    return rows
+
+
+def to_rgba(
+    rows: list[bytes], color_type: int, palette: bytes, transparency: bytes
+) -> list[bytes]:
+    if color_type == 6:
+        return rows
+    if color_type == 3:
+        alpha = transparency + b"\xff" * (256 - len(transparency))
+        table = [
+            palette[i * 3 : i * 3 + 3] + alpha[i : i + 1]
+            for i in range(len(palette) // 3)
+        ]
+        return [b"".join(table[i] for i in row) for row in rows]
+    if color_type == 2:
+        return [
+            b"".join(row[i : i + 3] + b"\xff" for i in range(0, len(row), 3))
+            for row in rows
+        ]
+    if color_type == 0:
+        return [b"".join(bytes((v, v, v, 255)) for v in row) for row in rows]
+    # gray with alpha
+    return [
+        b"".join(
+            bytes((row[i], row[i], row[i], row[i + 1]))
+            for i in range(0, len(row), 2)
+        )
+        for row in rows
+    ]
+
+
+def is_palette_png(content: bytes) -> bool:
+    # color type byte of the IHDR chunk
+    return content.startswith(PNG_SIGNATURE) and content[25:26] == b"\x03"
+
+
+def decode_png(content: bytes) -> tuple[int, list[bytes]]:
+    """Ширина и RGBA строки 8-битного PNG без interlace"""
+    if not content.startswith(PNG_SIGNATURE):
+        raise ValueError("Not a PNG image")
+    pos = len(PNG_SIGNATURE)
+    header, palette, transparency = b"", b"", b""
+    data = []
+    while pos < len(content):
+        (length,) = struct.unpack_from(">I", content, pos)
+        kind = content[pos + 4 : pos + 8]
+        chunk = content[pos + 8 : pos + 8 + length]
+        pos += length + 12
+        if kind == b"IHDR":
+            header = chunk
+        elif kind == b"PLTE":
+            palette = chunk
+        elif kind == b"tRNS":
+            transparency = chunk
+        elif kind == b"IDAT":
+            data.append(chunk)
+        elif kind == b"IEND":
+            break
+    if len(header) != 13:
+        raise ValueError("Missing PNG header")
+    width, height, depth, color_type, _, _, interlace = struct.unpack(
+        ">IIBBBBB", header
+    )
+    if depth != 8 or interlace or color_type not in CHANNELS:
+        raise ValueError(
+            f"Unsupported PNG: depth {depth}, color type {color_type}"
+        )
+    raw = zlib.decompress(b"".join(data))
+    rows = unfilter(raw, width, height, CHANNELS[color_type])
+    return width, to_rgba(rows, color_type, palette, transparency)
+
+
+# palette candidates of a color: its cell of a coarse 2-bit grid and
+# the cells around it
+NEIGHBOUR_CELLS = list(product((-1, 0, 1), repeat=4))
+
+
+def nearest_finder(palette: list[bytes]) -> Callable[[bytes], int]:
+    """Поиск ближайшего цвета палитры среди соседних ячеек грубой сетки"""
+    cells: defaultdict[tuple[int, ...], list[int]] = defaultdict(list)
+    for i, color in enumerate(palette):
+        cells[tuple(v >> 6 for v in color)].append(i)
+
+    def find(color: bytes) -> int:
+        r, g, b, a = (v >> 6 for v in color)
+        candidates = [
+            i
+            for dr, dg, db, da in NEIGHBOUR_CELLS
+            for i in cells.get((r + dr, g + dg, b + db, a + da), ())
+        ] or range(len(palette))
+        return min(
+            candidates,
+            key=lambda i: sum((x - y) ** 2 for x, y in zip(color, palette[i])),
+        )
+
+    return find
+
+
+def quantize(
+    rows: list[bytes], colors: int = 256
+) -> tuple[bytes, bytes, list[bytes]]:
+    """PLTE, tRNS и строки индексов палитры для RGBA строк
+
+    Каналы огрубляются до 5 бит (до 3 бит у очень пестрых изображений),
+    в палитру попадают самые частые цвета, остальные заменяются
+    ближайшим цветом палитры
+    """
+    pixels = [array("I", row) for row in rows]
+    for bits in QUANTIZE_BITS:
+        mask = array("I", bytes([0xFF << (8 - bits) & 0xFF]) * 4)[0]
+        counts = Counter(p & mask for p in chain.from_iterable(pixels))
+        # each color outside of the palette is searched for separately
+        if len(counts) <= MAX_QUANTIZE_COLORS:
+            break
+    rgba = {p: p.to_bytes(4, sys.byteorder) for p in counts}
+    # fully transparent pixels share one palette entry
+    for p, color in rgba.items():
+        if color[3] == 0:
+            rgba[p] = bytes(4)
+    merged: Counter[bytes] = Counter()
+    for p, count in counts.items():
+        merged[rgba[p]] += count
+    palette = [color for color, _ in merged.most_common(colors)]
+    index = {color: i for i, color in enumerate(palette)}
+    find = nearest_finder(palette)
+    for color in merged:
+        if color not in index:
+            index[color] = find(color)
+    lookup = {p: index[color] for p, color in rgba.items()}
+    # restore full range, e.g. 0xf8 -> 0xff
+    expanded = [
+        bytes(v | v >> bits | v >> 2 * bits for v in color) for color in palette
+    ]
+    alpha = bytes(color[3] for color in expanded).rstrip(b"\xff")
+    return (
+        b"".join(color[:3] for color in expanded),
+        alpha,
+        [
+            bytes(map(lookup.__getitem__, (p & mask for p in row)))
+            for row in pixels
+        ],
+    )
+
+
+def encode_png8(width: int, rows: list[bytes]) -> bytes:
+    """PNG с палитрой из 256 цветов из RGBA строк, с потерями"""
+    palette, transparency, indexes = quantize(rows)
+    return encode_png(
+        width,
+        indexes,
+        color_type=3,
+        palette=palette,
+        transparency=transparency,
+        level=9,
+    )
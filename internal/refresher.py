@@ -0,0 +1,223 @@
+import asyncio
+import hashlib
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import AsyncGenerator, Awaitable, Callable, Generic, TypeVar
+
+import httpx
+import structlog
+from fastapi import FastAPI
+
+from internal.settings import REFRESHER_ENABLED, WARMUP_ENABLED, WARMUP_TIMEOUT
+from internal.single_flight import AsyncSingleFlight, SingleFlight
+
+log = structlog.stdlib.get_logger(__name__)
+
+T = TypeVar("T")
+
+# refetch a bit after hishel ttl is over so cache entry is surely expired
+EXPIRE_MARGIN = 1
+MIN_REFRESH_INTERVAL = 5
+RETRY_INTERVAL = 60
+
+
+def cache_expires_at(res: httpx.Response, ttl: int) -> float:
+    """Время (time.time) когда закэшированный ответ будет запрошен заново"""
+    metadata = res.extensions.get("cache_metadata")
+    if not res.extensions.get("from_cache") or metadata is None:
+        return time.time() + ttl
+    created_at: datetime = metadata["created_at"]
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return created_at.timestamp() + ttl
+
+
+def upstream_version(res: httpx.Response) -> str:
+    """Версия ответа внешнего API: ETag, Last-Modified или хэш тела"""
+    for header in ("etag", "last-modified"):
+        value = res.headers.get(header)
+        if value:
+            return f"{header}:{value}"
+    return "blake2b:" + hashlib.blake2b(res.content, digest_size=16).hexdigest()
+
+
+class BaseSnapshot(Generic[T]):
+    """Последнее удачно полученное значение из внешнего API
+
+    Обновляется в фоне через refresher_lifespan, обработчики запросов
+    только читают текущее значение и не ждут внешний API
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.value: T | None = None
+        # time.time() after which upstream data may change
+        self.expires_at: float = 0
+        # time.time() of the last successful refresh
+        self.updated_at: float | None = None
+        snapshots.append(self)
+
+
+class Snapshot(BaseSnapshot[T]):
+    def __init__(self, name: str, fetch: Callable[[], tuple[T, float]]):
+        super().__init__(name)
+        self._fetch = fetch
+
+    def refresh(self) -> T:
+        return refreshes.do(self.name, self._refresh)
+
+    def _refresh(self) -> T:
+        value, expires_at = self._fetch()
+        self.value, self.expires_at = value, expires_at
+        self.updated_at = time.time()
+        return value
+
+    def get(self) -> T:
+        value = self.value
+        if value is None:
+            # refresher is disabled or has not fetched the feed yet
+            value = self.refresh()
+        return value
+
+
+class AsyncSnapshot(BaseSnapshot[T]):
+    """Snapshot для внешних API с асинхронным клиентом"""
+
+    def __init__(
+        self,
+        name: str,
+        fetch: Callable[[], Awaitable[tuple[T, float]]],
+    ):
+        super().__init__(name)
+        self._fetch = fetch
+
+    async def refresh(self) -> T:
+        return await async_refreshes.do(self.name, self._refresh)
+
+    async def _refresh(self) -> T:
+        value, expires_at = await self._fetch()
+        self.value, self.expires_at = value, expires_at
+        self.updated_at = time.time()
+        return value
+
+    async def get(self) -> T:
+        value = self.value
+        if value is None:
+            value = await self.refresh()
+        return value
+
+
+snapshots: list[BaseSnapshot] = []
+# concurrent refreshes of the same snapshot share one fetch
+refreshes = SingleFlight()
+async_refreshes = AsyncSingleFlight()
+
+
+async def refresh_snapshot(snapshot: BaseSnapshot):
+    if isinstance(snapshot, AsyncSnapshot):
+        await snapshot.refresh()
+    elif isinstance(snapshot, Snapshot):
+        await asyncio.to_thread(snapshot.refresh)
+
+
+async def refresh_loop(snapshot: BaseSnapshot):
+    while True:
+        try:
+            await refresh_snapshot(snapshot)
+            delay = max(
+                snapshot.expires_at - time.time() + EXPIRE_MARGIN,
+                MIN_REFRESH_INTERVAL,
+            )
+        except Exception as e:
+            log.exception(f"Failed to refresh {snapshot.name}: {e}")
+            delay = RETRY_INTERVAL
+        await asyncio.sleep(delay)
+
+
+@asynccontextmanager
+async def refresher_lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
+    if not REFRESHER_ENABLED:
+        log.info("Refresher is disabled")
+        yield
+        return
+    tasks = [
+        asyncio.create_task(refresh_loop(s), name=f"refresh-{s.name}")
+        for s in snapshots
+    ]
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class Readiness:
+    """Результат прогрева кэшей внешних API при старте процесса"""
+
+    def __init__(self):
+        self.ready = False
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self.failed: list[str] = []
+        self.pending: list[str] = []
+
+    def as_dict(self) -> dict:
+        return {
+            "status": "ready" if self.ready else "warming",
+            "failed": self.failed,
+            "pending": self.pending,
+        }
+
+
+readiness = Readiness()
+
+
+async def warm_up(
+    items: list[BaseSnapshot],
+    timeout: float,
+    state: Readiness = readiness,
+) -> list[asyncio.Task]:
+    """Параллельно обновляет все снапшоты, не дольше timeout секунд
+
+    Ошибки и не успевшие снапшоты не блокируют готовность, их дальше
+    обновляет refresher. Возвращает еще не завершенные задачи
+    """
+    state.started_at = time.time()
+    tasks = {
+        asyncio.create_task(refresh_snapshot(s), name=f"warmup-{s.name}"): s
+        for s in items
+    }
+    done, pending = (
+        await asyncio.wait(tasks, timeout=timeout) if tasks else (set(), set())
+    )
+    state.failed = [tasks[t].name for t in done if t.exception() is not None]
+    state.pending = [tasks[t].name for t in pending]
+    state.finished_at = time.time()
+    state.ready = True
+    log.info(
+        "Warm up finished",
+        duration=round(state.finished_at - state.started_at, 2),
+        failed=state.failed,
+        pending=state.pending,
+    )
+    return list(pending)
+
+
+@asynccontextmanager
+async def warmup_lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
+    if not WARMUP_ENABLED:
+        readiness.ready = True
+        yield
+        return
+    # runs in background, so /ready can answer while caches are filled
+    task = asyncio.create_task(warm_up(snapshots, WARMUP_TIMEOUT))
+    try:
+        yield
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        if not task.cancelled() and task.exception() is None:
+            for pending in task.result():
+                pending.cancel()
@@ -0,0 +1,282 @@
+import asyncio
+import json
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Iterable, MutableMapping
+
+import structlog
+from pydantic import BaseModel
+
+from internal.refresher import BaseSnapshot, refresh_snapshot, snapshots
+from internal.storage import AsyncPersistentStorage, PersistentStorage
+
+log = structlog.stdlib.get_logger(__name__)
+
+
+class CacheEntry(BaseModel):
+    key: str
+    size: int | None = None
+    age: float | None = None
+    url: str | None = None
+
+
+class NamespaceStats(BaseModel):
+    name: str
+    kind: str
+    entries: int
+    size: int
+    hits: int
+    misses: int
+    oldest_age: float | None
+
+
+class NamespaceDetails(NamespaceStats):
+    # stats by part of the cache, e.g. by zoom level of tiles
+    breakdown: list[NamespaceStats] = []
+    items: list[CacheEntry]
+
+
+class Namespace(ABC):
+    """Кэш одного компонента в реестре: записи, статистика, инвалидация
+
+    warm заново заполняет кэш, чтобы после инвалидации не ждать
+    первого запроса клиента
+    """
+
+    kind = "memory"
+
+    def __init__(
+        self,
+        name: str,
+        warm: Callable[[], Awaitable[Any]] | None = None,
+    ):
+        self.name = name
+        self._warm = warm
+
+    def counts(self) -> tuple[int, int]:
+        """Число попаданий и промахов кэша"""
+        return 0, 0
+
+    @abstractmethod
+    def entries(self) -> list[CacheEntry]:
+        """Записи кэша с размером и возрастом, если они известны"""
+
+    @abstractmethod
+    def invalidate(self, key: str | None = None) -> int:
+        """Удаляет запись key или весь кэш, возвращает число записей"""
+
+    async def warm(self) -> bool:
+        if self._warm is None:
+            return False
+        await self._warm()
+        return True
+
+    def stats(self) -> NamespaceStats:
+        entries = self.entries()
+        ages = [e.age for e in entries if e.age is not None]
+        hits, misses = self.counts()
+        return NamespaceStats(
+            name=self.name,
+            kind=self.kind,
+            entries=len(entries),
+            size=sum(e.size or 0 for e in entries),
+            hits=hits,
+            misses=misses,
+            oldest_age=max(ages, default=None),
+        )
+
+    def breakdown(self) -> list[NamespaceStats]:
+        return []
+
+    def details(self) -> NamespaceDetails:
+        return NamespaceDetails(
+            **self.stats().model_dump(),
+            breakdown=self.breakdown(),
+            items=self.entries(),
+        )
+
+
+async def refresh_snapshots(items: Iterable[BaseSnapshot]):
+    await asyncio.gather(*(refresh_snapshot(s) for s in items))
+
+
+class StorageNamespace(Namespace):
+    """Файловый кэш hishel ответов внешнего API
+
+    warm обновляет снапшоты, которые читают из этого кэша
+    """
+
+    kind = "storage"
+
+    def __init__(
+        self,
+        storage: PersistentStorage | AsyncPersistentStorage,
+        feeds: list[BaseSnapshot],
+    ):
+        super().__init__(storage.name, lambda: refresh_snapshots(feeds))
+        self.storage = storage
+
+    def counts(self) -> tuple[int, int]:
+        return self.storage.hits, self.storage.misses
+
+    def entries(self) -> list[CacheEntry]:
+        now = time.time()
+        res = []
+        for path in self.storage.files():
+            try:
+                stat = path.stat()
+                url = json.loads(path.read_bytes())["request"]["url"]
+            except (OSError, ValueError, KeyError):
+                # removed or being replaced by another worker
+                continue
+            res.append(
+                CacheEntry(
+                    key=path.name,
+                    size=stat.st_size,
+                    age=round(now - stat.st_mtime, 1),
+                    # query may hold api keys
+                    url=url.split("?")[0],
+                )
+            )
+        return res
+
+    def invalidate(self, key: str | None = None) -> int:
+        if key is None:
+            count = len(self.storage.files())
+            self.storage.clear()
+            return count
+        path = self.storage.folder / key
+        if path.name != key or key.startswith(".") or not path.is_file():
+            return 0
+        path.unlink(missing_ok=True)
+        return 1
+
+
+class SnapshotNamespace(Namespace):
+    """Последние значения внешних API (refresher), ключ - имя снапшота"""
+
+    def __init__(self, name: str, items: list[BaseSnapshot]):
+        super().__init__(name, lambda: refresh_snapshots(items))
+        self.items = items
+
+    def entries(self) -> list[CacheEntry]:
+        now = time.time()
+        return [
+            CacheEntry(
+                key=s.name,
+                age=(
+                    round(now - s.updated_at, 1)
+                    if s.updated_at is not None
+                    else None
+                ),
+            )
+            for s in self.items
+            if s.value is not None
+        ]
+
+    def invalidate(self, key: str | None = None) -> int:
+        count = 0
+        for s in self.items:
+            if s.value is not None and key in (None, s.name):
+                # next get() fetches the value again
+                s.value, s.expires_at, s.updated_at = None, 0, None
+                count += 1
+        return count
+
+
+class MemoNamespace(Namespace):
+    """Результаты функций под functools.lru_cache, ключ - имя функции"""
+
+    def __init__(
+        self,
+        name: str,
+        funcs: list[Any],
+        warm: Callable[[], Awaitable[Any]] | None = None,
+    ):
+        super().__init__(name, warm)
+        self.funcs = {f.__name__: f for f in funcs}
+
+    def entries(self) -> list[CacheEntry]:
+        return [
+            CacheEntry(key=f"{name}[{i}]")
+            for name, f in self.funcs.items()
+            for i in range(f.cache_info().currsize)
+        ]
+
+    def counts(self) -> tuple[int, int]:
+        infos = [f.cache_info() for f in self.funcs.values()]
+        return sum(i.hits for i in infos), sum(i.misses for i in infos)
+
+    def invalidate(self, key: str | None = None) -> int:
+        count = 0
+        for name, f in self.funcs.items():
+            if key in (None, name):
+                count += f.cache_info().currsize
+                f.cache_clear()
+        return count
+
+
+class DictNamespace(Namespace):
+    """Кэш в виде словаря, ключ - repr ключа словаря"""
+
+    def __init__(self, name: str, mapping: MutableMapping):
+        super().__init__(name)
+        self.mapping = mapping
+
+    def entries(self) -> list[CacheEntry]:
+        return [CacheEntry(key=repr(k)) for k in list(self.mapping)]
+
+    def invalidate(self, key: str | None = None) -> int:
+        keys = [k for k in list(self.mapping) if key in (None, repr(k))]
+        for k in keys:
+            self.mapping.pop(k, None)
+        return len(keys)
+
+
+class CacheRegistry:
+    """Все кэши приложения по именам, для админских эндпоинтов"""
+
+    def __init__(self):
+        self.namespaces: dict[str, Namespace] = {}
+        # caches of what was served from the others, e.g. etags
+        self.derived: list[Namespace] = []
+
+    def register(
+        self, namespace: Namespace, derived: bool = False
+    ) -> Namespace:
+        """derived - кэш сбрасывается при изменении любого другого кэша"""
+        if namespace.name in self.namespaces:
+            raise ValueError(f"Namespace {namespace.name} already registered")
+        self.namespaces[namespace.name] = namespace
+        if derived:
+            self.derived.append(namespace)
+        return namespace
+
+    def get(self, name: str) -> Namespace | None:
+        return self.namespaces.get(name)
+
+    def stats(self) -> list[NamespaceStats]:
+        return [ns.stats() for ns in self.namespaces.values()]
+
+    def invalidate(self, namespace: Namespace, key: str | None = None) -> int:
+        count = namespace.invalidate(key)
+        if count:
+            self.changed(namespace)
+        return count
+
+    def changed(self, namespace: Namespace):
+        """Сбрасывает производные кэши после инвалидации или прогрева"""
+        for ns in self.derived:
+            if ns is not namespace:
+                ns.invalidate()
+
+    def invalidate_all(self) -> int:
+        count = 0
+        for ns in self.namespaces.values():
+            count += ns.invalidate()
+        log.info("Invalidated all caches", count=count)
+        return count
+
+
+registry = CacheRegistry()
+registry.register(SnapshotNamespace("snapshots", snapshots))
@@ -2,6 +2,7 @@ from pathlib import Path
 
 import structlog
 from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
 
 from internal.auth import check_credentials
 from internal.db.models import Banners, Cities, Customers, Tours
@@ -15,7 +16,13 @@ from internal.db.schemas import (
     Tour,
     TourIn,
 )
-from internal.nooa import nooa_req, swpc_req
+from internal.nooa.city_table import city_table
+from internal.registry import (
+    Namespace,
+    NamespaceDetails,
+    NamespaceStats,
+    registry,
+)
 from internal.settings import MEDIA_FOLDER
 
 logger = structlog.stdlib.get_logger(__name__)
@@ -42,6 +49,7 @@ async def set_cities(cities: list[CityIn]):
     for c in cities:
         nc = await Cities.create(**c.model_dump())
         cs.append(nc)
+    await city_table.reload()
     return cs
 
 
@@ -49,6 +57,7 @@ async def set_cities(cities: list[CityIn]):
 async def new_city(city: CityIn):
     """Добавление города"""
     c = await Cities.create(**city.model_dump())
+    await city_table.reload()
     return c
 
 
@@ -59,6 +68,7 @@ async def drop_city(city_id: int):
     if c is None:
         raise HTTPException(status_code=404, detail="City not found")
     await c.delete()
+    await city_table.reload()
     return Message(detail="ok")
 
 
@@ -72,18 +82,95 @@ async def update_city(city_id: int, city: CityUpdate):
         {k: v for k, v in city.model_dump().items() if v is not None}
     )
     await upd_c.save()
+    await city_table.reload()
     return upd_c
 
 
-@router.delete("/drop-cache")
+@router.delete("/drop-cache", deprecated=True)
 async def drop_cache():
-    """Очистка кэша запросов в NOOA"""
-    swpc_req.storage._cache.cache = {}
-    nooa_req.storage._cache.cache = {}
-    nooa_req.long_storage._cache.cache = {}
+    """Очистка всех кэшей, лучше использовать DELETE /cache/{namespace}"""
+    await run_in_threadpool(registry.invalidate_all)
     return {"message": "ok"}
 
 
+@router.get("/cache", response_model=list[NamespaceStats])
+async def cache_stats():
+    """Статистика всех кэшей: записи, размер в байтах, попадания и промахи,
+    возраст самой старой записи в секундах"""
+    # tile caches list their files on disk
+    return await run_in_threadpool(registry.stats)
+
+
+def get_namespace(namespace: str) -> Namespace:
+    ns = registry.get(namespace)
+    if ns is None:
+        raise HTTPException(status_code=404, detail="Cache not found")
+    return ns
+
+
+async def warm_namespace(ns: Namespace) -> bool:
+    try:
+        warmed = await ns.warm()
+    except Exception as e:
+        logger.exception(f"Failed to warm {ns.name}: {e}")
+        raise HTTPException(
+            status_code=502, detail="Failed to warm cache"
+        ) from e
+    if warmed:
+        registry.changed(ns)
+    return warmed
+
+
+@router.get(
+    "/cache/{namespace}",
+    response_model=NamespaceDetails,
+    responses={404: {"model": Message}},
+)
+async def cache_details(namespace: str):
+    """Записи одного кэша"""
+    return await run_in_threadpool(get_namespace(namespace).details)
+
+
+@router.delete(
+    "/cache/{namespace}",
+    response_model=Message,
+    responses={404: {"model": Message}},
+)
+async def invalidate_cache(
+    namespace: str, key: str | None = None, warm: bool = False
+):
+    """Удаление записи key или всего кэша
+
+    - **warm**: сразу заполнить кэш заново
+    """
+    ns = get_namespace(namespace)
+    count = await run_in_threadpool(registry.invalidate, ns, key)
+    if key is not None and not count:
+        raise HTTPException(status_code=404, detail="Cache entry not found")
+    logger.info("Invalidated cache", namespace=namespace, key=key, count=count)
+    if warm:
+        await warm_namespace(ns)
+    return Message(detail=f"Invalidated {count} entries")
+
+
+@router.post(
+    "/cache/{namespace}/warm",
+    response_model=Message,
+    responses={
+        400: {"model": Message},
+        404: {"model": Message},
+        502: {"model": Message},
+    },
+)
+async def warm_cache(namespace: str):
+    """Заполнение кэша заново из внешних API"""
+    if not await warm_namespace(get_namespace(namespace)):
+        raise HTTPException(
+            status_code=400, detail="Cache does not support warm up"
+        )
+    return Message(detail="ok")
+
+
 @router.post("/tour", response_model=Tour)
 async def set_tour(tour: TourIn):
     """Добавление тура"""
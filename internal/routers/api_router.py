@@ -1,24 +1,51 @@
-import json
+from datetime import datetime, timedelta, timezone
+from typing import Annotated
 
 from fastapi import (
     APIRouter,
+    Body,
+    Header,
     HTTPException,
+    Path,
+    Query,
+    Request,
     Response,
 )
-from pydantic import BaseModel, Field
+from fastapi.concurrency import run_in_threadpool
+from pydantic import AwareDatetime, BaseModel, Field
 
 from internal.db.models import Banners, Cities, Tours
-from internal.db.schemas import Banner, BannerIn, City, Tour
+from internal.db.schemas import Banner, BannerIn, City, Message, Tour
 from internal.nooa import nooa_req, swpc_req
+from internal.nooa.archive import (
+    MAX_HISTORY_RANGE,
+    ArchiveDep,
+    AuroraHistoryPoint,
+    AuroraHistoryResponse,
+)
+from internal.nooa.aurora_tiles import MAX_TILE_ZOOM, aurora_tiles
 from internal.nooa.calc import (
+    MAX_BATCH_SIZE,
+    AuroraModelMapQuery,
     AuroraNooaProbabilityResponse,
     AuroraProbabilityBody,
     AuroraProbabilityCalculation,
     NooaAuroraReq,
     UserBody,
     aurora_probability,
+    cached_aurora_probability_grid,
+    model_slot_end,
+    nearst_aurora_probabilities,
     nearst_aurora_probability,
 )
+from internal.nooa.city_table import (
+    MAX_NEAREST_CITIES,
+    CitiesProbabilityResponse,
+    city_table,
+    city_table_payload,
+)
+from internal.nooa.ovation import LON_SIZE, AuroraMapQuery
+from internal.payload import NotModifiedDep, Payload
 
 router = APIRouter(
     prefix="/api/v1",
@@ -44,15 +71,14 @@ class AuroraProbabilityResponse(BaseModel):
 )
 async def api_aurora_probability(
     ub: UserBody,
-    dst: swpc_req.DstDep,
-    bz: swpc_req.BzDep,
-    kp: swpc_req.KpDep,
+    feeds: swpc_req.SwpcFeedsDep,
 ):
     """Получение вероятности северного сияния по заданным параметрам
 
     - **Источник**: https://services.swpc.noaa.gov/json/geospace/geospace_dst_1_hour.json
     - **Cache TTL**: 1 час
     """
+    dst, bz, kp = feeds
     ad = SwpcApiData(dst=dst, bz=bz, kp=kp)
     res = aurora_probability(
         user_data=ub,
@@ -74,45 +100,391 @@ async def api_aurora_probability(
     "/aurora-nooa-probability", response_model=AuroraNooaProbabilityResponse
 )
 async def api_aurora_nooa_probability(
-    req: NooaAuroraReq, aurora_res: nooa_req.AuroraDep
+    req: NooaAuroraReq, aurora_grid: nooa_req.AuroraGridDep
 ):
     """Получение вероятности северного сияния по заданным координатам из nooa
 
     - **Источник**: https://services.swpc.noaa.gov/json/ovation_aurora_latest.json
     - **Cache TTL**: 1 час
     """
-    res = nooa_req.NooaAuroraRes.model_validate(json.loads(aurora_res))  # type: ignore
-    return nearst_aurora_probability(pos=req, prob_map=res)
+    return nearst_aurora_probability(pos=req, prob_map=aurora_grid)
+
+
+NooaAuroraBatchBody = Annotated[
+    list[NooaAuroraReq],
+    Body(
+        min_length=1,
+        max_length=MAX_BATCH_SIZE,
+        openapi_examples={
+            "Murmansk and Kirov": {
+                "value": [
+                    {"lat": 68.9792, "lon": 33.0925},
+                    {"lat": 58.6, "lon": 49.6},
+                ]
+            },
+        },
+    ),
+]
+
+
+@router.post(
+    "/aurora-nooa-probability-batch",
+    response_model=list[AuroraNooaProbabilityResponse],
+)
+async def api_aurora_nooa_probability_batch(
+    req: NooaAuroraBatchBody, aurora_grid: nooa_req.AuroraGridDep
+):
+    """Получение вероятности северного сияния для списка координат из nooa
+
+    - **Источник**: https://services.swpc.noaa.gov/json/ovation_aurora_latest.json
+    - **Cache TTL**: 1 час
+    - **Max batch size**: 256 координат
+    """
+    return nearst_aurora_probabilities(positions=req, prob_map=aurora_grid)
+
+
+class NearestCity(BaseModel):
+    distance: float = Field(description="Расстояние до города, км")
+    city: City
+
+
+@router.get("/nearest-cities", response_model=list[NearestCity])
+async def api_nearest_cities(
+    lat: Annotated[float, Query(ge=-90, le=90)],
+    lon: Annotated[float, Query(ge=-180, le=180)],
+    k: Annotated[int, Query(ge=1, le=MAX_NEAREST_CITIES)] = 1,
+):
+    """Получение k ближайших к точке городов по расстоянию на сфере"""
+    await city_table.ensure_loaded()
+    return [
+        NearestCity(
+            distance=round(distance, 1),
+            city=City.model_validate(c, from_attributes=True),
+        )
+        for distance, c in city_table.index.nearest(lat, lon, k)
+    ]
+
 
+@router.get("/cities-probability", response_model=CitiesProbabilityResponse)
+async def api_cities_probability(
+    request: Request, aurora_grid: nooa_req.AuroraGridDep
+):
+    """Получение вероятности северного сияния из nooa для всех городов
 
-@router.get("/aurora-map", response_model=nooa_req.NooaAuroraRes)
-async def api_aurora_map(aurora_res: nooa_req.AuroraDep):
+    - **Источник**: https://services.swpc.noaa.gov/json/ovation_aurora_latest.json
+    - **Cache TTL**: 1 час, список городов обновляется раз в минуту
+    """
+    await city_table.ensure_loaded()
+    return city_table_payload(
+        city_table.table(aurora_grid), nooa_req.aurora_snapshot.expires_at
+    ).response(request)
+
+
+@router.get(
+    "/aurora-map",
+    response_model=nooa_req.NooaAuroraRes,
+    responses={
+        200: {
+            "content": {
+                "application/octet-stream": {
+                    "schema": {"type": "string", "format": "binary"}
+                }
+            }
+        }
+    },
+)
+async def api_aurora_map(
+    request: Request,
+    _: NotModifiedDep,
+    q: Annotated[AuroraMapQuery, Query()],
+    aurora_grid: nooa_req.AuroraGridDep,
+    accept: Annotated[str, Header()] = "application/json",
+):
     """Получение карты северного сияния
 
+    - **lat_min, lat_max, lon_min, lon_max**: регион карты,
+    если lon_min > lon_max регион проходит через 0 меридиан
+    - **stride**: шаг сетки в градусах, округляется вниз до одного из
+    1, 2, 3, 5, 10, 15, 30
+    - **min_probability**: минимальная вероятность, ячейки с меньшей
+    вероятностью не возвращаются
+
+    С заголовком `Accept: application/octet-stream` возвращается бинарная
+    карта: 32 байта заголовка (little-endian `<4sBBHqqhhHH`: "OVAT", версия,
+    stride, резерв, Observation Time, Forecast Time, первая долгота,
+    первая широта, кол-во долгот, кол-во широт) и uint8 растр по долготам
+
+    - **Источник**: https://services.swpc.noaa.gov/json/ovation_aurora_latest.json
+    - **Cache TTL**: 1 час
+    """
+    binary = "application/octet-stream" in accept
+    expires_at = nooa_req.aurora_snapshot.expires_at
+    # serializing and compressing a map that is not cached yet (e.g. after
+    # invalidation or for a new region) takes up to 0.4 s
+    if q == AuroraMapQuery():
+        payload = await run_in_threadpool(
+            nooa_req.aurora_map_payload, aurora_grid, binary, expires_at
+        )
+    else:
+        payload = await run_in_threadpool(
+            nooa_req.filtered_aurora_map_payload,
+            aurora_grid,
+            q,
+            binary,
+            expires_at,
+        )
+    return payload.response(request)
+
+
+@router.get(
+    "/aurora-map-delta",
+    response_model=nooa_req.NooaAuroraDeltaRes | nooa_req.NooaAuroraRes,
+)
+async def api_aurora_map_delta(
+    request: Request,
+    _: NotModifiedDep,
+    since: AwareDatetime,
+    aurora_grid: nooa_req.AuroraGridDep,
+):
+    """Получение изменений карты северного сияния с версии since
+
+    - **since**: Observation Time карты, которая уже есть у клиента
+
+    Возвращаются только изменившиеся ячейки: пары [индекс, вероятность],
+    где индекс = lon * 181 + lat + 90. Если версия since уже не хранится
+    (последние 24 карты), возвращается полная карта как в /aurora-map,
+    без поля "Base Observation Time"
+
     - **Источник**: https://services.swpc.noaa.gov/json/ovation_aurora_latest.json
     - **Cache TTL**: 1 час
     """
-    return Response(content=aurora_res, media_type="application/json")
+    expires_at = nooa_req.aurora_snapshot.expires_at
+    base = nooa_req.aurora_history.get(since)
+    if base is None:
+        return nooa_req.aurora_map_payload(
+            aurora_grid, False, expires_at
+        ).response(request)
+    return nooa_req.aurora_delta_payload(
+        base, aurora_grid, expires_at
+    ).response(request)
+
+
+@router.get(
+    "/aurora-contours",
+    response_class=Response,
+    responses={
+        200: {
+            "content": {"application/geo+json": {"schema": {"type": "object"}}}
+        }
+    },
+)
+async def api_aurora_contours(
+    request: Request,
+    _: NotModifiedDep,
+    aurora_grid: nooa_req.AuroraGridDep,
+):
+    """Получение контуров овала северного сияния в формате GeoJSON
+
+    FeatureCollection с MultiPolygon для каждого уровня вероятности
+    (properties.probability, по умолчанию 10/30/50%), полигоны упрощены
+    до 0.5 градуса, долготы в диапазоне -180..180
+
+    - **Источник**: https://services.swpc.noaa.gov/json/ovation_aurora_latest.json
+    - **Cache TTL**: 1 час, контуры строятся один раз на обновление карты
+    """
+    return nooa_req.aurora_contours_payload(
+        aurora_grid, nooa_req.aurora_snapshot.expires_at
+    ).response(request)
+
+
+@router.get(
+    "/aurora-history",
+    response_model=AuroraHistoryResponse,
+    responses={
+        400: {"model": Message},
+        404: {"model": Message},
+    },
+)
+async def api_aurora_history(
+    archive: ArchiveDep,
+    lat: Annotated[float | None, Query(ge=-90, le=90)] = None,
+    lon: Annotated[float | None, Query(ge=-180, le=180)] = None,
+    city_id: int | None = None,
+    start: AwareDatetime | None = None,
+    end: AwareDatetime | None = None,
+):
+    """Получение истории вероятности северного сияния в точке или городе
+
+    - **lat, lon** или **city_id**: точка для которой строится история
+    - **start, end**: интервал по Forecast Time, по умолчанию последние сутки,
+    не больше 31 дня
+
+    - **Источник**: архив карт https://services.swpc.noaa.gov/json/ovation_aurora_latest.json
+    - **Частота**: одна карта на обновление кэша (1 час)
+    """
+    if city_id is not None:
+        c = await Cities.get_or_none(id=city_id)
+        if c is None:
+            raise HTTPException(status_code=404, detail="City not found")
+        lat, lon = c.lat, c.long
+    if lat is None or lon is None:
+        raise HTTPException(
+            status_code=400, detail="lat and lon or city_id are required"
+        )
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(days=1)
+    if not timedelta(0) <= end - start <= MAX_HISTORY_RANGE:
+        raise HTTPException(status_code=400, detail="Invalid time range")
+
+    rounded_lat = int(round(lat, 0))
+    rounded_lon = int(round(lon, 0))
+    nooa_lon = rounded_lon % LON_SIZE
+    # flock and mmap reads block, keep them off the event loop
+    rows = await run_in_threadpool(
+        archive.series, nooa_lon, rounded_lat, start, end
+    )
+    return AuroraHistoryResponse(
+        lat=rounded_lat,
+        lon=rounded_lon,
+        nooa_lat=rounded_lat,
+        nooa_lon=nooa_lon,
+        points=[
+            AuroraHistoryPoint(
+                observation_time=observation_time,
+                forecast_time=forecast_time,
+                probability=probability,
+            )
+            for observation_time, forecast_time, probability in rows
+        ],
+    )
+
+
+TileCoord = Annotated[int, Path(ge=0)]
+
+
+@router.get(
+    "/aurora-tiles/{z}/{x}/{y}.png",
+    response_class=Response,
+    responses={
+        200: {"content": {"image/png": {}}},
+        404: {"model": Message},
+    },
+)
+async def api_aurora_tiles(
+    request: Request,
+    _: NotModifiedDep,
+    z: Annotated[int, Path(ge=0, le=MAX_TILE_ZOOM)],
+    x: TileCoord,
+    y: TileCoord,
+    aurora_grid: nooa_req.AuroraGridDep,
+):
+    """Получение XYZ тайлов карты северного сияния (Web-Mercator, 256px)
+
+    Цвет пикселя определяется вероятностью по фиксированной шкале,
+    ячейки с нулевой вероятностью прозрачные
+
+    - **Источник**: https://services.swpc.noaa.gov/json/ovation_aurora_latest.json
+    - **Cache TTL**: 1 час, до нового Forecast Time
+    - **Cache Size**: 1024 тайла
+    """
+    if x >= 2**z or y >= 2**z:
+        raise HTTPException(status_code=404, detail="Tile not found")
+    return aurora_tiles.get(
+        aurora_grid, (z, x, y), nooa_req.aurora_snapshot.expires_at
+    ).response(request)
+
+
+@router.get(
+    "/aurora-model-map",
+    response_model=nooa_req.NooaAuroraRes,
+    responses={
+        200: {
+            "content": {
+                "application/octet-stream": {
+                    "schema": {"type": "string", "format": "binary"}
+                }
+            }
+        }
+    },
+)
+async def api_aurora_model_map(
+    request: Request,
+    _: NotModifiedDep,
+    q: Annotated[AuroraModelMapQuery, Query()],
+    feeds: swpc_req.SwpcFeedsDep,
+    accept: Annotated[str, Header()] = "application/json",
+):
+    """Получение карты вероятности сияния по собственной модели
+
+    Та же модель что и в /aurora-probabilitiy, посчитанная для всей сетки
+    OVATION, локальное время определяется по долготе. Формат ответа и
+    фильтры такие же как у /aurora-map, Forecast Time - время расчета
+
+    - **speed, clouds**: скорость солнечного ветра и облачность, округляются
+    до 10 км/с и 5%
+    - **Источник**: https://services.swpc.noaa.gov/json/geospace/geospace_dst_1_hour.json
+    - **Cache TTL**: 1 час, пересчет каждые 4 минуты
+    """
+    now = datetime.now(timezone.utc)
+    expires_at = min(
+        model_slot_end(now),
+        swpc_req.dst_snapshot.expires_at,
+        swpc_req.bz_snapshot.expires_at,
+        swpc_req.kp_snapshot.expires_at,
+    )
+    # model evaluation and compression of the whole grid take ~0.4 s
+    payload = await run_in_threadpool(
+        model_map_payload,
+        feeds,
+        now,
+        q,
+        "application/octet-stream" in accept,
+        expires_at,
+    )
+    return payload.response(request)
+
+
+def model_map_payload(
+    feeds: swpc_req.SwpcFeeds,
+    now: datetime,
+    q: AuroraModelMapQuery,
+    binary: bool,
+    expires_at: float,
+) -> Payload:
+    grid = cached_aurora_probability_grid(*feeds, now, q.speed, q.clouds)
+    # speed and clouds are already in the grid, keep them out of the key
+    query = AuroraMapQuery(
+        **q.model_dump(include=set(AuroraMapQuery.model_fields))
+    )
+    return nooa_req.aurora_model_map_payload(grid, query, binary, expires_at)
 
 
 @router.get("/aurora-kp-3", response_model=nooa_req.NooaAuroraKp3Req)
-async def api_aurora_kp_3(aurora_kp_res: nooa_req.Kp3Dep):
+async def api_aurora_kp_3(
+    request: Request,
+    _: NotModifiedDep,
+    aurora_kp_res: nooa_req.Kp3PayloadDep,
+):
     """Получение планетарного k-индекса за 3 дня
 
     - **Источник**: https://services.swpc.noaa.gov/text/3-day-forecast.txt
     - **Cache TTL**: 24 часа
     """
-    return aurora_kp_res
+    return aurora_kp_res.response(request)
 
 
 @router.get("/aurora-kp-27", response_model=nooa_req.NooaAuroraKp27Req)
-async def api_aurora_kp_map(aurora_kp_res: nooa_req.Kp27Dep):
+async def api_aurora_kp_map(
+    request: Request,
+    _: NotModifiedDep,
+    aurora_kp_res: nooa_req.Kp27PayloadDep,
+):
     """Получение планетарного k-индекса за 27 дней
 
     - **Источник**: https://services.swpc.noaa.gov/text/27-day-outlook.txt
     - **Cache TTL**: 24 часа
     """
-    return aurora_kp_res
+    return aurora_kp_res.response(request)
 
 
 @router.get("/all-cities", response_model=list[City])
@@ -1,9 +1,58 @@
+from pathlib import Path
 from typing import Annotated
 
 import httpx
-from fastapi import APIRouter, Path, Response
+from fastapi import APIRouter, Header, HTTPException, Request, Response
+from fastapi import Path as PathParam
 
-client = httpx.AsyncClient()
+from internal.payload import NotModifiedDep
+from internal.registry import registry
+from internal.settings import TILE_FOLDER
+from internal.tile_formats import negotiate_format
+from internal.tiles import ProxyTileCache, TileKey, TileStore, TileVariants
+
+# basemap tiles barely change, stale ones are revalidated with etag
+OSM_TTL = 7 * 24 * 3600
+OSM_MEMORY_BYTES = 32 * 1024 * 1024
+OSM_DISK_BYTES = 1024 * 1024 * 1024
+# tile.openstreetmap.org usage policy asks to keep few connections
+OSM_MAX_DOWNLOADS = 4
+OSM_MAX_ZOOM = 19
+OSM_VARIANT_BYTES = 16 * 1024 * 1024
+OSM_VARIANT_DISK_BYTES = 256 * 1024 * 1024
+OSM_FOLDER = Path(TILE_FOLDER) / "osm"
+
+client = httpx.AsyncClient(
+    timeout=httpx.Timeout(10, connect=5),
+    limits=httpx.Limits(max_connections=OSM_MAX_DOWNLOADS),
+    headers={"User-Agent": "aurora-api tile proxy"},
+)
+
+
+def osm_url(key: TileKey) -> str:
+    z, x, y = key
+    return f"https://tile.openstreetmap.org/{z}/{x}/{y}.png"
+
+
+osm_variants = TileVariants(
+    "osm-variants",
+    OSM_FOLDER,
+    OSM_VARIANT_BYTES,
+    disk_bytes=OSM_VARIANT_DISK_BYTES,
+)
+registry.register(osm_variants)
+
+osm_tiles = ProxyTileCache(
+    "osm",
+    TileStore(OSM_FOLDER, max_bytes=OSM_DISK_BYTES),
+    client,
+    osm_url,
+    ttl=OSM_TTL,
+    max_bytes=OSM_MEMORY_BYTES,
+    max_downloads=OSM_MAX_DOWNLOADS,
+    variants=osm_variants,
+)
+registry.register(osm_tiles)
 
 
 router = APIRouter(
@@ -11,19 +60,34 @@ router = APIRouter(
     tags=["Proxy"],
 )
 
-OsmCoord = Annotated[int, Path()]
+OsmCoord = Annotated[int, PathParam(ge=0)]
 
 
-@router.get("/proxy/osm-tile-map/{z}/{x}/{y}.png")
+@router.get(
+    "/proxy/osm-tile-map/{z}/{x}/{y}.png",
+    response_class=Response,
+    responses={200: {"content": {"image/png": {}}}},
+)
 async def api_cloud_map(
-    z: OsmCoord,
+    request: Request,
+    _: NotModifiedDep,
+    z: Annotated[int, PathParam(ge=0, le=OSM_MAX_ZOOM)],
     x: OsmCoord,
     y: OsmCoord,
+    accept: Annotated[str, Header()] = "image/png",
 ):
     """Прокируем запрос на сервер OpenStreetMap
 
+    Клиентам с `image/webp` в заголовке `Accept` тайл отдается в PNG
+    с палитрой из 256 цветов, кроме первого запроса тайла, который
+    передается потоком как есть
+
     - **Источник**: openstreetmap.org
-    - **Cache TTL**: None
+    - **Cache TTL**: 7 дней, затем условный запрос к источнику
+    - **Cache Size**: 32 МБ в памяти, 1 ГБ на диске
     """
-    res = await client.get(f"https://tile.openstreetmap.org/{z}/{x}/{y}.png")
-    return Response(content=res.content, media_type="image/png")
+    if x >= 2**z or y >= 2**z:
+        raise HTTPException(status_code=404, detail="Tile not found")
+    return await osm_tiles.response(
+        (z, x, y), request, negotiate_format(accept)
+    )
@@ -10,6 +10,7 @@ from tortoise import transactions
 from internal import fcm
 from internal.db.models import Customers, Subscriptions
 from internal.db.schemas import Cust, CustIn, CustUpdate, Message, Sub, SubIn
+from internal.nooa.city_table import nearest_city_id
 
 AuthDep = Annotated[HTTPBasicCredentials, Depends(HTTPBasic())]
 
@@ -73,9 +74,21 @@ NewUserBody = Annotated[
 
 @router.post("/new-user", response_model=Cust, tags=["User"])
 async def new_user(cust: NewUserBody):
-    """Создание нового пользователя"""
+    """Создание нового пользователя
+
+    Без city_id пользователь привязывается к ближайшему городу
+    по current_geo_lat/current_geo_long
+    """
     if _ := await Customers.get_or_none(token=cust.token):
         raise HTTPException(status_code=409, detail="User already exists")
+    if (
+        cust.city_id is None
+        and cust.current_geo_lat is not None
+        and cust.current_geo_long is not None
+    ):
+        cust.city_id = await nearest_city_id(
+            cust.current_geo_lat, cust.current_geo_long
+        )
     async with transactions.in_transaction():
         c = await Customers.create(**cust.model_dump())
         err = fcm.subscribe_to_user_topic(c)
@@ -183,11 +196,20 @@ async def get_subscription(id: uuid.UUID):
 
 @router.put("/mod-user/{id}", response_model=Cust)
 async def mod_user(id: int, upd_cust: CustUpdate, u: UserAuth):
-    """Модификация пользователя"""
+    """Модификация пользователя
+
+    Пользователь без города привязывается к ближайшему по координатам
+    """
     if u.id != id:
         raise HTTPException(status_code=401, detail="Not allowed")
-    upd_u = await u.update_from_dict(
-        {k: v for k, v in upd_cust.model_dump().items() if v is not None}
-    )
+    upd = {k: v for k, v in upd_cust.model_dump().items() if v is not None}
+    lat = upd.get("current_geo_lat", u.current_geo_lat)
+    lon = upd.get("current_geo_long", u.current_geo_long)
+    has_city = "city_id" in upd or u.city_id is not None  # type: ignore
+    if not has_city and lat is not None and lon is not None:
+        city_id = await nearest_city_id(lat, lon)
+        if city_id is not None:
+            upd["city_id"] = city_id
+    upd_u = await u.update_from_dict(upd)
     await upd_u.save()
     return upd_u
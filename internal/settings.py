@@ -18,6 +18,18 @@ LOG_JSON = os.getenv("LOG_JSON", str(not sys.stderr.isatty())) in _true_values
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 DB_URL = os.getenv("DB_URL", "sqlite://data/db.sqlite3")
 MEDIA_FOLDER = os.getenv("MEDIA_FOLDER", "media")
+# persistent cache of upstream api responses
+CACHE_FOLDER = os.getenv("CACHE_FOLDER", "data/cache")
+# history of ovation aurora grids
+ARCHIVE_FOLDER = os.getenv("ARCHIVE_FOLDER", "data/ovation")
+# grids kept in the archive, ~64 KB each, 90 days of hourly updates
+ARCHIVE_MAX_FRAMES = int(os.getenv("ARCHIVE_MAX_FRAMES", 90 * 24))
+# map tiles of external apis
+TILE_FOLDER = os.getenv("TILE_FOLDER", "data/tiles")
+# probability levels of aurora oval contours, percent
+CONTOUR_LEVELS = [
+    int(level) for level in os.getenv("CONTOUR_LEVELS", "10,30,50").split(",")
+]
 
 ADMIN_USER = os.getenv("ADMIN_USER", "admin")
 ADMIN_PASS = os.getenv(
@@ -30,6 +42,10 @@ ADMIN_TEST_PASS = "admin"  # only for tests
 # OpenWeatherMap API key
 OW_API_KEY = os.environ["OW_API_KEY"]
 SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "True") in _true_values
+REFRESHER_ENABLED = os.getenv("REFRESHER_ENABLED", "True") in _true_values
+# prefetch upstream apis on startup, /ready waits for it at most timeout sec
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "True") in _true_values
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "60"))
 
 # https://github.com/DenverCoder1/jct-discord-bot/blob/67af73fa05afda73973d8843c1a66c6bacc5ceaf/config.py#L44
 FCM_PROJECT_ID = os.getenv("FCM_PROJECT_ID", "")
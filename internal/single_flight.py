@@ -0,0 +1,77 @@
+import asyncio
+import threading
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class _Call(Generic[T]):
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: T | None = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """Объединяет одновременные вызовы с одинаковым ключом в один
+
+    Первый вызов выполняет функцию, остальные ждут его завершения
+    и получают тот же результат (или то же исключение)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if call is None:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result  # type: ignore
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class AsyncSingleFlight:
+    """SingleFlight для корутин одного event loop
+
+    Вызов выполняется в отдельной задаче, поэтому отмена одного
+    ожидающего запроса не отменяет запрос для остальных
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        if call is None:
+            call = self._calls[key] = asyncio.ensure_future(fn())
+            call.add_done_callback(lambda _: self._done(key, call))
+        return await asyncio.shield(call)
+
+    def _done(self, key: Hashable, call: asyncio.Future):
+        del self._calls[key]
+        if not call.cancelled():
+            # mark error as retrieved even if every waiter was cancelled
+            call.exception()
+
+
+# shared by all upstream clients, keyed by url
+upstream = SingleFlight()
+async_upstream = AsyncSingleFlight()
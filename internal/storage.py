@@ -0,0 +1,203 @@
+import datetime
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+import anyio
+import hishel
+from httpcore import Request, Response
+
+from internal.settings import CACHE_FOLDER
+
+# how often all entries of a storage are checked for expiration
+CLEANUP_INTERVAL = 60
+
+
+def atomic_write(path: str | Path, data: bytes | str, is_binary: bool = True):
+    """Запись через временный файл, чтобы другие воркеры не читали
+    частично записанный файл"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb" if is_binary else "wt") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class FileEntries:
+    """Сериализованные hishel ответы в файлах folder/<ключ>
+
+    ttl считается по mtime файла, поэтому переживает рестарт. Файлы
+    заменяются атомарно, так что воркеры на одном хосте читают их
+    без блокировок
+    """
+
+    def __init__(self, name: str, ttl: int):
+        self.name = name
+        self.ttl = ttl
+        self.folder = Path(CACHE_FOLDER) / name
+        self.folder.mkdir(parents=True, exist_ok=True)
+        gitignore = self.folder / ".gitignore"
+        if not gitignore.is_file():
+            gitignore.write_text("*\n")
+        self.serializer = hishel.JSONSerializer()
+        self.hits = 0
+        self.misses = 0
+        self._cleaned_at = time.monotonic()
+        self._cleanup_lock = threading.Lock()
+
+    def files(self) -> list[Path]:
+        return [
+            p
+            for p in self.folder.iterdir()
+            if p.is_file() and not p.name.startswith(".")
+        ]
+
+    def is_expired(self, mtime: float) -> bool:
+        return time.time() - mtime > self.ttl
+
+    def read(self, key: str) -> Any:
+        path = self.folder / key
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+                mtime = os.fstat(f.fileno()).st_mtime
+        except FileNotFoundError:
+            data = b""
+        else:
+            if self.is_expired(mtime):
+                path.unlink(missing_ok=True)
+                data = b""
+        if not data:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.serializer.loads(data)
+
+    def write(
+        self,
+        key: str,
+        response: Response,
+        request: Request,
+        metadata: Any = None,
+    ):
+        if metadata is None:
+            metadata = {
+                "cache_key": key,
+                "created_at": datetime.datetime.now(datetime.UTC),
+                "number_of_uses": 0,
+            }
+        data = self.serializer.dumps(response, request, metadata)
+        atomic_write(self.folder / key, data, isinstance(data, bytes))
+        self.cleanup()
+
+    def update(
+        self, key: str, response: Response, request: Request, metadata: Any
+    ):
+        path = self.folder / key
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return self.write(key, response, request, metadata)
+        data = self.serializer.dumps(response, request, metadata)
+        atomic_write(path, data, isinstance(data, bytes))
+        # mtime is the age of the response, uses do not extend it
+        os.utime(path, (stat.st_atime, stat.st_mtime))
+
+    def remove(self, key: str | Response):
+        if isinstance(key, Response):
+            key = str(key.extensions["cache_metadata"]["cache_key"])
+        (self.folder / key).unlink(missing_ok=True)
+
+    def cleanup(self):
+        """Удаляет истекшие записи не чаще раза в CLEANUP_INTERVAL"""
+        if time.monotonic() - self._cleaned_at < CLEANUP_INTERVAL:
+            return
+        if not self._cleanup_lock.acquire(blocking=False):
+            return
+        try:
+            self._cleaned_at = time.monotonic()
+            for path in self.files():
+                try:
+                    if self.is_expired(path.stat().st_mtime):
+                        path.unlink(missing_ok=True)
+                except FileNotFoundError:
+                    continue
+        finally:
+            self._cleanup_lock.release()
+
+    def clear(self):
+        for path in self.files():
+            path.unlink(missing_ok=True)
+
+
+class PersistentStorage(FileEntries, hishel.BaseStorage):
+    """Файловый кэш ответов внешних API в CACHE_FOLDER
+
+    Переживает рестарт и общий для всех воркеров на хосте,
+    ttl считается по mtime файла, поэтому тоже сохраняется
+    """
+
+    def __init__(self, name: str, ttl: int):
+        FileEntries.__init__(self, name, ttl)
+        hishel.BaseStorage.__init__(self, self.serializer, ttl)
+
+    def store(
+        self,
+        key: str,
+        response: Response,
+        request: Request,
+        metadata: Any = None,
+    ) -> None:
+        self.write(key, response, request, metadata)
+
+    def update_metadata(
+        self, key: str, response: Response, request: Request, metadata: Any
+    ) -> None:
+        self.update(key, response, request, metadata)
+
+    def retrieve(self, key: str) -> Any:
+        return self.read(key)
+
+    def close(self) -> None:
+        return
+
+
+class AsyncPersistentStorage(FileEntries, hishel.AsyncBaseStorage):
+    """PersistentStorage для hishel.AsyncCacheClient, формат файлов общий"""
+
+    def __init__(self, name: str, ttl: int):
+        FileEntries.__init__(self, name, ttl)
+        hishel.AsyncBaseStorage.__init__(self, self.serializer, ttl)
+
+    async def store(
+        self,
+        key: str,
+        response: Response,
+        request: Request,
+        metadata: Any = None,
+    ) -> None:
+        await anyio.to_thread.run_sync(
+            self.write, key, response, request, metadata
+        )
+
+    async def remove(self, key: str | Response) -> None:
+        await anyio.to_thread.run_sync(FileEntries.remove, self, key)
+
+    async def update_metadata(
+        self, key: str, response: Response, request: Request, metadata: Any
+    ) -> None:
+        await anyio.to_thread.run_sync(
+            self.update, key, response, request, metadata
+        )
+
+    async def retrieve(self, key: str) -> Any:
+        return await anyio.to_thread.run_sync(self.read, key)
+
+    async def aclose(self) -> None:
+        return
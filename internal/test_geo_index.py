@@ -0,0 +1,45 @@
+import math
+import random
+
+from internal.geo_index import EARTH_RADIUS_KM, GeoIndex
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = (
+        math.sin(dp / 2) ** 2
+        + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def test_geo_index_matches_brute_force():
+    rnd = random.Random(42)
+    points = [
+        (rnd.uniform(-90, 90), rnd.uniform(-180, 180), i) for i in range(300)
+    ]
+    index = GeoIndex(points)
+    assert len(index) == 300
+    for _ in range(50):
+        lat, lon = rnd.uniform(-90, 90), rnd.uniform(-180, 180)
+        k = rnd.randint(1, 10)
+        expected = sorted(
+            points, key=lambda p: haversine_km(lat, lon, p[0], p[1])
+        )[:k]
+        found = index.nearest(lat, lon, k)
+        assert [item for _, item in found] == [p[2] for p in expected]
+        for distance, item in found:
+            plat, plon, _ = points[item]
+            assert math.isclose(
+                distance, haversine_km(lat, lon, plat, plon), abs_tol=1e-6
+            )
+
+
+def test_geo_index_antimeridian():
+    index = GeoIndex([(65, 179.5, "east"), (65, -170, "west"), (0, 0, "x")])
+    assert [item for _, item in index.nearest(65, -179.9, 2)] == [
+        "east",
+        "west",
+    ]
+    assert GeoIndex([]).nearest(0, 0, 3) == []
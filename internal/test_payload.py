@@ -0,0 +1,64 @@
+import gzip
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from internal.payload import (
+    NotModifiedDep,
+    Payload,
+    accepted_encodings,
+    etag_matches,
+)
+
+
+def test_accepted_encodings():
+    assert accepted_encodings(None) == set()
+    assert accepted_encodings("gzip, deflate, br;q=0.5") == {
+        "gzip",
+        "deflate",
+        "br",
+    }
+    assert accepted_encodings("gzip;q=0, br") == {"br"}
+
+
+def test_etag_matches():
+    assert etag_matches('"a", "b"', '"b"')
+    assert etag_matches('W/"b"', '"b"')
+    assert etag_matches("*", '"b"')
+    assert not etag_matches('"a"', '"b"')
+    assert not etag_matches(None, '"b"')
+    assert etag_matches('"b-gzip"', '"b"')
+    assert etag_matches('W/"b"', '"b-gzip"')
+    assert not etag_matches('"a-gzip"', '"b"')
+
+
+def test_payload_encodings():
+    content = b"[" + b"1," * 1000 + b"1]"
+    payload = Payload(content)
+    assert gzip.decompress(payload.encodings["gzip"]) == content
+    assert payload.etag == Payload(content).etag
+    assert Payload(b"[]").encodings == {}
+
+
+def test_payload_etag_per_encoding():
+    payload = Payload(b"[" + b"1," * 1000 + b"1]", expires_at=2**40)
+    app = FastAPI()
+
+    @app.get("/")
+    async def index(request: Request, _: NotModifiedDep):
+        return payload.response(request)
+
+    client = TestClient(app)
+    plain = client.get("/", headers={"Accept-Encoding": "identity"})
+    assert plain.headers["etag"] == payload.etag
+    gzipped = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert gzipped.headers["etag"] == payload.etag[:-1] + '-gzip"'
+
+    # both etags revalidate, 304 carries the etag of the negotiated body
+    for etag in (plain.headers["etag"], gzipped.headers["etag"]):
+        res = client.get(
+            "/", headers={"Accept-Encoding": "gzip", "If-None-Match": etag}
+        )
+        assert res.status_code == 304
+        assert res.headers["etag"] == gzipped.headers["etag"]
@@ -0,0 +1,98 @@
+import struct
+import zlib
+
+import pytest
+
+from internal.png import (
+    PNG_SIGNATURE,
+    decode_png,
+    encode_png,
+    encode_png8,
+    is_palette_png,
+    png_chunk,
+    quantize,
+    unfilter,
+)
+
+
+def test_png_roundtrip():
+    rows = [bytes(range(i, i + 8)) for i in range(3)]
+    assert decode_png(encode_png(2, rows)) == (2, rows)
+
+
+def test_decode_palette():
+    content = encode_png(
+        2,
+        [b"\x00\x01"],
+        color_type=3,
+        palette=b"\xff\x00\x00\x00\x00\xff",
+        transparency=b"\x80",
+    )
+    assert decode_png(content) == (2, [b"\xff\x00\x00\x80\x00\x00\xff\xff"])
+
+
+def test_unfilter():
+    # sub, up, average and paeth filters of a 2x1 gray image per row
+    raw = b"\x00\x0a\x14" + b"\x01\x05\x05" + b"\x02\x01\x01"
+    raw += b"\x03\x00\x00" + b"\x04\x01\x01"
+    assert unfilter(raw, 2, 5, 1) == [
+        b"\x0a\x14",
+        b"\x05\x0a",
+        b"\x06\x0b",
+        b"\x03\x07",
+        b"\x04\x08",
+    ]
+
+
+def test_decode_unsupported():
+    with pytest.raises(ValueError, match="Not a PNG"):
+        decode_png(b"GIF89a")
+    header = struct.pack(">IIBBBBB", 1, 1, 16, 0, 0, 0, 0)
+    content = (
+        PNG_SIGNATURE
+        + png_chunk(b"IHDR", header)
+        + png_chunk(b"IDAT", zlib.compress(b"\x00\x00\x00"))
+    )
+    with pytest.raises(ValueError, match="depth 16"):
+        decode_png(content)
+
+
+def test_quantize():
+    # 300 colors do not fit the palette, transparent pixels are merged
+    rows = [
+        bytes(c for v in range(100) for c in (v * 2, 0, 0, 255)),
+        bytes(c for v in range(100) for c in (0, v * 2, 0, 255)),
+        bytes(c for v in range(100) for c in (0, 0, v * 2, 255)),
+        bytes(c for v in range(100) for c in (v, v, 0, 0)),
+    ]
+    palette, transparency, indexes = quantize(rows)
+    assert len(palette) <= 256 * 3
+    assert transparency.startswith(b"\x00")
+    assert set(indexes[3]) == {0}
+
+    width, decoded = decode_png(encode_png8(100, rows))
+    assert width == 100
+    assert decoded[3] == bytes(400)
+    # quantization error stays within a few levels
+    for row, original in zip(decoded[:3], rows):
+        assert max(abs(a - b) for a, b in zip(row, original)) <= 8
+
+
+def test_quantize_noisy():
+    # every pixel has its own color, still one lookup per distinct color
+    rows = [
+        bytes(
+            (x * 37 + y * 101 + c * 59) * 7 % 256
+            for x in range(64)
+            for c in range(4)
+        )
+        for y in range(64)
+    ]
+    palette, _, indexes = quantize(rows)
+    assert len(palette) <= 256 * 3
+    assert len(indexes) == 64
+
+    content = encode_png8(64, rows)
+    assert is_palette_png(content)
+    assert not is_palette_png(encode_png(64, rows))
+    assert not is_palette_png(b"tile")
@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+import pytest
+
+from internal import refresher
+from internal.refresher import (
+    AsyncSnapshot,
+    Readiness,
+    Snapshot,
+    refresh_loop,
+    snapshots,
+    warm_up,
+)
+
+
+@pytest.fixture
+def counter_snapshot():
+    calls: list[int] = []
+
+    def fetch():
+        calls.append(len(calls))
+        if len(calls) == 2:
+            raise Exception("upstream is down")
+        return len(calls), time.time()
+
+    s = Snapshot("test", fetch)
+    yield s, calls
+    snapshots.remove(s)
+
+
+def test_snapshot_get(counter_snapshot):
+    s, calls = counter_snapshot
+    assert s.value is None
+    assert s.get() == 1
+    assert s.get() == 1
+    assert len(calls) == 1
+
+
+async def test_refresh_loop_keeps_last_good_value(
+    counter_snapshot,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    s, calls = counter_snapshot
+    monkeypatch.setattr(refresher, "MIN_REFRESH_INTERVAL", 0.01)
+    monkeypatch.setattr(refresher, "RETRY_INTERVAL", 0.2)
+    task = asyncio.create_task(refresh_loop(s))
+    while len(calls) < 2:
+        await asyncio.sleep(0.01)
+    # second fetch failed, handlers still see the first value
+    assert s.get() == 1
+    while s.value != 3:
+        await asyncio.sleep(0.01)
+    task.cancel()
+
+
+async def test_async_snapshot_get():
+    calls: list[int] = []
+
+    async def fetch():
+        calls.append(len(calls))
+        await asyncio.sleep(0.05)
+        return len(calls), time.time() + 60
+
+    s = AsyncSnapshot("test-async", fetch)
+    try:
+        assert await asyncio.gather(s.get(), s.get()) == [1, 1]
+        assert await s.get() == 1
+        assert len(calls) == 1
+    finally:
+        snapshots.remove(s)
+
+
+async def test_warm_up():
+    async def fetch(delay: float, fail: bool = False):
+        await asyncio.sleep(delay)
+        if fail:
+            raise Exception("upstream is down")
+        return delay, time.time() + 60
+
+    fast = AsyncSnapshot("test-fast", lambda: fetch(0.01))
+    failing = AsyncSnapshot("test-failing", lambda: fetch(0.01, True))
+    slow = AsyncSnapshot("test-slow", lambda: fetch(1))
+    sync = Snapshot("test-sync", lambda: (1, time.time() + 60))
+    items = [fast, failing, slow, sync]
+    try:
+        state = Readiness()
+        started = time.monotonic()
+        pending = await warm_up(items, 0.2, state)
+        # snapshots are refreshed in parallel, slow one does not block
+        assert time.monotonic() - started < 0.5
+        assert state.ready
+        assert state.failed == ["test-failing"]
+        assert state.pending == ["test-slow"]
+        assert (fast.value, sync.value, slow.value) == (0.01, 1, None)
+        for task in pending:
+            task.cancel()
+    finally:
+        for s in items:
+            snapshots.remove(s)
@@ -0,0 +1,111 @@
+from functools import lru_cache
+
+import hishel
+import httpx
+import pytest
+
+from internal.refresher import Snapshot, snapshots
+from internal.registry import (
+    CacheRegistry,
+    DictNamespace,
+    MemoNamespace,
+    SnapshotNamespace,
+    StorageNamespace,
+)
+from internal.storage import PersistentStorage
+from tests.fixtures.storage import cache_folder
+
+
+def make_snapshot(storage: PersistentStorage, calls: list[str]) -> Snapshot:
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(str(request.url))
+        return httpx.Response(200, content=b"[1, 2, 3]")
+
+    client = hishel.CacheClient(
+        storage=storage,
+        controller=hishel.Controller(force_cache=True),
+        transport=httpx.MockTransport(handler),
+    )
+
+    def fetch() -> tuple[bytes, float]:
+        return client.get("https://example.com/feed.json?key=s").content, 0
+
+    snapshot = Snapshot("test-feed", fetch)
+    snapshots.remove(snapshot)
+    return snapshot
+
+
+async def test_storage_namespace(cache_folder):
+    calls: list[str] = []
+    storage = PersistentStorage("test", ttl=60)
+    snapshot = make_snapshot(storage, calls)
+    ns = StorageNamespace(storage, [snapshot])
+    assert ns.stats().entries == 0
+
+    snapshot.refresh()
+    snapshot.refresh()
+    stats = ns.stats()
+    assert (stats.entries, stats.hits, stats.misses) == (1, 1, 1)
+    assert stats.size > 0
+    (entry,) = ns.entries()
+    assert entry.url == "https://example.com/feed.json"
+
+    assert ns.invalidate("../test") == 0
+    assert ns.invalidate(entry.key) == 1
+    assert ns.invalidate() == 0
+    assert await ns.warm()
+    assert len(calls) == 2
+    assert ns.stats().entries == 1
+
+
+async def test_snapshot_namespace(cache_folder):
+    calls: list[str] = []
+    snapshot = make_snapshot(PersistentStorage("test", ttl=60), calls)
+    ns = SnapshotNamespace("snapshots", [snapshot])
+    assert ns.entries() == []
+    await ns.warm()
+    (entry,) = ns.entries()
+    assert entry.key == "test-feed" and entry.age is not None
+    assert ns.invalidate("other") == 0
+    assert ns.invalidate("test-feed") == 1
+    assert snapshot.value is None
+
+
+def test_memo_and_dict_namespaces():
+    @lru_cache(maxsize=4)
+    def square(x: int) -> int:
+        return x * x
+
+    square(2), square(2), square(3)
+    ns = MemoNamespace("memo", [square])
+    stats = ns.stats()
+    assert (stats.entries, stats.hits, stats.misses) == (2, 1, 2)
+    assert ns.invalidate("cube") == 0
+    assert ns.invalidate("square") == 2
+    assert square.cache_info().currsize == 0
+
+    mapping = {("a", 1): 1, ("b", 2): 2}
+    ns = DictNamespace("dict", mapping)
+    assert [e.key for e in ns.entries()] == ["('a', 1)", "('b', 2)"]
+    assert ns.invalidate("('a', 1)") == 1
+    assert ns.invalidate() == 1
+    assert mapping == {}
+
+
+def test_registry():
+    registry = CacheRegistry()
+    ns = registry.register(DictNamespace("dict", {1: 1}))
+    with pytest.raises(ValueError):
+        registry.register(DictNamespace("dict", {}))
+    assert registry.get("dict") is ns
+    assert [s.name for s in registry.stats()] == ["dict"]
+    assert registry.invalidate_all() == 1
+
+    # derived caches are dropped when another namespace changes
+    derived = {"etag": 1}
+    registry.register(DictNamespace("derived", derived), derived=True)
+    other = registry.register(DictNamespace("other", {1: 1}))
+    assert registry.invalidate(other, "2") == 0
+    assert derived == {"etag": 1}
+    assert registry.invalidate(other) == 1
+    assert derived == {}
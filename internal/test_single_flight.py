@@ -0,0 +1,86 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from internal.single_flight import AsyncSingleFlight, SingleFlight
+
+
+def test_single_flight_coalesces_calls():
+    sf = SingleFlight()
+    calls = 0
+    started = threading.Event()
+
+    def fetch():
+        nonlocal calls
+        calls += 1
+        started.set()
+        time.sleep(0.1)
+        return object()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        first = pool.submit(sf.do, "url", fetch)
+        started.wait()
+        rest = [pool.submit(sf.do, "url", fetch) for _ in range(7)]
+        results = {id(f.result()) for f in [first, *rest]}
+    assert calls == 1
+    assert len(results) == 1
+    # finished call is not reused
+    sf.do("url", fetch)
+    assert calls == 2
+
+
+def test_single_flight_shares_error():
+    sf = SingleFlight()
+    started = threading.Event()
+
+    def fetch():
+        started.set()
+        time.sleep(0.1)
+        raise ValueError("upstream is down")
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        first = pool.submit(sf.do, "url", fetch)
+        started.wait()
+        second = pool.submit(sf.do, "url", lambda: "not called")
+        for f in (first, second):
+            with pytest.raises(ValueError):
+                f.result()
+
+
+async def test_async_single_flight_coalesces_calls():
+    sf = AsyncSingleFlight()
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return object()
+
+    waiters = [asyncio.create_task(sf.do("url", fetch)) for _ in range(8)]
+    await asyncio.sleep(0.01)
+    # cancelled waiter does not cancel the shared call
+    waiters[0].cancel()
+    results = await asyncio.gather(*waiters[1:])
+    assert calls == 1
+    assert len({id(r) for r in results}) == 1
+    await sf.do("url", fetch)
+    assert calls == 2
+
+
+async def test_async_single_flight_shares_error():
+    sf = AsyncSingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        raise ValueError("upstream is down")
+
+    results = await asyncio.gather(
+        sf.do("url", fetch),
+        sf.do("url", fetch),
+        return_exceptions=True,
+    )
+    assert all(isinstance(r, ValueError) for r in results)
@@ -0,0 +1,87 @@
+import os
+import time
+
+import hishel
+import httpx
+import pytest
+
+from internal import storage as storage_module
+from internal.storage import AsyncPersistentStorage, PersistentStorage
+from tests.fixtures.storage import cache_folder
+
+
+def make_client(upstream_calls: list[str]) -> hishel.CacheClient:
+    def handler(request: httpx.Request) -> httpx.Response:
+        upstream_calls.append(str(request.url))
+        return httpx.Response(200, content=b"[1, 2, 3]")
+
+    return hishel.CacheClient(
+        storage=PersistentStorage("test", ttl=60),
+        controller=hishel.Controller(force_cache=True),
+        transport=httpx.MockTransport(handler),
+    )
+
+
+def test_storage_survives_restart(cache_folder):
+    calls: list[str] = []
+    res = make_client(calls).get("https://example.com/feed.json")
+    assert not res.extensions["from_cache"]
+
+    # new storage instance over the same folder acts as restarted process
+    res = make_client(calls).get("https://example.com/feed.json")
+    assert res.extensions["from_cache"]
+    assert res.content == b"[1, 2, 3]"
+    assert len(calls) == 1
+
+
+def test_storage_ttl(cache_folder):
+    calls: list[str] = []
+    make_client(calls).get("https://example.com/feed.json")
+    old = time.time() - 120
+    for entry in (cache_folder / "test").iterdir():
+        os.utime(entry, (old, old))
+    res = make_client(calls).get("https://example.com/feed.json")
+    assert not res.extensions["from_cache"]
+    assert len(calls) == 2
+
+
+def test_storage_clear(cache_folder):
+    calls: list[str] = []
+    client = make_client(calls)
+    client.get("https://example.com/feed.json")
+    PersistentStorage("test", ttl=60).clear()
+    assert [p.name for p in (cache_folder / "test").iterdir()] == [".gitignore"]
+    client.get("https://example.com/feed.json")
+    assert len(calls) == 2
+
+
+async def test_async_storage_shares_entries(cache_folder):
+    calls: list[str] = []
+    make_client(calls).get("https://example.com/feed.json")
+
+    storage = AsyncPersistentStorage("test", ttl=60)
+    client = hishel.AsyncCacheClient(
+        storage=storage,
+        controller=hishel.Controller(force_cache=True),
+        transport=httpx.MockTransport(lambda r: httpx.Response(500)),
+    )
+    res = await client.get("https://example.com/feed.json")
+    assert res.extensions["from_cache"]
+    assert res.content == b"[1, 2, 3]"
+
+    storage.clear()
+    res = await client.get("https://example.com/feed.json")
+    assert res.status_code == 500
+
+
+def test_storage_removes_expired(cache_folder, monkeypatch: pytest.MonkeyPatch):
+    calls: list[str] = []
+    make_client(calls).get("https://example.com/feed.json")
+    old = time.time() - 120
+    for entry in (cache_folder / "test").iterdir():
+        os.utime(entry, (old, old))
+
+    # storing another entry sweeps the expired one
+    monkeypatch.setattr(storage_module, "CLEANUP_INTERVAL", 0)
+    make_client(calls).get("https://example.com/other.json")
+    assert len(PersistentStorage("test", ttl=60).files()) == 1
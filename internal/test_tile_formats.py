@@ -0,0 +1,28 @@
+import pytest
+
+from internal.png import PNG_SIGNATURE, decode_png, encode_png
+from internal.tile_formats import negotiate_format, recode
+
+
+def test_negotiate_format():
+    assert negotiate_format("image/png") == "png"
+    assert negotiate_format("*/*") == "png"
+    assert negotiate_format("image/avif,image/webp,*/*") == "png8"
+
+
+def test_recode():
+    rows = [bytes(range(i, i + 64)) * 4 for i in range(16)]
+    content = encode_png(64, rows, level=0)
+    res = recode(content, "png8")
+    assert len(res) < len(content)
+    assert res.startswith(PNG_SIGNATURE)
+    assert decode_png(res)[0] == 64
+
+    # palette PNG is not encoded again
+    assert recode(res, "png8") is res
+
+    # larger result is not worth it, the original is kept
+    small = encode_png(1, [b"\x00\x00\x00\xff"])
+    assert recode(small, "png8") == small
+    with pytest.raises(ValueError):
+        recode(b"not a png", "png8")
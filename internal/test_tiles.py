@@ -0,0 +1,430 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from internal import tiles as tiles_module
+from internal.png import decode_png, encode_png
+from internal.tiles import (
+    ByteLRU,
+    ProxyTileCache,
+    Tile,
+    TileCache,
+    TileKey,
+    TilePyramid,
+    TileStore,
+    TileVariants,
+    VariantStore,
+    crop_upscale,
+)
+
+
+def make_cache(
+    tmp_path, calls: list[TileKey], fail: bool = False, max_bytes: int = 1024
+) -> TileCache:
+    async def fetch(key: TileKey) -> bytes:
+        calls.append(key)
+        if fail:
+            raise Exception("upstream is down")
+        return b"tile %d/%d/%d" % key
+
+    return TileCache(
+        "test", TileStore(tmp_path), fetch, ttl=60, max_bytes=max_bytes
+    )
+
+
+def test_byte_lru():
+    lru = ByteLRU(max_bytes=10)
+    for key in "abc":
+        lru.put(key, Tile(b"1234", time.time(), 60))
+    # third tile does not fit, the least recently used one is dropped
+    assert len(lru) == 2 and lru.size == 8
+    assert "a" not in lru
+    lru.get("b")
+    lru.put("d", Tile(b"1234", time.time(), 60))
+    assert "b" in lru and "c" not in lru
+    # a single tile larger than the limit is still kept
+    lru.put("e", Tile(b"x" * 20, time.time(), 60))
+    assert len(lru) == 1 and lru.size == 20
+
+
+def test_tile_store(tmp_path):
+    store = TileStore(tmp_path)
+    assert store.read((3, 1, 2)) is None
+    fetched_at = store.write((3, 1, 2), b"png")
+    assert (tmp_path / "3" / "1" / "2.png").read_bytes() == b"png"
+    assert store.read((3, 1, 2)) == (b"png", fetched_at)
+    assert store.keys() == [(3, 1, 2)]
+    assert store.remove((3, 1, 2))
+    assert not store.remove((3, 1, 2))
+
+
+def test_tile_store_prune(tmp_path):
+    # pruned after each 64 / PRUNE_PARTS = 4 bytes written
+    store = TileStore(tmp_path, max_bytes=64)
+    for y in range(4):
+        store.write((3, 1, y), b"x" * 16, {"etag": '"v1"'})
+        old = time.time() - 100 + y
+        os.utime(store.path((3, 1, y)), (old, old))
+    assert len(store.keys()) == 4
+    # the oldest tile and its meta are removed to fit the new one
+    store.write((3, 1, 4), b"x" * 16)
+    assert sorted(store.keys()) == [(3, 1, y) for y in range(1, 5)]
+    assert store.read_meta((3, 1, 0)) == {}
+    assert store.read_meta((3, 1, 1)) == {"etag": '"v1"'}
+    assert store.prune() == 0
+
+    # variants do not remove the meta of the upstream tile
+    variants = VariantStore(tmp_path, ".png8", max_bytes=16)
+    variants.write((3, 1, 1), b"x" * 16)
+    variants.write((3, 1, 2), b"x" * 16)
+    assert variants.keys() == [(3, 1, 2)]
+    assert store.read_meta((3, 1, 1)) == {"etag": '"v1"'}
+
+
+async def test_tile_cache_layers(tmp_path):
+    calls: list[TileKey] = []
+    tiles = make_cache(tmp_path, calls)
+    tile = await tiles.get((3, 1, 2))
+    assert tile.payload.content == b"tile 3/1/2"
+    assert tile.payload.media_type == "image/png"
+    assert await tiles.get((3, 1, 2)) is tile
+    assert calls == [(3, 1, 2)]
+    assert tiles.counts() == (1, 1)
+
+    # restarted process reads the tile from disk
+    restarted = make_cache(tmp_path, calls)
+    tile = await restarted.get((3, 1, 2))
+    assert tile.payload.content == b"tile 3/1/2"
+    assert calls == [(3, 1, 2)]
+
+    assert [e.key for e in restarted.entries()] == ["3/1/2"]
+    assert restarted.invalidate("3/1/2") == 1
+    assert restarted.invalidate("3/x") == 0
+    await restarted.get((3, 1, 2))
+    assert len(calls) == 2
+
+
+async def test_tile_cache_expired(tmp_path):
+    calls: list[TileKey] = []
+    await make_cache(tmp_path, calls).get((3, 0, 0))
+    old = time.time() - 120
+    os.utime(tmp_path / "3" / "0" / "0.png", (old, old))
+
+    # upstream is down, stale tile is better than nothing
+    tiles = make_cache(tmp_path, calls, fail=True)
+    tile = await tiles.get((3, 0, 0))
+    assert tile.payload.content == b"tile 3/0/0"
+    assert len(calls) == 2
+    with pytest.raises(Exception, match="upstream is down"):
+        await tiles.get((3, 0, 1))
+
+    tile = await make_cache(tmp_path, calls).get((3, 0, 0))
+    assert tile.fetched_at > old
+    assert len(calls) == 4
+
+
+async def test_tile_cache_ensure_fresh(tmp_path):
+    calls: list[TileKey] = []
+    tiles = make_cache(tmp_path, calls)
+    keys = [(3, x, 0) for x in range(4)]
+    await tiles.get(keys[0])
+    await tiles.ensure_fresh(keys)
+    assert sorted(calls) == keys
+    # tiles expiring within the margin are downloaded again
+    await tiles.ensure_fresh(keys, margin=90)
+    assert len(calls) == 8
+
+
+def test_crop_upscale():
+    # 2x2 RGBA pixels a b / c d
+    rows = [b"aaaabbbb", b"ccccdddd"]
+    assert crop_upscale(2, rows, 1, 1, 0) == [b"bbbbbbbb"] * 2
+    assert crop_upscale(2, rows, 1, 0, 1) == [b"cccccccc"] * 2
+    assert crop_upscale(2, rows, 0, 0, 0) == rows
+
+
+async def test_tile_pyramid(tmp_path):
+    calls: list[TileKey] = []
+    version = [b"\x00"]
+
+    async def fetch(key: TileKey) -> bytes:
+        calls.append(key)
+        return encode_png(2, [version[0] * 4 + b"\xff" * 4] * 2)
+
+    base = TileCache("base", TileStore(tmp_path), fetch, ttl=60, max_bytes=1024)
+    pyramid = TilePyramid("pyramid", base, base_zoom=1, max_bytes=1024)
+    # base zoom is served by the base cache itself
+    base_tile = await pyramid.get((1, 0, 0))
+    assert base_tile is await base.get((1, 0, 0))
+
+    # z=3 tile is a quarter of the z=1 parent column
+    tile = await pyramid.get((3, 0, 1))
+    assert decode_png(tile.payload.content) == (2, [b"\x00" * 8] * 2)
+    assert await pyramid.get((3, 0, 1)) is tile
+    await pyramid.get((2, 1, 0))
+    assert calls == [(1, 0, 0)]
+    assert pyramid.counts() == (1, 2)
+    stats = {s.name: s for s in pyramid.breakdown()}
+    assert stats["z3"].entries == 1 and stats["z3"].hits == 1
+    assert stats["z2"].misses == 1
+    assert [e.key for e in pyramid.details().items] == ["3/0/1", "2/1/0"]
+
+    # updated parent invalidates derived tiles
+    version[0] = b"\x7f"
+    base.invalidate("1/0/0")
+    tile = await pyramid.get((3, 0, 1))
+    assert decode_png(tile.payload.content) == (2, [b"\x7f" * 8] * 2)
+    assert pyramid.invalidate("3/0/1") == 1
+    assert pyramid.invalidate() == 1
+
+
+# gradient with more than enough colors to shrink as a palette PNG
+GRADIENT = encode_png(
+    64, [bytes(range(i, i + 64)) * 4 for i in range(16)], level=0
+)
+
+
+async def test_tile_variants(tmp_path, monkeypatch: pytest.MonkeyPatch):
+    variants = TileVariants("variants", tmp_path, max_bytes=1024 * 1024)
+    tile = Tile(GRADIENT, time.time(), 60)
+    assert await variants.get((3, 1, 2), tile, "png") is tile
+
+    variant = await variants.get((3, 1, 2), tile, "png8")
+    assert variant.size < tile.size
+    assert variant.payload.media_type == "image/png"
+    assert variant.payload.etag != tile.payload.etag
+    assert (tmp_path / "3" / "1" / "2.png8").read_bytes() == (
+        variant.payload.content
+    )
+    assert await variants.get((3, 1, 2), tile, "png8") is variant
+
+    # restarted process reads the variant from disk instead of encoding
+    restarted = TileVariants("variants", tmp_path, max_bytes=1024 * 1024)
+    stored = await restarted.get((3, 1, 2), tile, "png8")
+    assert stored.payload.content == variant.payload.content
+    assert restarted.counts() == (1, 0)
+
+    # updated upstream tile is encoded again
+    tile = Tile(GRADIENT, time.time() + 10, 60)
+    await restarted.get((3, 1, 2), tile, "png8")
+    assert restarted.counts() == (1, 1)
+
+    # palette png is not copied, an empty variant marks it as is
+    palette = Tile(variant.payload.content, time.time() - 10, 60)
+    assert await restarted.get((3, 1, 3), palette, "png8") is palette
+    assert (tmp_path / "3" / "1" / "3.png8").read_bytes() == b""
+    assert await restarted.get((3, 1, 3), palette, "png8") is palette
+    assert restarted.counts() == (2, 2)
+    restarted.memory.clear()
+    assert await restarted.get((3, 1, 3), palette, "png8") is palette
+    assert restarted.counts() == (3, 2)
+    restarted.invalidate("3/1/3")
+
+    # tile which is not a png is served as is
+    broken = Tile(b"tile", time.time(), 60)
+    assert await restarted.get((3, 0, 0), broken, "png8") is broken
+
+    assert [e.key for e in restarted.entries()] == ["3/1/2.png8"]
+
+    # image library errors keep the original tile as well
+    def broken_recode(content: bytes, fmt: str) -> bytes:
+        raise OSError("cannot identify image file")
+
+    monkeypatch.setattr(tiles_module, "recode", broken_recode)
+    assert await restarted.get((3, 0, 1), tile, "png8") is tile
+
+    assert restarted.invalidate("3/1/3.png8") == 0
+    assert restarted.invalidate("3/1/2") == 1
+    assert restarted.invalidate() == 0
+
+
+async def test_tile_pyramid_decodes_parent_once(
+    tmp_path, monkeypatch: pytest.MonkeyPatch
+):
+    decoded = []
+
+    def decode(content: bytes) -> tuple[int, list[bytes]]:
+        decoded.append(content)
+        # slow decode, so worker threads overlap
+        time.sleep(0.05)
+        return decode_png(content)
+
+    monkeypatch.setattr(tiles_module, "decode_png", decode)
+
+    async def fetch(key: TileKey) -> bytes:
+        return GRADIENT
+
+    base = TileCache("base", TileStore(tmp_path), fetch, ttl=60, max_bytes=1024)
+    pyramid = TilePyramid("pyramid", base, base_zoom=1, max_bytes=1024 * 1024)
+    await base.get((1, 0, 0))
+    # siblings derived in parallel worker threads share one decode
+    await asyncio.gather(
+        *(pyramid.get((3, x, y)) for x in range(4) for y in range(4))
+    )
+    assert len(decoded) == 1
+    assert len(pyramid.memory) == 16
+
+
+async def test_tile_pyramid_formats(tmp_path):
+    async def fetch(key: TileKey) -> bytes:
+        return GRADIENT
+
+    base = TileCache("base", TileStore(tmp_path), fetch, ttl=60, max_bytes=1024)
+    variants = TileVariants("variants", tmp_path, max_bytes=1024 * 1024)
+    pyramid = TilePyramid(
+        "pyramid", base, base_zoom=1, max_bytes=1024 * 1024, variants=variants
+    )
+    tile = await pyramid.get((1, 0, 0), "png8")
+    assert tile.size < len(GRADIENT)
+    assert (tmp_path / "1" / "0" / "0.png8").exists()
+
+    png = await pyramid.get((2, 0, 0))
+    png8 = await pyramid.get((2, 0, 0), "png8")
+    # IHDR color type: rgba and palette
+    assert png.payload.content[25] == 6
+    assert png8.payload.content[25] == 3
+    assert decode_png(png8.payload.content)[0] == 64
+    assert [e.key for e in pyramid.entries()] == ["2/0/0", "2/0/0.png8"]
+    assert pyramid.invalidate("2/0/0") == 2
+
+
+def make_proxy_app(
+    tmp_path, requests: list[httpx.Request], content: bytes = b"png" * 1000
+) -> TestClient:
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.headers.get("if-none-match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, content=content, headers={"ETag": '"v1"'})
+
+    tiles = ProxyTileCache(
+        "test",
+        TileStore(tmp_path),
+        httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        lambda key: "https://example.com/%d/%d/%d.png" % key,
+        ttl=60,
+        max_bytes=1024 * 1024,
+        max_downloads=2,
+        variants=TileVariants("variants", tmp_path, max_bytes=1024 * 1024),
+    )
+    app = FastAPI()
+
+    @app.get("/{z}/{x}/{y}.png")
+    async def tile(z: int, x: int, y: int, request: Request, fmt: str = "png"):
+        return await tiles.response((z, x, y), request, fmt)
+
+    return TestClient(app)
+
+
+def test_proxy_tile_cache(tmp_path):
+    requests: list[httpx.Request] = []
+    client = make_proxy_app(tmp_path, requests)
+    # miss is streamed once and stored with its validators, concurrent
+    # requests wait for it
+    with client, ThreadPoolExecutor() as pool:
+        responses = list(pool.map(client.get, ["/1/0/1.png"] * 4))
+    assert {r.status_code for r in responses} == {200}
+    assert {r.content for r in responses} == {b"png" * 1000}
+    assert sum("etag" not in r.headers for r in responses) == 1
+    res = responses[0]
+    assert (tmp_path / "1" / "0" / "1.png").read_bytes() == res.content
+    assert TileStore(tmp_path).read_meta((1, 0, 1)) == {"etag": '"v1"'}
+
+    res = client.get("/1/0/1.png")
+    assert res.status_code == 200
+    assert res.headers["etag"]
+    assert len(requests) == 1
+
+    # stale tile is revalidated, 304 extends it without downloading
+    old = time.time() - 120
+    os.utime(tmp_path / "1" / "0" / "1.png", (old, old))
+    client = make_proxy_app(tmp_path, requests)
+    res = client.get("/1/0/1.png")
+    assert res.status_code == 200
+    assert res.content == b"png" * 1000
+    assert requests[-1].headers["if-none-match"] == '"v1"'
+    assert (tmp_path / "1" / "0" / "1.png").stat().st_mtime > old
+    assert len(requests) == 2
+
+
+def test_proxy_tile_variants(tmp_path):
+    requests: list[httpx.Request] = []
+    client = make_proxy_app(tmp_path, requests, GRADIENT)
+    # first request is streamed as is, next ones get the variant
+    res = client.get("/1/0/1.png", params={"fmt": "png8"})
+    assert res.content == GRADIENT
+    res = client.get("/1/0/1.png", params={"fmt": "png8"})
+    assert len(res.content) < len(GRADIENT)
+    assert res.content == (tmp_path / "1" / "0" / "1.png8").read_bytes()
+    res = client.get("/1/0/1.png")
+    assert res.content == GRADIENT
+    assert len(requests) == 1
+
+
+def test_proxy_tile_cache_upstream_error(tmp_path):
+    requests: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(500)
+
+    tiles = ProxyTileCache(
+        "test",
+        TileStore(tmp_path),
+        httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        lambda key: "https://example.com/%d/%d/%d.png" % key,
+        ttl=60,
+        max_bytes=1024,
+        max_downloads=1,
+    )
+    app = FastAPI()
+
+    @app.get("/{z}/{x}/{y}.png")
+    async def tile(z: int, x: int, y: int, request: Request):
+        return await tiles.response((z, x, y), request)
+
+    client = TestClient(app)
+    # failed downloads do not keep the only download permit
+    for _ in range(3):
+        assert client.get("/1/0/1.png").status_code == 502
+    assert len(requests) == 3
+
+
+async def test_proxy_tile_stream_not_started(tmp_path):
+    closed = []
+
+    class Stream(httpx.AsyncByteStream):
+        async def __aiter__(self):
+            yield b"png"
+
+        async def aclose(self):
+            closed.append(True)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, stream=Stream())
+
+    tiles = ProxyTileCache(
+        "test",
+        TileStore(tmp_path),
+        httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        lambda key: "https://example.com/%d/%d/%d.png" % key,
+        ttl=60,
+        max_bytes=1024,
+        max_downloads=1,
+    )
+    res = await tiles.stream((1, 0, 1))
+    # permit is released once upstream has answered
+    assert not tiles._downloads.locked()
+    # client has disconnected before the body, the background task
+    # still closes the upstream response
+    assert res.background is not None
+    await res.background()
+    assert closed == [True]
+    assert tiles._streams == {}
+    assert TileStore(tmp_path).read((1, 0, 1)) is None
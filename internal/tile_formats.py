@@ -0,0 +1,28 @@
+from internal.png import decode_png, encode_png, encode_png8, is_palette_png
+
+
+def negotiate_format(accept: str) -> str:
+    """Формат тайла по заголовку Accept
+
+    Клиенту, принимающему WebP, отдается PNG с палитрой из 256 цветов,
+    остальные получают исходный PNG
+    """
+    # webp support is a marker of a browser, which is fine with lossy tiles
+    return "png8" if "image/webp" in accept else "png"
+
+
+def encode_rgba(fmt: str, width: int, rows: list[bytes]) -> bytes:
+    if fmt == "png8":
+        return encode_png8(width, rows)
+    return encode_png(width, rows)
+
+
+def recode(content: bytes, fmt: str) -> bytes:
+    """Перекодирует PNG тайл, если результат меньше исходного
+
+    PNG с палитрой (например, тайлы OSM) в PNG8 не перекодируются
+    """
+    if fmt == "png8" and is_palette_png(content):
+        return content
+    res = encode_rgba(fmt, *decode_png(content))
+    return res if len(res) < len(content) else content
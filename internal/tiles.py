@@ -0,0 +1,788 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict, defaultdict
+from operator import itemgetter
+from pathlib import Path
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Hashable,
+    Iterable,
+    cast,
+)
+
+import httpx
+import structlog
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from internal.payload import Payload
+from internal.png import decode_png
+from internal.registry import CacheEntry, Namespace, NamespaceStats
+from internal.single_flight import async_upstream
+from internal.storage import atomic_write
+from internal.tile_formats import encode_rgba, recode
+
+log = structlog.stdlib.get_logger(__name__)
+
+TileKey = tuple[int, int, int]
+
+# parallel upstream downloads of one tile set
+MAX_TILE_DOWNLOADS = 16
+# bounded TileStore is pruned after each 1/PRUNE_PARTS of max_bytes written
+PRUNE_PARTS = 16
+
+
+class Tile:
+    __slots__ = ("payload", "fetched_at")
+
+    def __init__(self, content: bytes, fetched_at: float, ttl: float):
+        self.payload = Payload(
+            content,
+            media_type="image/png",
+            expires_at=fetched_at + ttl,
+            compress=False,
+        )
+        self.fetched_at = fetched_at
+
+    @property
+    def size(self) -> int:
+        return len(self.payload.content)
+
+
+class ByteLRU:
+    """LRU, ограниченный суммарным размером тайлов в байтах"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items: OrderedDict[Hashable, Tile] = OrderedDict()
+        # admin endpoints invalidate from the threadpool
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._items
+
+    def items(self) -> list[tuple[Hashable, Tile]]:
+        with self._lock:
+            return list(self._items.items())
+
+    def get(self, key: Hashable) -> Tile | None:
+        with self._lock:
+            tile = self._items.get(key)
+            if tile is not None:
+                self._items.move_to_end(key)
+            return tile
+
+    def put(self, key: Hashable, tile: Tile):
+        with self._lock:
+            self._pop(key)
+            self._items[key] = tile
+            self.size += tile.size
+            while self.size > self.max_bytes and len(self._items) > 1:
+                _, old = self._items.popitem(last=False)
+                self.size -= old.size
+
+    def pop(self, key: Hashable) -> Tile | None:
+        with self._lock:
+            return self._pop(key)
+
+    def _pop(self, key: Hashable) -> Tile | None:
+        tile = self._items.pop(key, None)
+        if tile is not None:
+            self.size -= tile.size
+        return tile
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+
+class TileStore:
+    """Тайлы на диске: folder/z/x/y.png, время загрузки - mtime файла
+
+    Переживает рестарт и общий для всех воркеров на хосте. С max_bytes
+    после записи каждой 1/PRUNE_PARTS части объема удаляются тайлы,
+    загруженные раньше всех, пока хранилище больше max_bytes
+    """
+
+    def __init__(
+        self,
+        folder: str | Path,
+        suffix: str = ".png",
+        max_bytes: int | None = None,
+    ):
+        self.folder = Path(folder)
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        self._written = 0
+        self._prune_lock = threading.Lock()
+
+    def path(self, key: TileKey) -> Path:
+        z, x, y = key
+        return self.folder / str(z) / str(x) / f"{y}{self.suffix}"
+
+    def meta_path(self, key: TileKey) -> Path:
+        return self.path(key).with_suffix(".json")
+
+    def read(self, key: TileKey) -> tuple[bytes, float] | None:
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                return f.read(), os.fstat(f.fileno()).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def read_meta(self, key: TileKey) -> dict[str, str]:
+        """Заголовки для условного запроса (ETag, Last-Modified)"""
+        try:
+            return json.loads(self.meta_path(key).read_bytes())
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def write(
+        self,
+        key: TileKey,
+        content: bytes,
+        meta: dict[str, str] | None = None,
+    ) -> float:
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if meta is not None:
+            atomic_write(self.meta_path(key), json.dumps(meta).encode())
+        atomic_write(path, content)
+        fetched_at = path.stat().st_mtime
+        self._written += len(content)
+        if (
+            self.max_bytes is not None
+            and self._written > self.max_bytes // PRUNE_PARTS
+        ):
+            self._written = 0
+            self.prune()
+        return fetched_at
+
+    def touch(self, key: TileKey) -> float:
+        """Продлевает тайл, который не изменился во внешнем API"""
+        path = self.path(key)
+        path.touch()
+        return path.stat().st_mtime
+
+    def remove(self, key: TileKey) -> bool:
+        self.meta_path(key).unlink(missing_ok=True)
+        try:
+            self.path(key).unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+    def prune(self) -> int:
+        """Удаляет самые старые тайлы сверх max_bytes, возвращает их число"""
+        if self.max_bytes is None or not self._prune_lock.acquire(False):
+            return 0
+        try:
+            files = []
+            for key in self.keys():
+                try:
+                    stat = self.path(key).stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, key))
+            size = sum(f[1] for f in files)
+            count = 0
+            for _, file_size, key in sorted(files):
+                if size <= self.max_bytes:
+                    break
+                # another worker may have removed it already
+                self.remove(key)
+                size -= file_size
+                count += 1
+        finally:
+            self._prune_lock.release()
+        if count:
+            log.info(f"Pruned {count} tiles from {self.folder}")
+        return count
+
+    def keys(self) -> list[TileKey]:
+        res = []
+        for path in self.folder.glob(f"*/*/*{self.suffix}"):
+            try:
+                key = (
+                    int(path.parent.parent.name),
+                    int(path.parent.name),
+                    int(path.name.removesuffix(self.suffix)),
+                )
+            except ValueError:
+                continue
+            res.append(key)
+        return res
+
+
+def format_key(key: TileKey) -> str:
+    return "/".join(map(str, key))
+
+
+def parse_key(key: str) -> TileKey | None:
+    try:
+        z, x, y = map(int, key.split("/"))
+    except ValueError:
+        return None
+    return z, x, y
+
+
+class TileCache(Namespace):
+    """Кэш тайлов внешнего API: LRU в памяти поверх хранилища на диске
+
+    Обработчики запросов читают тайл из памяти или с диска, внешний API
+    запрашивается только при отсутствии свежего тайла. Если API
+    недоступен, отдается устаревший тайл
+    """
+
+    kind = "tiles"
+
+    def __init__(
+        self,
+        name: str,
+        store: TileStore,
+        fetch: Callable[[TileKey], Awaitable[bytes]] | None,
+        ttl: float,
+        max_bytes: int,
+        max_downloads: int = MAX_TILE_DOWNLOADS,
+        warm: Callable[[], Awaitable[Any]] | None = None,
+    ):
+        super().__init__(name, warm)
+        self.store = store
+        self.ttl = ttl
+        self.memory = ByteLRU(max_bytes)
+        self._fetch = fetch
+        self._downloads = asyncio.Semaphore(max_downloads)
+        self.hits = 0
+        self.misses = 0
+
+    def is_fresh(self, tile: Tile, margin: float = 0) -> bool:
+        return time.time() + margin < tile.fetched_at + self.ttl
+
+    async def cached(self, key: TileKey) -> Tile | None:
+        """Тайл из памяти или с диска, возможно устаревший"""
+        tile = self.memory.get(key)
+        if tile is not None:
+            return tile
+        stored = await asyncio.to_thread(self.store.read, key)
+        if stored is None:
+            return None
+        tile = Tile(stored[0], stored[1], self.ttl)
+        self.memory.put(key, tile)
+        return tile
+
+    async def get(self, key: TileKey) -> Tile:
+        tile = await self.cached(key)
+        if tile is not None and self.is_fresh(tile):
+            self.hits += 1
+            return tile
+        self.misses += 1
+        try:
+            return await self.download(key)
+        except Exception as e:
+            if tile is None:
+                raise
+            log.warning(f"Serving stale tile {self.name} {key}: {e}")
+            return tile
+
+    async def download(self, key: TileKey) -> Tile:
+        # concurrent misses of the same tile share one upstream request
+        return await async_upstream.do(
+            (self.name, key), lambda: self._download(key)
+        )
+
+    async def _download(self, key: TileKey) -> Tile:
+        assert self._fetch is not None
+        async with self._downloads:
+            content = await self._fetch(key)
+        fetched_at = await asyncio.to_thread(self.store.write, key, content)
+        return self._remember(key, content, fetched_at)
+
+    def _remember(
+        self, key: TileKey, content: bytes, fetched_at: float
+    ) -> Tile:
+        tile = Tile(content, fetched_at, self.ttl)
+        self.memory.put(key, tile)
+        return tile
+
+    async def ensure_fresh(
+        self, keys: Iterable[TileKey], margin: float = 0
+    ) -> list[Tile]:
+        """Загружает тайлы, которые устареют в ближайшие margin секунд"""
+
+        async def one(key: TileKey) -> Tile:
+            tile = await self.cached(key)
+            if tile is not None and self.is_fresh(tile, margin):
+                return tile
+            return await self.download(key)
+
+        return await asyncio.gather(*(one(key) for key in keys))
+
+    def counts(self) -> tuple[int, int]:
+        return self.hits, self.misses
+
+    def entries(self) -> list[CacheEntry]:
+        now = time.time()
+        res = []
+        for key in self.store.keys():
+            try:
+                stat = self.store.path(key).stat()
+            except FileNotFoundError:
+                continue
+            res.append(
+                CacheEntry(
+                    key=format_key(key),
+                    size=stat.st_size,
+                    age=round(now - stat.st_mtime, 1),
+                )
+            )
+        return res
+
+    def invalidate(self, key: str | None = None) -> int:
+        if key is None:
+            keys = self.store.keys()
+            self.memory.clear()
+        else:
+            parsed = parse_key(key)
+            if parsed is None:
+                return 0
+            keys = [parsed]
+            self.memory.pop(parsed)
+        return sum(self.store.remove(k) for k in keys)
+
+
+class VariantStore(TileStore):
+    """TileStore перекодированных тайлов рядом с исходными
+
+    Метаданные (z/x/y.json) принадлежат исходному тайлу и не удаляются
+    """
+
+    def remove(self, key: TileKey) -> bool:
+        try:
+            self.path(key).unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+
+# file suffixes of re-encoded tiles, next to the upstream z/x/y.png
+VARIANT_SUFFIXES = {"png8": ".png8"}
+
+
+def format_variant_key(key: TileKey, fmt: str) -> str:
+    return format_key(key) + VARIANT_SUFFIXES.get(fmt, "")
+
+
+def parse_variant_key(key: str) -> tuple[TileKey | None, str | None]:
+    """Ключ тайла и формат, None - все форматы тайла"""
+    for fmt, suffix in VARIANT_SUFFIXES.items():
+        if key.endswith(suffix):
+            return parse_key(key.removesuffix(suffix)), fmt
+    return parse_key(key), None
+
+
+class TileVariants(Namespace):
+    """Перекодированные тайлы TileCache (PNG с палитрой)
+
+    Вариант кодируется один раз на версию исходного тайла и хранится
+    на диске рядом с ним (z/x/y.png8), пока исходный тайл не обновится.
+    Пустой вариант означает, что тайл отдается как есть.
+    disk_bytes ограничивает хранилище каждого формата на диске
+    """
+
+    kind = "tiles"
+
+    def __init__(
+        self,
+        name: str,
+        folder: str | Path,
+        max_bytes: int,
+        disk_bytes: int | None = None,
+    ):
+        super().__init__(name)
+        self.stores = {
+            fmt: VariantStore(folder, suffix, disk_bytes)
+            for fmt, suffix in VARIANT_SUFFIXES.items()
+        }
+        self.memory = ByteLRU(max_bytes)
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: TileKey, tile: Tile, fmt: str) -> Tile:
+        if fmt not in self.stores:
+            return tile
+        variant = self.memory.get((key, fmt))
+        if variant is not None and variant.fetched_at == tile.fetched_at:
+            self.hits += 1
+            return variant if variant.size else tile
+        stored = await asyncio.to_thread(self.stores[fmt].read, key)
+        # written after the upstream tile, so it was encoded from it
+        if stored is not None and stored[1] >= tile.fetched_at:
+            self.hits += 1
+            return self._remember(key, fmt, tile, stored[0])
+        self.misses += 1
+        return await async_upstream.do(
+            (self.name, key, fmt, tile.fetched_at),
+            lambda: self._encode(key, fmt, tile),
+        )
+
+    async def _encode(self, key: TileKey, fmt: str, tile: Tile) -> Tile:
+        try:
+            content = await asyncio.to_thread(recode, tile.payload.content, fmt)
+        except (ValueError, OSError) as e:
+            log.warning(f"Failed to encode tile {self.name} {key}: {e}")
+            return tile
+        if content is tile.payload.content:
+            # not worth a copy, the empty variant marks the tile as is
+            content = b""
+        await asyncio.to_thread(self.stores[fmt].write, key, content)
+        return self._remember(key, fmt, tile, content)
+
+    def _remember(
+        self, key: TileKey, fmt: str, tile: Tile, content: bytes
+    ) -> Tile:
+        variant = Tile(
+            content,
+            tile.fetched_at,
+            tile.payload.expires_at - tile.fetched_at,
+        )
+        self.memory.put((key, fmt), variant)
+        return variant if content else tile
+
+    def counts(self) -> tuple[int, int]:
+        return self.hits, self.misses
+
+    def entries(self) -> list[CacheEntry]:
+        now = time.time()
+        res = []
+        for fmt, store in self.stores.items():
+            for key in store.keys():
+                try:
+                    stat = store.path(key).stat()
+                except FileNotFoundError:
+                    continue
+                res.append(
+                    CacheEntry(
+                        key=format_variant_key(key, fmt),
+                        size=stat.st_size,
+                        age=round(now - stat.st_mtime, 1),
+                    )
+                )
+        return res
+
+    def invalidate(self, key: str | None = None) -> int:
+        if key is None:
+            self.memory.clear()
+            targets = [
+                (k, fmt)
+                for fmt, store in self.stores.items()
+                for k in store.keys()
+            ]
+        else:
+            parsed, only = parse_variant_key(key)
+            if parsed is None:
+                return 0
+            targets = [
+                (parsed, fmt) for fmt in self.stores if only in (None, fmt)
+            ]
+        count = 0
+        for k, fmt in targets:
+            self.memory.pop((k, fmt))
+            count += self.stores[fmt].remove(k)
+        return count
+
+
+VALIDATORS = {"etag": "If-None-Match", "last-modified": "If-Modified-Since"}
+
+
+class ProxyTileCache(TileCache):
+    """TileCache для проксирования тайлов как есть
+
+    Устаревший тайл перезапрашивается условным запросом (ETag,
+    Last-Modified), при 304 продлевается без загрузки. Отсутствующий тайл
+    отдается клиенту потоком по мере загрузки и сохраняется в кэш,
+    одновременные запросы того же тайла ждут его сохранения
+    """
+
+    def __init__(
+        self,
+        name: str,
+        store: TileStore,
+        client: httpx.AsyncClient,
+        url: Callable[[TileKey], str],
+        ttl: float,
+        max_bytes: int,
+        max_downloads: int,
+        variants: TileVariants | None = None,
+    ):
+        # tiles are downloaded by the conditional _download below
+        super().__init__(name, store, None, ttl, max_bytes, max_downloads)
+        self.client = client
+        self.url = url
+        self.variants = variants
+        # misses being streamed, resolved with the stored tile
+        self._streams: dict[TileKey, asyncio.Future[Tile | None]] = {}
+
+    async def response(
+        self, key: TileKey, request: Request, fmt: str = "png"
+    ) -> Response:
+        """Тайл в формате fmt, отсутствующий тайл отдается как есть"""
+        tile = await self.cached(key)
+        if tile is None and key in self._streams:
+            tile = await asyncio.shield(self._streams[key])
+        if tile is not None and self.is_fresh(tile):
+            self.hits += 1
+        else:
+            self.misses += 1
+            if tile is None:
+                return await self.stream(key)
+            try:
+                tile = await self.download(key)
+            except Exception as e:
+                log.warning(f"Serving stale tile {self.name} {key}: {e}")
+        if self.variants is not None:
+            tile = await self.variants.get(key, tile, fmt)
+        return tile.payload.response(request)
+
+    async def _download(self, key: TileKey) -> Tile:
+        meta = await asyncio.to_thread(self.store.read_meta, key)
+        headers = {VALIDATORS[k]: v for k, v in meta.items() if k in VALIDATORS}
+        async with self._downloads:
+            res = await self.client.get(self.url(key), headers=headers)
+        if res.status_code == 304:
+            stored = await asyncio.to_thread(self.store.read, key)
+            if stored is not None:
+                fetched_at = await asyncio.to_thread(self.store.touch, key)
+                return self._remember(key, stored[0], fetched_at)
+        if res.status_code != 200:
+            raise Exception(f"Failed to get tile {key} ({res.status_code})")
+        return await self._save(key, res, res.content)
+
+    async def _save(
+        self, key: TileKey, res: httpx.Response, content: bytes
+    ) -> Tile:
+        meta = {k: res.headers[k] for k in VALIDATORS if k in res.headers}
+        fetched_at = await asyncio.to_thread(
+            self.store.write, key, content, meta
+        )
+        return self._remember(key, content, fetched_at)
+
+    async def stream(self, key: TileKey) -> Response:
+        """Отдает отсутствующий тайл потоком и сохраняет его целиком
+
+        Разрешение на загрузку держится только до ответа источника
+        """
+        done = self._streams[key] = asyncio.get_running_loop().create_future()
+        res: httpx.Response | None = None
+
+        async def finish(tile: Tile | None = None):
+            # runs from the body and as a background task, whichever is first
+            if self._streams.get(key) is done:
+                del self._streams[key]
+            if not done.done():
+                done.set_result(tile)
+            if res is not None:
+                await res.aclose()
+
+        try:
+            async with self._downloads:
+                res = await self.client.send(
+                    self.client.build_request("GET", self.url(key)),
+                    stream=True,
+                )
+            if res.status_code != 200:
+                raise Exception(f"Failed to get tile {key} ({res.status_code})")
+        except Exception as e:
+            await finish()
+            log.warning(f"Failed to get tile {self.name} {key}: {e}")
+            raise HTTPException(
+                status_code=502, detail="Failed to get tile from upstream"
+            ) from e
+        upstream = res
+
+        async def body() -> AsyncIterator[bytes]:
+            chunks = []
+            tile = None
+            try:
+                async for chunk in upstream.aiter_bytes():
+                    chunks.append(chunk)
+                    yield chunk
+                # not reached if the client has disconnected midway
+                tile = await self._save(key, upstream, b"".join(chunks))
+            finally:
+                await finish(tile)
+
+        return StreamingResponse(
+            body(), media_type="image/png", background=BackgroundTask(finish)
+        )
+
+
+# decoded base tiles, derived tiles of one parent share them
+MAX_DECODED_TILES = 16
+
+
+def crop_upscale(
+    width: int, rows: list[bytes], shift: int, dx: int, dy: int
+) -> list[bytes]:
+    """Часть RGBA тайла, увеличенная в 2**shift раз (nearest neighbor)
+
+    dx, dy - номер части по горизонтали и вертикали
+    """
+    factor = 2**shift
+    part = len(rows) // factor
+    cols = [dx * width // factor + c // factor for c in range(width)]
+    pick = itemgetter(*cols)
+    scaled: dict[int, bytes] = {}
+    res = []
+    for r in range(len(rows)):
+        src = dy * part + r // factor
+        row = scaled.get(src)
+        if row is None:
+            pixels = array("I", rows[src])
+            row = scaled[src] = array("I", pick(pixels)).tobytes()
+        res.append(row)
+    return res
+
+
+class TilePyramid(Namespace):
+    """Тайлы зумов больше базового, вырезанные из тайла базового зума
+
+    Не расходует запросы к внешнему API: родитель берется из TileCache,
+    производные тайлы пересчитываются при обновлении родителя и хранятся
+    в ограниченном LRU сразу в запрошенном формате
+    """
+
+    kind = "tiles"
+
+    def __init__(
+        self,
+        name: str,
+        base: TileCache,
+        base_zoom: int,
+        max_bytes: int,
+        variants: TileVariants | None = None,
+    ):
+        super().__init__(name)
+        self.base = base
+        self.base_zoom = base_zoom
+        self.variants = variants
+        self.memory = ByteLRU(max_bytes)
+        self._decoded: OrderedDict[
+            tuple[TileKey, float], tuple[int, list[bytes]]
+        ] = OrderedDict()
+        self._decode_lock = threading.Lock()
+        # zoom -> [hits, misses]
+        self._counts: defaultdict[int, list[int]] = defaultdict(lambda: [0, 0])
+
+    async def get(self, key: TileKey, fmt: str = "png") -> Tile:
+        z, x, y = key
+        shift = z - self.base_zoom
+        if shift <= 0:
+            base_tile = await self.base.get(key)
+            if self.variants is None:
+                return base_tile
+            return await self.variants.get(key, base_tile, fmt)
+        parent_key = (self.base_zoom, x >> shift, y >> shift)
+        parent = await self.base.get(parent_key)
+        tile = self.memory.get((key, fmt))
+        if tile is not None and tile.fetched_at == parent.fetched_at:
+            self._counts[z][0] += 1
+            return tile
+        self._counts[z][1] += 1
+        content = await asyncio.to_thread(
+            self._derive, parent_key, parent, shift, x, y, fmt
+        )
+        tile = Tile(content, parent.fetched_at, self.base.ttl)
+        self.memory.put((key, fmt), tile)
+        return tile
+
+    def _derive(
+        self,
+        parent_key: TileKey,
+        parent: Tile,
+        shift: int,
+        x: int,
+        y: int,
+        fmt: str,
+    ) -> bytes:
+        decoded_key = (parent_key, parent.fetched_at)
+        # decoding is pure python and holds the GIL anyway, so workers
+        # deriving siblings wait for one decode instead of repeating it
+        with self._decode_lock:
+            decoded = self._decoded.get(decoded_key)
+            if decoded is None:
+                decoded = decode_png(parent.payload.content)
+                self._decoded[decoded_key] = decoded
+                if len(self._decoded) > MAX_DECODED_TILES:
+                    self._decoded.popitem(last=False)
+            else:
+                self._decoded.move_to_end(decoded_key)
+        width, rows = decoded
+        mask = 2**shift - 1
+        return encode_rgba(
+            fmt, width, crop_upscale(width, rows, shift, x & mask, y & mask)
+        )
+
+    def counts(self) -> tuple[int, int]:
+        return (
+            sum(c[0] for c in self._counts.values()),
+            sum(c[1] for c in self._counts.values()),
+        )
+
+    def tiles(self) -> list[tuple[tuple[TileKey, str], Tile]]:
+        return cast(list[tuple[tuple[TileKey, str], Tile]], self.memory.items())
+
+    def entries(self) -> list[CacheEntry]:
+        return [
+            CacheEntry(key=format_variant_key(key, fmt), size=tile.size)
+            for (key, fmt), tile in self.tiles()
+        ]
+
+    def breakdown(self) -> list[NamespaceStats]:
+        sizes: defaultdict[int, list[int]] = defaultdict(lambda: [0, 0])
+        # copy, requests add zoom levels while admin lists them in a thread
+        counts = defaultdict(lambda: [0, 0], self._counts)
+        for ((z, _, _), _), tile in self.tiles():
+            sizes[z][0] += 1
+            sizes[z][1] += tile.size
+        return [
+            NamespaceStats(
+                name=f"z{z}",
+                kind=self.kind,
+                entries=sizes[z][0],
+                size=sizes[z][1],
+                hits=counts[z][0],
+                misses=counts[z][1],
+                oldest_age=None,
+            )
+            for z in sorted(set(sizes) | set(counts))
+        ]
+
+    def invalidate(self, key: str | None = None) -> int:
+        if key is None:
+            count = len(self.memory)
+            self.memory.clear()
+            with self._decode_lock:
+                self._decoded.clear()
+            return count
+        parsed, only = parse_variant_key(key)
+        if parsed is None:
+            return 0
+        return sum(
+            self.memory.pop((parsed, fmt)) is not None
+            for fmt in ("png", *VARIANT_SUFFIXES)
+            if only in (None, fmt)
+        )
@@ -18,6 +18,8 @@ from internal.fcm import fcm_lifespan
 from internal.jobs import job_router
 from internal.jobs.job_router import scheduler_lifespan
 from internal.logger import setup_logging, setup_uvicorn_logging
+from internal.nooa.openweather_req import legacy_cloud_lifespan
+from internal.refresher import readiness, refresher_lifespan, warmup_lifespan
 from internal.routers import admin_router, api_router, proxy_router, user_router
 from internal.settings import (
     ALLOWED_ORIGINS,
@@ -60,7 +62,16 @@ async def db_lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
 
 
 app = FastAPI(
-    lifespan=app_lifespan([db_lifespan, scheduler_lifespan, fcm_lifespan]),
+    lifespan=app_lifespan(
+        [
+            db_lifespan,
+            scheduler_lifespan,
+            fcm_lifespan,
+            legacy_cloud_lifespan,
+            warmup_lifespan,
+            refresher_lifespan,
+        ]
+    ),
     swagger_ui_parameters={"syntaxHighlight": False},
     docs_url=None,
     redoc_url=None,
@@ -73,6 +84,15 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/ready", include_in_schema=False)
+async def ready():
+    """Готовность принимать трафик: кэши внешних API прогреты"""
+    return JSONResponse(
+        status_code=200 if readiness.ready else 503,
+        content=readiness.as_dict(),
+    )
+
+
 @app.get("/", include_in_schema=False)
 async def redirect_docs():
     return RedirectResponse(url="/docs")
@@ -0,0 +1,35 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from internal.nooa import nooa_req
+from internal.nooa.ovation import OvationGrid
+from main import app
+
+OBSERVATION_TIME = datetime(2025, 1, 11, 15, 6, tzinfo=timezone.utc)
+
+
+def make_grid(
+    coordinates: list[list[int]],
+    observation_time: datetime = OBSERVATION_TIME,
+    hours: int = 1,
+) -> OvationGrid:
+    return OvationGrid.from_coordinates(
+        observation_time,
+        observation_time + timedelta(hours=hours),
+        coordinates,
+    )
+
+
+@pytest.fixture
+def aurora_grid():
+    grid = make_grid(
+        [
+            [33, 69, 40],
+            [50, 59, 10],
+            [270, 56, 5],
+        ]
+    )
+    app.dependency_overrides[nooa_req.use_nooa_aurora_grid] = lambda: grid
+    yield grid
+    app.dependency_overrides.pop(nooa_req.use_nooa_aurora_grid, None)
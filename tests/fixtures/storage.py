@@ -0,0 +1,9 @@
+import pytest
+
+from internal import storage
+
+
+@pytest.fixture
+def cache_folder(tmp_path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(storage, "CACHE_FOLDER", str(tmp_path))
+    return tmp_path
@@ -1,7 +1,11 @@
+import time
+
 import pytest
 from fastapi.testclient import TestClient
 
+from internal import payload
 from internal.db.schemas import BannerIn, CityIn
+from internal.nooa import openweather_req
 from tests.fixtures import admin_auth, city, client
 from tests.fixtures.banner import (
     banner,
@@ -57,3 +61,45 @@ async def test_delete_banner(
     res = client.get("/api/v1/all-banners")
     assert res.status_code == 200
     assert res.json() == []
+
+
+def test_cache_registry(client: TestClient):
+    res = client.get("/api/v1/cache", auth=admin_auth)
+    assert res.status_code == 200
+    names = {ns["name"] for ns in res.json()}
+    assert {"swpc", "nooa", "nooa-long", "openweather"} <= names
+    assert {"snapshots", "ovation-maps", "aurora-tiles"} <= names
+
+    res = client.get("/api/v1/cache/etags", auth=admin_auth)
+    assert res.status_code == 200
+    assert res.json()["name"] == "etags"
+
+    res = client.delete(
+        "/api/v1/cache/aurora-tiles", params={"key": "9/9/9"}, auth=admin_auth
+    )
+    assert res.status_code == 404
+    res = client.delete("/api/v1/cache/aurora-tiles", auth=admin_auth)
+    assert res.status_code == 200
+    res = client.post("/api/v1/cache/aurora-tiles/warm", auth=admin_auth)
+    assert res.status_code == 400
+    res = client.get("/api/v1/cache/unknown", auth=admin_auth)
+    assert res.status_code == 404
+    res = client.get("/api/v1/cache")
+    assert res.status_code == 401
+
+
+def test_cache_warm_cloud_tiles(
+    client: TestClient, monkeypatch: pytest.MonkeyPatch
+):
+    refreshed = []
+
+    async def refresh():
+        refreshed.append(True)
+
+    monkeypatch.setattr(openweather_req.cloud_snapshot, "refresh", refresh)
+    # etags of the old responses are forgotten
+    monkeypatch.setitem(payload._known_etags, "key", ('"a"', time.time() + 60))
+    res = client.post("/api/v1/cache/openweather/warm", auth=admin_auth)
+    assert res.status_code == 200
+    assert refreshed == [True]
+    assert "key" not in payload._known_etags
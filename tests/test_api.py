@@ -1,7 +1,26 @@
+import time
+from datetime import datetime, timedelta, timezone
+
 import pytest
 from fastapi.testclient import TestClient
 
 from internal.db.schemas import BannerIn, CityIn
+from internal.nooa import nooa_req, openweather_req, swpc_req
+from internal.nooa.archive import OvationArchive, use_aurora_archive
+from internal.nooa.calc import MAX_BATCH_SIZE
+from internal.nooa.ovation import (
+    MAP_BIN_HEADER,
+    MAP_BIN_MAGIC,
+    MAP_BIN_VERSION,
+    GridHistory,
+    OvationGrid,
+    grid_index,
+)
+from internal.payload import Payload
+from internal.png import decode_png, encode_png
+from internal.refresher import readiness
+from internal.tiles import TileKey, TileStore, TileVariants
+from main import app
 from tests.fixtures import (
     admin_auth,
     city,
@@ -12,6 +31,7 @@ from tests.fixtures.banner import (
     banner,
     setup_banner,
 )
+from tests.fixtures.ovation import aurora_grid
 from tests.test_utils import init_memory_sqlite
 
 
@@ -21,6 +41,17 @@ def test_health(client: TestClient):
     assert response.json() == {"status": "ok"}
 
 
+def test_ready(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(readiness, "ready", False)
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.json()["status"] == "warming"
+    monkeypatch.setattr(readiness, "ready", True)
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.json()["status"] == "ready"
+
+
 @pytest.mark.asyncio
 @init_memory_sqlite()
 async def test_add_remove_city(client: TestClient, city: CityIn):
@@ -186,3 +217,465 @@ async def test_all_banner_default(
     )
     assert res.status_code == 200
     assert res.json() == [b]
+
+
+def test_aurora_nooa_probability_batch(
+    client: TestClient,
+    aurora_grid: OvationGrid,
+):
+    res = client.post(
+        "/api/v1/aurora-nooa-probability-batch",
+        json=[
+            {"lat": 68.9792, "lon": 33.0925},
+            {"lat": 58.6, "lon": 49.6},
+            {"lat": 55.75, "lon": -89.62},
+            {"lat": 0, "lon": 0},
+        ],
+    )
+    assert res.status_code == 200
+    assert [r["probability"] for r in res.json()] == [40, 10, 5, 0]
+    assert res.json()[2] == {
+        "probability": 5,
+        "lat": 56,
+        "lon": -90,
+        "nooa_lat": 56,
+        "nooa_lon": 270,
+    }
+
+
+def test_aurora_nooa_probability_batch_limit(
+    client: TestClient,
+    aurora_grid: OvationGrid,
+):
+    res = client.post(
+        "/api/v1/aurora-nooa-probability-batch",
+        json=[{"lat": 0, "lon": 0}] * (MAX_BATCH_SIZE + 1),
+    )
+    assert res.status_code == 422
+
+
+@pytest.mark.parametrize(
+    "pos",
+    [
+        {"lat": 90.1, "lon": 0},
+        {"lat": -91, "lon": 0},
+        {"lat": 0, "lon": 360.5},
+        {"lat": 0, "lon": -181},
+    ],
+)
+def test_aurora_nooa_probability_out_of_range(
+    client: TestClient, aurora_grid: OvationGrid, pos: dict[str, float]
+):
+    res = client.post("/api/v1/aurora-nooa-probability", json=pos)
+    assert res.status_code == 422
+    res = client.post("/api/v1/aurora-nooa-probability-batch", json=[pos])
+    assert res.status_code == 422
+
+
+def test_aurora_nooa_probability_bounds(
+    client: TestClient, aurora_grid: OvationGrid
+):
+    res = client.post(
+        "/api/v1/aurora-nooa-probability-batch",
+        json=[
+            {"lat": 90, "lon": 359.6},
+            {"lat": -90, "lon": 360},
+            {"lat": 0, "lon": -180},
+        ],
+    )
+    assert res.status_code == 200
+    assert [(r["nooa_lat"], r["nooa_lon"]) for r in res.json()] == [
+        (90, 0),
+        (-90, 0),
+        (0, 180),
+    ]
+
+
+def test_aurora_map(client: TestClient, aurora_grid: OvationGrid):
+    res = client.get("/api/v1/aurora-map")
+    assert res.status_code == 200
+    r = res.json()
+    assert r["Forecast Time"] == "2025-01-11T16:06:00Z"
+    assert len(r["coordinates"]) == 360 * 181
+    assert [33, 69, 40] in r["coordinates"]
+
+
+def test_aurora_map_delta(
+    client: TestClient,
+    aurora_grid: OvationGrid,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    base = OvationGrid.from_coordinates(
+        aurora_grid.observation_time - timedelta(minutes=5),
+        aurora_grid.forecast_time - timedelta(minutes=5),
+        [[33, 69, 35], [50, 59, 10]],
+    )
+    history = GridHistory()
+    history.add(base)
+    monkeypatch.setattr(nooa_req, "aurora_history", history)
+    res = client.get(
+        "/api/v1/aurora-map-delta",
+        params={"since": "2025-01-11T15:01:00Z"},
+    )
+    assert res.status_code == 200
+    r = res.json()
+    assert r["Base Observation Time"] == "2025-01-11T15:01:00Z"
+    assert r["changes"] == [
+        [grid_index(33, 69), 40],
+        [grid_index(270, 56), 5],
+    ]
+
+    # unknown base version, full map is returned
+    res = client.get(
+        "/api/v1/aurora-map-delta",
+        params={"since": "2025-01-11T14:00:00Z"},
+    )
+    assert res.status_code == 200
+    r = res.json()
+    assert "Base Observation Time" not in r
+    assert len(r["coordinates"]) == 360 * 181
+
+    res = client.get(
+        "/api/v1/aurora-map-delta", params={"since": "2025-01-11T14:00:00"}
+    )
+    assert res.status_code == 422
+
+
+def test_aurora_contours(client: TestClient, aurora_grid: OvationGrid):
+    res = client.get("/api/v1/aurora-contours")
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "application/geo+json"
+    r = res.json()
+    assert r["type"] == "FeatureCollection"
+    assert [f["properties"]["probability"] for f in r["features"]] == [
+        10,
+        30,
+        50,
+    ]
+    # single 40% cell, its 30% contour is smaller than the minimal area
+    assert len(r["features"][0]["geometry"]["coordinates"]) == 1
+    assert not r["features"][1]["geometry"]["coordinates"]
+
+
+def test_aurora_map_filtered(client: TestClient, aurora_grid: OvationGrid):
+    res = client.get(
+        "/api/v1/aurora-map",
+        params={"lat_min": 50, "lon_min": -90, "lon_max": 40, "stride": 1},
+    )
+    assert res.status_code == 200
+    assert len(res.json()["coordinates"]) == 131 * 41
+
+    res = client.get(
+        "/api/v1/aurora-map",
+        params={"lat_min": 50, "min_probability": 1},
+    )
+    assert res.status_code == 200
+    assert res.json()["coordinates"] == [
+        [33, 69, 40],
+        [50, 59, 10],
+        [270, 56, 5],
+    ]
+
+    res = client.get(
+        "/api/v1/aurora-map",
+        params={"lat_min": 54, "stride": 5, "min_probability": 1},
+    )
+    assert res.status_code == 200
+    assert res.json()["coordinates"] == [[50, 59, 10]]
+
+
+def test_aurora_map_invalid_region(
+    client: TestClient,
+    aurora_grid: OvationGrid,
+):
+    res = client.get("/api/v1/aurora-map", params={"lat_min": 60, "lat_max": 0})
+    assert res.status_code == 422
+
+
+def test_aurora_map_bin(client: TestClient, aurora_grid: OvationGrid):
+    res = client.get(
+        "/api/v1/aurora-map",
+        params={"lat_min": 50, "lon_min": 30, "lon_max": 60},
+        headers={"Accept": "application/octet-stream"},
+    )
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "application/octet-stream"
+    header = MAP_BIN_HEADER.unpack_from(res.content)
+    assert header[:2] == (MAP_BIN_MAGIC, MAP_BIN_VERSION)
+    assert header[6:] == (30, 50, 31, 41)
+    raster = res.content[MAP_BIN_HEADER.size :]
+    assert len(raster) == 31 * 41
+    assert raster[(33 - 30) * 41 + 69 - 50] == 40
+    assert raster[(50 - 30) * 41 + 59 - 50] == 10
+    assert sum(raster) == 50
+
+
+def test_aurora_map_compressed(client: TestClient, aurora_grid: OvationGrid):
+    res = client.get("/api/v1/aurora-map", headers={"Accept-Encoding": "gzip"})
+    assert res.status_code == 200
+    assert res.headers["content-encoding"] == "gzip"
+    assert len(res.json()["coordinates"]) == 360 * 181
+    etag = res.headers["etag"]
+
+    res = client.get("/api/v1/aurora-map", headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.content == b""
+
+    res = client.get(
+        "/api/v1/aurora-map",
+        params={"stride": 5},
+        headers={"If-None-Match": etag},
+    )
+    assert res.status_code == 200
+    assert res.headers["etag"] != etag
+
+
+def test_aurora_kp_not_modified(client: TestClient):
+    payload = Payload(b"[]", expires_at=time.time() + 60)
+    app.dependency_overrides[nooa_req.use_nooa_aurora_kp_payload] = (
+        lambda: payload
+    )
+    try:
+        res = client.get("/api/v1/aurora-kp-3")
+        assert res.status_code == 200
+        assert res.json() == []
+        assert res.headers["etag"] == payload.etag
+
+        def fail():
+            raise AssertionError("304 must not touch upstream cache")
+
+        app.dependency_overrides[nooa_req.use_nooa_aurora_kp_payload] = fail
+        res = client.get(
+            "/api/v1/aurora-kp-3",
+            headers={"If-None-Match": f"W/{payload.etag}"},
+        )
+        assert res.status_code == 304
+        assert res.headers["etag"] == payload.etag
+    finally:
+        app.dependency_overrides.pop(nooa_req.use_nooa_aurora_kp_payload)
+
+
+@pytest.mark.asyncio
+@init_memory_sqlite()
+async def test_aurora_history(client: TestClient, city: CityIn, tmp_path):
+    archive = OvationArchive(tmp_path)
+    start = datetime(2025, 1, 11, 15, 6, tzinfo=timezone.utc)
+    for hour, aurora in enumerate([10, 20, 30]):
+        observation_time = start + timedelta(hours=hour)
+        archive.append(
+            OvationGrid.from_coordinates(
+                observation_time,
+                observation_time + timedelta(hours=1),
+                [[33, 69, aurora]],
+            )
+        )
+    app.dependency_overrides[use_aurora_archive] = lambda: archive
+    try:
+        params: dict[str, str | float] = {
+            "lat": 68.9,
+            "lon": 33.2,
+            "start": "2025-01-11T17:00:00Z",
+            "end": "2025-01-11T19:00:00Z",
+        }
+        res = client.get("/api/v1/aurora-history", params=params)
+        assert res.status_code == 200
+        assert res.json() == {
+            "lat": 69,
+            "lon": 33,
+            "nooa_lat": 69,
+            "nooa_lon": 33,
+            "points": [
+                {
+                    "observation_time": "2025-01-11T16:06:00Z",
+                    "forecast_time": "2025-01-11T17:06:00Z",
+                    "probability": 20,
+                },
+                {
+                    "observation_time": "2025-01-11T17:06:00Z",
+                    "forecast_time": "2025-01-11T18:06:00Z",
+                    "probability": 30,
+                },
+            ],
+        }
+
+        ct = setup_city(client, city)
+        res = client.get(
+            "/api/v1/aurora-history",
+            params={"city_id": ct["id"], "end": "2025-01-11T19:00:00Z"},
+        )
+        assert res.status_code == 200
+        assert res.json()["lat"] == round(city.lat)
+        assert len(res.json()["points"]) == 3
+
+        res = client.get("/api/v1/aurora-history", params={"city_id": 100})
+        assert res.status_code == 404
+        res = client.get("/api/v1/aurora-history", params={"lat": 69})
+        assert res.status_code == 400
+        res = client.get(
+            "/api/v1/aurora-history",
+            params={**params, "start": "2024-01-01T00:00:00Z"},
+        )
+        assert res.status_code == 400
+    finally:
+        app.dependency_overrides.pop(use_aurora_archive)
+
+
+@pytest.mark.asyncio
+@init_memory_sqlite()
+async def test_cities_probability(
+    client: TestClient, city: CityIn, aurora_grid: OvationGrid
+):
+    ids = []
+    for c in (CityIn(name="Murmansk", lat=68.9, long=33.2), city):
+        res = client.post(
+            "/api/v1/new-city", json=c.model_dump(), auth=admin_auth
+        )
+        assert res.status_code == 200
+        ids.append(res.json()["id"])
+
+    res = client.get("/api/v1/cities-probability")
+    assert res.status_code == 200
+    assert res.json() == {
+        "observation_time": "2025-01-11T15:06:00Z",
+        "forecast_time": "2025-01-11T16:06:00Z",
+        "cities": [
+            {"city_id": ids[0], "probability": 40},
+            {"city_id": ids[1], "probability": 0},
+        ],
+    }
+    etag = res.headers["etag"]
+
+    res = client.delete(f"/api/v1/city/{ids[1]}", auth=admin_auth)
+    assert res.status_code == 200
+    res = client.get(
+        "/api/v1/cities-probability", headers={"If-None-Match": etag}
+    )
+    assert res.status_code == 200
+    assert res.json()["cities"] == [{"city_id": ids[0], "probability": 40}]
+
+
+@pytest.mark.asyncio
+@init_memory_sqlite()
+async def test_nearest_cities(client: TestClient):
+    for c in (
+        CityIn(name="Murmansk", lat=68.9, long=33.1),
+        CityIn(name="Kirovsk", lat=67.6, long=33.7),
+        CityIn(name="Kirov", lat=58.6, long=49.6),
+    ):
+        res = client.post(
+            "/api/v1/new-city", json=c.model_dump(), auth=admin_auth
+        )
+        assert res.status_code == 200
+
+    res = client.get(
+        "/api/v1/nearest-cities", params={"lat": 68.5, "lon": 33.3, "k": 2}
+    )
+    assert res.status_code == 200
+    r = res.json()
+    assert [c["city"]["name"] for c in r] == ["Murmansk", "Kirovsk"]
+    assert 40 < r[0]["distance"] < 50
+
+    res = client.get("/api/v1/nearest-cities", params={"lat": 91, "lon": 0})
+    assert res.status_code == 422
+
+
+def test_aurora_model_map(client: TestClient):
+    time_tag = datetime(2025, 1, 11, 15, 0)
+    feeds = (
+        swpc_req.SwpcDstReq(dst=-60, time_tag=time_tag),
+        swpc_req.SwpcBzReq(bz_gsm=-5, bz_gse=-5, time_tag=time_tag),
+        swpc_req.SwpcKpReq(kp_index=6, time_tag=time_tag),
+    )
+    app.dependency_overrides[swpc_req.use_swpc_feeds] = lambda: feeds
+    try:
+        res = client.get(
+            "/api/v1/aurora-model-map",
+            params={"lat_min": 60, "lat_max": 60, "clouds": 0},
+        )
+        assert res.status_code == 200
+        r = res.json()
+        assert r["Observation Time"] == "2025-01-11T15:00:00Z"
+        assert len(r["coordinates"]) == 360
+        assert {c[2] for c in r["coordinates"]} == {100}
+
+        res = client.get("/api/v1/aurora-model-map", params={"clouds": 101})
+        assert res.status_code == 422
+    finally:
+        app.dependency_overrides.pop(swpc_req.use_swpc_feeds)
+
+
+def test_aurora_tiles(client: TestClient, aurora_grid: OvationGrid):
+    res = client.get("/api/v1/aurora-tiles/1/1/0.png")
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "image/png"
+    assert res.content.startswith(b"\x89PNG")
+    assert "content-encoding" not in res.headers
+    res = client.get(
+        "/api/v1/aurora-tiles/1/1/0.png",
+        headers={"If-None-Match": res.headers["etag"]},
+    )
+    assert res.status_code == 304
+
+    res = client.get("/api/v1/aurora-tiles/1/2/0.png")
+    assert res.status_code == 404
+    res = client.get("/api/v1/aurora-tiles/20/0/0.png")
+    assert res.status_code == 422
+
+
+def test_cloud_map(
+    client: TestClient, tmp_path, monkeypatch: pytest.MonkeyPatch
+):
+    calls: list[TileKey] = []
+
+    # left half is white, right half is black
+    cloud = encode_png(4, [b"\xff" * 8 + b"\x00" * 8] * 4)
+
+    async def fetch(key: TileKey) -> bytes:
+        calls.append(key)
+        return cloud
+
+    tiles = openweather_req.cloud_tiles
+    monkeypatch.setattr(tiles, "store", TileStore(tmp_path))
+    monkeypatch.setattr(tiles, "_fetch", fetch)
+    tiles.memory.clear()
+    openweather_req.cloud_pyramid.invalidate()
+    res = client.get("/api/v1/cloud-map/3/1/2")
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "image/png"
+    assert res.content == cloud
+    res = client.get(
+        "/api/v1/cloud-map/3/1/2",
+        headers={"If-None-Match": res.headers["etag"]},
+    )
+    assert res.status_code == 304
+
+    # z=4 tile is the upscaled right half of its z=3 parent
+    res = client.get("/api/v1/cloud-map/4/3/4")
+    assert res.status_code == 200
+    assert decode_png(res.content) == (4, [b"\x00" * 16] * 4)
+    assert calls == [(3, 1, 2)]
+    assert openweather_req.cloud_pyramid.counts() == (0, 1)
+
+    # webp capable clients get a palette png
+    variants = TileVariants("test", tmp_path, max_bytes=1024 * 1024)
+    monkeypatch.setattr(openweather_req.cloud_pyramid, "variants", variants)
+    for url in ("/api/v1/cloud-map/3/1/2", "/api/v1/cloud-map/4/3/4"):
+        res = client.get(url, headers={"Accept": "image/webp,*/*"})
+        assert res.status_code == 200
+        assert res.headers["content-type"] == "image/png"
+        assert "Accept" in res.headers["vary"]
+    assert variants.counts() == (0, 1)
+    tiles.memory.clear()
+    openweather_req.cloud_pyramid.invalidate()
+
+    res = client.get("/api/v1/cloud-map/3/8/0")
+    assert res.status_code == 404
+    res = client.get("/api/v1/cloud-map/11/0/0")
+    assert res.status_code == 422
+
+
+def test_osm_tile_proxy(client: TestClient):
+    res = client.get("/api/v1/proxy/osm-tile-map/1/2/0.png")
+    assert res.status_code == 404
+    res = client.get("/api/v1/proxy/osm-tile-map/20/0/0.png")
+    assert res.status_code == 422
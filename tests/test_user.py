@@ -46,3 +46,37 @@ async def test_get_user(client: TestClient, user: CustIn, city: CityIn):
     assert r["locale"] == user.locale
     assert r["token"] == user.token
     assert res.status_code == 200
+
+
+@pytest.mark.asyncio
+@init_memory_sqlite()
+async def test_new_user_nearest_city(client: TestClient, city: CityIn):
+    setup_city(client, city)
+    user = CustIn(
+        current_geo_lat=10.3,
+        current_geo_long=9.8,
+        locale="ru",
+        token="test",
+    )
+    res = client.post("/api/v1/new-user", json=user.model_dump())
+    assert res.status_code == 200
+    assert res.json()["city_id"] == 1
+
+    far_user = CustIn(current_geo_lat=60, current_geo_long=30, token="test2")
+    res = client.post("/api/v1/new-user", json=far_user.model_dump())
+    assert res.status_code == 200
+    assert res.json()["city_id"] is None
+
+
+@pytest.mark.asyncio
+@init_memory_sqlite()
+async def test_mod_user_nearest_city(client: TestClient, city: CityIn):
+    setup_user(client, CustIn(token="test"), city)
+    res = client.put(
+        "/api/v1/mod-user/1",
+        json={"current_geo_lat": 10.1, "current_geo_long": 10.2},
+        auth=user_auth,
+    )
+    assert res.status_code == 200
+    assert res.json()["city_id"] == 1
+    assert res.json()["current_geo_lat"] == 10.1